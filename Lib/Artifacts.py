@@ -0,0 +1,359 @@
+import logging
+import contextlib
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# local sha256 sums, see Sha256Cache
+SHA256_CACHE_FILE = 'sha256cache.json'
+HASH_BLOCK_SIZE = 1024 * 1024
+# per-upload progress records, see UploadProgress
+UPLOAD_PROGRESS_DIR = 'uploadProgress'
+# local copies of build share artifacts, see ArtifactCache
+ARTIFACT_CACHE_DIR = 'artifactCache'
+ARTIFACT_CACHE_SIZE = 20 * 1024 ** 3
+ARTIFACT_CACHE_INDEX = 'index.json'
+# seconds between checks of the build share for new builds, see ArtifactPrefetcher
+PREFETCH_INTERVAL = 300
+
+class ArtifactVerificationError(Exception):
+    """file on device doesn't match the local artifact it was uploaded from"""
+
+
+class FileLock:
+    """
+    exclusive lock on lockFile between processes (and threads), for read-modify-write of a json file
+    shared by concurrent regr.py runs (fleet.py), released by the OS if the holder dies
+    """
+
+    def __init__(self, lockFile: str):
+        self._lockFile = lockFile
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self._lockFile, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    # gives up after 10s of retrying, keep on waiting
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+
+def sha256_file(path: str) -> str:
+    '''hex sha256 of file contents'''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Sha256Cache:
+    """
+    sha256 sums of local files, remembered in a json file across runs
+    an entry is reused as long as the file's size and mtime are unchanged,
+    so multi-hundred-MB artifacts on the build share get hashed once
+    the json file is shared by concurrent regr.py runs, entries are added to what's on disk under a lock file
+    """
+
+    def __init__(self, cacheFile: str = SHA256_CACHE_FILE):
+        self._cacheFile = cacheFile
+        self._entries = self._load()
+
+    def _load(self) -> dict:
+        if os.path.exists(self._cacheFile):
+            try:
+                with open(self._cacheFile, 'rt') as f:
+                    return json.load(f)
+            except ValueError:
+                logging.warning(f'Ignoring corrupt hash cache {self._cacheFile}')
+        return {}
+
+    def peek(self, path: str) -> str:
+        '''cached sha256 of file, None if not known (or file changed since), never reads the file'''
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        entry = self._entries.get(key)
+        if not self._matches(entry, stat):
+            # another process may have hashed it since
+            self._entries = self._load()
+            entry = self._entries.get(key)
+        return entry['sha256'] if self._matches(entry, stat) else None
+
+    @staticmethod
+    def _matches(entry: dict, stat: os.stat_result) -> bool:
+        return entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+    def put(self, path: str, sha256: str):
+        '''records sha256 of file computed elsewhere (e.g. while streaming it)'''
+        stat = os.stat(path)
+        with FileLock(self._cacheFile + '.lock'):
+            # what other processes saved since it was read, plus this entry
+            self._entries = self._load()
+            self._entries[os.path.abspath(path)] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+            self._save()
+
+    def get(self, path: str) -> str:
+        sha256 = self.peek(path)
+        if sha256 is not None:
+            return sha256
+        logging.info(f'Computing sha256 of {path}')
+        sha256 = sha256_file(path)
+        self.put(path, sha256)
+        return sha256
+
+    def _save(self):
+        # write then rename, other regr processes may be reading it
+        tmpFile = self._cacheFile + f'.{os.getpid()}.tmp'
+        with open(tmpFile, 'wt') as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmpFile, self._cacheFile)
+
+
+class UploadProgress:
+    """
+    per-chunk progress of an upload to a device, kept on local disk so that
+    the upload can resume after a dropped connection, or in a later run
+    """
+
+    def __init__(self, IP: str, remoteFile: str, progressDir: str = UPLOAD_PROGRESS_DIR):
+        self._progressDir = progressDir
+        self._path = os.path.join(progressDir, re.sub(r'[^\w.-]', '_', f'{IP}_{remoteFile}') + '.json')
+
+    def load(self) -> dict:
+        '''recorded progress, None if nothing recorded'''
+        if not os.path.exists(self._path):
+            return None
+        try:
+            with open(self._path, 'rt') as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def save(self, sha256: str, size: int, offset: int, chunkLength: int, chunkSha256: str):
+        '''
+        records offset reached uploading a file of given size/sha256,
+        along with the length/sha256 of the last chunk to verify it on the device before resuming
+        '''
+        os.makedirs(self._progressDir, exist_ok=True)
+        with open(self._path, 'wt') as f:
+            json.dump({'sha256': sha256, 'size': size, 'offset': offset,
+                       'chunkLength': chunkLength, 'chunkSha256': chunkSha256}, f)
+
+    def clear(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class ArtifactCache:
+    """
+    local copies of artifacts on the build share, uploads read from local disk instead of the share
+    an entry is valid as long as the share file's size/mtime are unchanged and the local copy checks out:
+    same size/mtime as when it was copied, otherwise its sha256 is checked again
+    least recently used entries are evicted once the cache grows past maxSize
+    the index is shared with other processes (prefetch.py, concurrent regr.py runs), updated under a lock file
+    """
+
+    def __init__(self, cacheDir: str = ARTIFACT_CACHE_DIR, maxSize: int = ARTIFACT_CACHE_SIZE, hashCache: Sha256Cache = None):
+        self._cacheDir = cacheDir
+        self._maxSize = maxSize
+        self._hashCache = hashCache if hashCache is not None else Sha256Cache()
+        self._indexFile = os.path.join(cacheDir, ARTIFACT_CACHE_INDEX)
+        # prefetcher thread and uploads may use the same instance
+        self._lock = threading.RLock()
+        os.makedirs(cacheDir, exist_ok=True)
+
+    @staticmethod
+    def from_config(config):
+        '''cache as set up in a device's INI file (ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_SIZE_GB), defaults otherwise'''
+        sizeGB = config.get('ARTIFACT_CACHE_SIZE_GB')
+        return ArtifactCache(config.get('ARTIFACT_CACHE_DIR', ARTIFACT_CACHE_DIR),
+                             int(float(sizeGB) * 1024 ** 3) if sizeGB else ARTIFACT_CACHE_SIZE)
+
+    def _loadIndex(self) -> dict:
+        # read every time, other processes (prefetch.py, other regr runs) share the cache
+        if os.path.exists(self._indexFile):
+            try:
+                with open(self._indexFile, 'rt') as f:
+                    return json.load(f)
+            except ValueError:
+                logging.warning(f'Ignoring corrupt artifact cache index {self._indexFile}')
+        return {}
+
+    def _saveIndex(self, index: dict):
+        tmpFile = self._indexFile + f'.{os.getpid()}.tmp'
+        with open(tmpFile, 'wt') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmpFile, self._indexFile)
+
+    @contextlib.contextmanager
+    def _updatingIndex(self):
+        '''index as on disk, saved when the with block is done, no other process updates it meanwhile'''
+        with self._lock, FileLock(self._indexFile + '.lock'):
+            index = self._loadIndex()
+            yield index
+            self._saveIndex(index)
+
+    def _valid(self, entry: dict, sourcePath: str) -> bool:
+        try:
+            source = os.stat(sourcePath)
+            if source.st_size != entry['size'] or source.st_mtime != entry['mtime']:
+                return False
+        except OSError:
+            # share not reachable, the local copy is still what was there
+            pass
+        localPath = os.path.join(self._cacheDir, entry['file'])
+        if not os.path.exists(localPath):
+            return False
+        local = os.stat(localPath)
+        if local.st_size != entry['size']:
+            return False
+        if local.st_mtime != entry['localMtime']:
+            logging.info(f'{localPath} touched since cached, checking sha256')
+            return sha256_file(localPath) == entry['sha256']
+        return True
+
+    def lookup(self, sourcePath: str) -> str:
+        '''local copy of sourcePath, None if not cached (or no longer valid)'''
+        key = os.path.abspath(sourcePath)
+        # checked without holding the lock file, it may take hashing the local copy
+        entry = self._loadIndex().get(key)
+        if entry is None or not self._valid(entry, sourcePath):
+            return None
+        with self._updatingIndex() as index:
+            if key in index:
+                index[key]['lastUsed'] = time.time()
+        return os.path.join(self._cacheDir, entry['file'])
+
+    def fetch(self, sourcePath: str) -> str:
+        '''local copy of sourcePath, copied from the share first if not cached'''
+        localPath = self.lookup(sourcePath)
+        if localPath is not None:
+            return localPath
+        with self._lock:
+            key = os.path.abspath(sourcePath)
+            source = os.stat(sourcePath)
+            # unique per source path, readable in a directory listing
+            fileName = re.sub(r'[^\w.-]', '_', os.path.splitdrive(key)[1]).strip('_')
+            localPath = os.path.join(self._cacheDir, fileName)
+            tmpPath = localPath + f'.{os.getpid()}.tmp'
+            logging.info(f'Caching {sourcePath} ({source.st_size} bytes)')
+            sha = hashlib.sha256()
+            with open(sourcePath, 'rb') as src, open(tmpPath, 'wb') as dst:
+                for block in iter(lambda: src.read(HASH_BLOCK_SIZE), b''):
+                    sha.update(block)
+                    dst.write(block)
+            sha256 = sha.hexdigest()
+            # the share file must not have changed under the copy, and the copy must read back the same
+            if os.stat(sourcePath).st_mtime != source.st_mtime or os.path.getsize(tmpPath) != source.st_size \
+                    or sha256_file(tmpPath) != sha256:
+                os.remove(tmpPath)
+                raise ArtifactVerificationError(f'Copy of {sourcePath} does not match the original')
+            os.replace(tmpPath, localPath)
+            with self._updatingIndex() as index:
+                index[key] = {'file': fileName, 'size': source.st_size, 'mtime': source.st_mtime,
+                              'localMtime': os.stat(localPath).st_mtime, 'sha256': sha256, 'lastUsed': time.time()}
+                self._evict(index, keep=key)
+            # uploads hash the file they send, no need to read it again for that
+            self._hashCache.put(localPath, sha256)
+            return localPath
+
+    def _evict(self, index: dict, keep: str):
+        total = sum(entry['size'] for entry in index.values())
+        for (key, entry) in sorted(index.items(), key=lambda item: item[1]['lastUsed']):
+            if total <= self._maxSize:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(os.path.join(self._cacheDir, entry['file']))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # e.g. being uploaded by another process (Windows), try again next time
+                logging.warning(f'Could not evict {entry["file"]}: {e}')
+                continue
+            logging.info(f'Evicted {entry["file"]} from artifact cache')
+            total -= entry['size']
+            del index[key]
+
+    def local_path(self, sourcePath: str) -> str:
+        '''path to upload sourcePath from: the local copy, or sourcePath itself if it can't be cached'''
+        try:
+            return self.fetch(sourcePath)
+        except (OSError, ArtifactVerificationError) as e:
+            logging.warning(f'Artifact cache unavailable for {sourcePath} ({e}), using the share')
+            return sourcePath
+
+
+class ArtifactPrefetcher(threading.Thread):
+    """
+    copies the latest rel/dev artifacts of the given devices (regular and test variants) into an ArtifactCache
+    as soon as they show up on the build share, so regr.py finds them on local disk
+    """
+
+    def __init__(self, cache: ArtifactCache, configs: dict, interval: float = PREFETCH_INTERVAL):
+        '''configs - DEVICE -> Config'''
+        super().__init__(name='ArtifactPrefetcher', daemon=True)
+        self._cache = cache
+        self._configs = configs
+        self._interval = interval
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    @staticmethod
+    def latest_artifacts(device: str, config) -> list:
+        '''latest rel/dev artifacts of device found on the share, test variants included'''
+        config.refresh_build_lists()
+        menderPath = config.get_rel_build_menderUpdate_path()
+        updateDevicePath = config.get_dev_build_updateDevice_path()
+        candidates = [menderPath, menderPath + f'.T{device}', updateDevicePath, updateDevicePath + f'_T{device}']
+        return [path for path in candidates if os.path.exists(path)]
+
+    def prefetch_once(self):
+        for (device, config) in self._configs.items():
+            try:
+                paths = self.latest_artifacts(device, config)
+            except (OSError, IndexError) as e:
+                logging.warning(f'{device}: could not list builds ({e})')
+                continue
+            for path in paths:
+                if self._stopping.is_set():
+                    return
+                try:
+                    self._cache.fetch(path)
+                except (OSError, ArtifactVerificationError) as e:
+                    logging.warning(f'Prefetch of {path} failed ({e}), retrying next round')
+
+    def run(self):
+        while not self._stopping.is_set():
+            self.prefetch_once()
+            self._stopping.wait(self._interval)
@@ -0,0 +1,48 @@
+import logging
+from typing import NamedTuple
+from utils import *
+
+class BisectResult(NamedTuple):
+    # first build that failed, right after lastGood (apart from untestable builds)
+    firstBad: str
+    lastGood: str
+    # version -> True (good), False (bad), None (could not be tested, e.g. install failed)
+    tested: dict
+    # builds between lastGood and firstBad that could not be tested, any of them may be the first bad one
+    untestable: list
+
+
+def bisect_builds(builds: list, good: str, bad: str, isGood) -> BisectResult:
+    '''
+    binary search for the first bad build between a known good and a known bad one
+    builds - build versions, any order, must include good and bad
+    isGood(version) - installs/checks version, returns True/False, or None if the build can't be tested
+    takes about log2(number of builds between good and bad) calls to isGood
+    '''
+    builds = sorted(builds, key=version_sort_key)
+    if not second_build_is_newer(good, bad):
+        raise ValueError(f'Good build {good} must be older than bad build {bad}')
+    low = builds.index(good)
+    high = builds.index(bad)
+    tested = {}
+    # between low and high, not testable
+    skipped = set()
+    while True:
+        candidates = [i for i in range(low + 1, high) if i not in skipped]
+        if len(candidates) == 0:
+            break
+        # untested build closest to the middle
+        middle = (low + high) // 2
+        index = min(candidates, key=lambda i: abs(i - middle))
+        logging.info(f'Bisecting: {high - low - 1} builds left between {builds[low]} and {builds[high]}, '
+                     f'testing {builds[index]}')
+        result = isGood(builds[index])
+        tested[builds[index]] = result
+        if result is None:
+            logging.warning(f'Build {builds[index]} could not be tested, skipping it')
+            skipped.add(index)
+        elif result:
+            low = index
+        else:
+            high = index
+    return BisectResult(builds[high], builds[low], tested, [builds[i] for i in sorted(skipped) if low < i < high])
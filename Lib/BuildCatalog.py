@@ -0,0 +1,136 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from utils import *
+
+logger = None
+
+# catalog database, shared by all processes on the host
+BUILD_CATALOG_FILE = 'buildCatalog.db'
+# build folders without their artifact (yet) are looked at again while younger than this
+PENDING_RECHECK_SECONDS = 2 * 24 * 3600
+# builds written to the catalog per transaction while scanning
+WRITE_BATCH = 50
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS roots (root TEXT PRIMARY KEY, mtime INTEGER);
+CREATE TABLE IF NOT EXISTS builds (root TEXT, version TEXT, sortKey REAL, artifact TEXT, size INTEGER, mtime REAL,
+                                   PRIMARY KEY (root, version));
+CREATE INDEX IF NOT EXISTS buildsBySortKey ON builds (root, sortKey);
+CREATE TABLE IF NOT EXISTS pending (root TEXT, version TEXT, firstSeen REAL, PRIMARY KEY (root, version));
+'''
+
+class BuildCatalog:
+    """
+    persistent index of the builds on the build share, one table row per build with its artifact path/size/mtime
+
+    a build root (e.g. Y:\\Orion\\Orion_Dev) is listed again only when its directory mtime changed,
+    and then only folders not seen before are looked into, so a refresh normally costs a single stat
+    folders whose artifact isn't there yet (build still running) are rechecked on every refresh for a while
+    """
+
+    def __init__(self, catalogFile: str = BUILD_CATALOG_FILE):
+        self._db = sqlite3.connect(catalogFile, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+
+    def close(self):
+        self._db.close()
+
+    def refresh(self, root: str, artifactName: str):
+        '''
+        brings the catalog up to date with root, a build is version folder root/<a.b.c.d>/Build/artifactName
+        the share is looked at outside of any transaction, results are written in short transactions
+        so other processes using the catalog aren't locked out for the length of a scan
+        '''
+        rootMtime = os.stat(root).st_mtime_ns
+        with self._lock:
+            row = self._db.execute('SELECT mtime FROM roots WHERE root = ?', (root,)).fetchone()
+        if row is None or row[0] != rootMtime:
+            self._scanRoot(root, artifactName)
+            with self._lock, self._db:
+                self._db.execute('INSERT OR REPLACE INTO roots VALUES (?, ?)', (root, rootMtime))
+        recent = time.time() - PENDING_RECHECK_SECONDS
+        with self._lock:
+            pending = [version for (version,) in self._db.execute(
+                'SELECT version FROM pending WHERE root = ? AND firstSeen > ?', (root, recent))]
+        self._checkAll(root, pending, artifactName)
+
+    def _scanRoot(self, root: str, artifactName: str):
+        listed = set(name for name in os.listdir(root) if name.split('.')[-1].isdigit())
+        with self._lock:
+            known = set(version for (version,) in self._db.execute(
+                'SELECT version FROM builds WHERE root = ? UNION SELECT version FROM pending WHERE root = ?',
+                (root, root)))
+        logger.debug(f'{root}: {len(listed - known)} new, {len(known - listed)} removed build folders')
+        with self._lock, self._db:
+            for version in known - listed:
+                self._db.execute('DELETE FROM builds WHERE root = ? AND version = ?', (root, version))
+                self._db.execute('DELETE FROM pending WHERE root = ? AND version = ?', (root, version))
+        self._checkAll(root, sorted(listed - known), artifactName)
+
+    def _checkAll(self, root: str, versions: list, artifactName: str):
+        checked = []
+        for version in versions:
+            checked.append(self._check(root, version, artifactName))
+            if len(checked) >= WRITE_BATCH:
+                self._write(root, checked)
+                checked = []
+        self._write(root, checked)
+
+    def _check(self, root: str, version: str, artifactName: str) -> tuple:
+        '''(version, artifact, stat) of build, stat None while the artifact isn't there'''
+        artifact = os.path.join(root, version, 'Build', artifactName)
+        try:
+            return (version, artifact, os.stat(artifact))
+        except FileNotFoundError:
+            return (version, artifact, None)
+
+    def _write(self, root: str, checked: list):
+        if len(checked) == 0:
+            return
+        with self._lock, self._db:
+            for (version, artifact, stat) in checked:
+                if stat is None:
+                    self._db.execute('INSERT OR IGNORE INTO pending VALUES (?, ?, ?)', (root, version, time.time()))
+                    continue
+                self._db.execute('INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?, ?)',
+                                 (root, version, version_sort_key(version), artifact, stat.st_size, stat.st_mtime))
+                self._db.execute('DELETE FROM pending WHERE root = ? AND version = ?', (root, version))
+
+    def _versions(self, query: str, args: tuple) -> list:
+        with self._lock:
+            return [version for (version,) in self._db.execute(query, args)]
+
+    def versions(self, root: str) -> list:
+        '''all builds of root, oldest first'''
+        return self._versions('SELECT version FROM builds WHERE root = ? ORDER BY sortKey', (root,))
+
+    def latest(self, root: str) -> str:
+        '''latest build of root, None if there is none'''
+        versions = self._versions('SELECT version FROM builds WHERE root = ? ORDER BY sortKey DESC LIMIT 1', (root,))
+        return versions[0] if len(versions) > 0 else None
+
+    def between(self, root: str, first: str, last: str) -> list:
+        '''builds from first to last (both included), oldest first'''
+        return self._versions('SELECT version FROM builds WHERE root = ? AND sortKey BETWEEN ? AND ? ORDER BY sortKey',
+                              (root, version_sort_key(first), version_sort_key(last)))
+
+    def previous(self, root: str, version: str, n: int = 1) -> str:
+        '''nth build before version, None if there aren't that many'''
+        versions = self._versions(
+            'SELECT version FROM builds WHERE root = ? AND sortKey < ? ORDER BY sortKey DESC LIMIT 1 OFFSET ?',
+            (root, version_sort_key(version), n - 1))
+        return versions[0] if len(versions) > 0 else None
+
+    def artifact(self, root: str, version: str):
+        '''(artifact path, size, mtime) of build, None if not in the catalog'''
+        with self._lock:
+            return self._db.execute('SELECT artifact, size, mtime FROM builds WHERE root = ? AND version = ?',
+                                    (root, version)).fetchone()
@@ -0,0 +1,188 @@
+import logging
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import NamedTuple
+from Lib.Config import Config
+from utils import *
+
+logger = None
+
+# seconds between looks at the build share (a look is normally one stat per build root, see BuildCatalog)
+WATCH_INTERVAL = 60
+# an artifact is complete once its size and mtime stayed the same this long
+STABLE_SECONDS = 120
+# last build triggered per build root, so a restart doesn't trigger them again
+WATCHER_STATE_FILE = 'buildWatcher.json'
+
+class BuildJob(NamedTuple):
+    device: str
+    # 'dev' or 'rel'
+    kind: str
+    version: str
+
+
+class BuildWatcher(threading.Thread):
+    """
+    watches the dev/rel build roots of the given devices for new builds and hands a BuildJob per device
+    to runJob once the build's artifacts (regular and the device's test variant) are complete and stable
+    builds already on the share when first started are taken as tested
+    """
+
+    def __init__(self, configs: dict, runJob, interval: float = WATCH_INTERVAL, stableSeconds: float = STABLE_SECONDS,
+                 stateFile: str = WATCHER_STATE_FILE):
+        '''configs - DEVICE -> Config, runJob - called with each BuildJob'''
+        super().__init__(name='BuildWatcher', daemon=True)
+        self._configs = configs
+        self._runJob = runJob
+        self._interval = interval
+        self._stableSeconds = stableSeconds
+        self._stateFile = stateFile
+        self._stopping = threading.Event()
+        # artifact path -> (size, mtime, time first seen at that size/mtime)
+        self._seen = {}
+        self._lastTriggered = {}
+        if os.path.exists(stateFile):
+            with open(stateFile, 'rt') as f:
+                self._lastTriggered = json.load(f)
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+
+    def stop(self):
+        self._stopping.set()
+
+    def _roots(self) -> dict:
+        '''(build root, kind) -> (config to query it with, [devices using it])'''
+        roots = {}
+        for (device, config) in self._configs.items():
+            for (root, kind) in ((config.dev_build_root, 'dev'), (config.rel_build_root, 'rel')):
+                roots.setdefault((root, kind), (config, []))[1].append(device)
+        return roots
+
+    def _artifacts(self, config: Config, kind: str, version: str, devices: list) -> list:
+        '''artifacts regr.py may install from build version, test variants only where they exist'''
+        if kind == 'dev':
+            path = config.get_dev_build_updateDevice_path(version)
+            variants = [path + f'_T{device}' for device in devices]
+        else:
+            path = config.get_rel_build_menderUpdate_path(version)
+            variants = [path + f'.T{device}' for device in devices]
+        return [path] + [variant for variant in variants if os.path.exists(variant)]
+
+    def _stable(self, paths: list, now: float) -> bool:
+        stable = True
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            seen = self._seen.get(path)
+            if seen is None or seen[:2] != (stat.st_size, stat.st_mtime):
+                # new, or still being written
+                self._seen[path] = (stat.st_size, stat.st_mtime, now)
+                stable = False
+            elif now - seen[2] < self._stableSeconds:
+                stable = False
+        return stable
+
+    def _saveState(self):
+        tmpFile = self._stateFile + '.tmp'
+        with open(tmpFile, 'wt') as f:
+            json.dump(self._lastTriggered, f, indent=1)
+        os.replace(tmpFile, self._stateFile)
+
+    def poll_once(self, now: float = None) -> list:
+        '''looks for new complete builds, returns the BuildJobs for them (runJob is not called)'''
+        now = time.time() if now is None else now
+        jobs = []
+        for ((root, kind), (config, devices)) in self._roots().items():
+            config.refresh_build_lists()
+            versions = config.get_dev_build_list() if kind == 'dev' else config.get_rel_build_list()
+            if len(versions) == 0:
+                continue
+            last = self._lastTriggered.get(root)
+            if last is None:
+                logger.info(f'{root}: starting from build {versions[-1]}')
+                self._lastTriggered[root] = versions[-1]
+                self._saveState()
+                continue
+            # newest first, one regression run covers all builds up to the latest complete one
+            for version in reversed([v for v in versions if second_build_is_newer(last, v)]):
+                if self._stable(self._artifacts(config, kind, version, devices), now):
+                    logger.info(f'New {kind} build {version} complete in {root}')
+                    jobs += [BuildJob(device, kind, version) for device in devices]
+                    self._lastTriggered[root] = version
+                    self._saveState()
+                    break
+        return jobs
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                [self._runJob(job) for job in self.poll_once()]
+            except OSError as e:
+                # share unreachable, try again next round
+                logger.warning(f'Build share not accessible: {e}')
+            self._stopping.wait(self._interval)
+
+
+class RegressionRunner:
+    """
+    runs regr.py for devices, one run at a time per device (a rig can only do one install at a time)
+    jobs arriving for a device while it is busy are coalesced: regr.py installs the latest builds anyway,
+    so one more run after the current one covers them all
+    """
+
+    def __init__(self, regrArgs: dict = None, logDir: str = 'log', regrScript: str = None):
+        '''regrArgs - DEVICE -> extra regr.py arguments (e.g. ['-s', 'COM4', '--ntp', 'off'])'''
+        self._regrArgs = regrArgs if regrArgs is not None else {}
+        self._logDir = logDir
+        self._regrScript = regrScript if regrScript is not None else \
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'regr.py')
+        self._lock = threading.Lock()
+        # device -> jobs waiting
+        self._pending = {}
+        self._workers = {}
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+
+    def submit(self, job: BuildJob):
+        with self._lock:
+            self._pending.setdefault(job.device, []).append(job)
+            worker = self._workers.get(job.device)
+            if worker is None or not worker.is_alive():
+                worker = threading.Thread(target=self._work, args=(job.device,), name=f'Regression-{job.device}', daemon=True)
+                self._workers[job.device] = worker
+                worker.start()
+
+    def command(self, device: str) -> list:
+        return [sys.executable, self._regrScript] + list(self._regrArgs.get(device, [])) + [device]
+
+    def _work(self, device: str):
+        while True:
+            with self._lock:
+                jobs = self._pending.pop(device, [])
+                if len(jobs) == 0:
+                    del self._workers[device]
+                    return
+            builds = ', '.join(f'{job.kind} {job.version}' for job in jobs)
+            os.makedirs(self._logDir, exist_ok=True)
+            logFile = os.path.join(self._logDir, f'watcher_{device}_{time.strftime("%Y%m%d-%H%M%S")}.log')
+            logger.info(f'{device}: starting regression for {builds}, output in {logFile}')
+            with open(logFile, 'wt') as log:
+                exitCode = subprocess.run(self.command(device), stdout=log, stderr=subprocess.STDOUT).returncode
+            logger.info(f'{device}: regression for {builds} finished with exit code {exitCode}')
+
+    def wait(self):
+        '''blocks until all submitted jobs are done'''
+        while True:
+            with self._lock:
+                workers = list(self._workers.values())
+            if len(workers) == 0:
+                return
+            [worker.join() for worker in workers]
@@ -0,0 +1,15 @@
+from typing import NamedTuple
+
+class CommandResult(NamedTuple):
+    """outcome of a single command executed on the device"""
+
+    # output lines of the command
+    stdout: list
+    # exit status, None if the command didn't finish in time
+    exitCode: int
+    # seconds from sending the command to getting its exit status
+    elapsed: float
+
+    @property
+    def succeeded(self) -> bool:
+        return self.exitCode == 0
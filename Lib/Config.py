@@ -1,5 +1,6 @@
 import logging
 import os
+from Lib.BuildCatalog import BuildCatalog, BUILD_CATALOG_FILE
 from utils import *
 
 class Config:
@@ -22,6 +23,13 @@ class Config:
     USER='USER'
     PASSWORD='PASSWORD'
     DLOG_FOLDER='DLOG_FOLDER'
+    # optional, local artifact cache (see Lib/Artifacts.py ArtifactCache)
+    ARTIFACT_CACHE_DIR='ARTIFACT_CACHE_DIR'
+    ARTIFACT_CACHE_SIZE_GB='ARTIFACT_CACHE_SIZE_GB'
+    # optional, build catalog database (see Lib/BuildCatalog.py)
+    BUILD_CATALOG='BUILD_CATALOG'
+    # optional, yes to send updateDevice as a block delta against the last one uploaded (see Lib/DeltaUpload.py)
+    DELTA_UPLOAD='DELTA_UPLOAD'
 
     UPDATE_DEVICE_FILE='updateDevice'
     MENDER_FILE='device.mender'
@@ -39,6 +47,22 @@ class Config:
         self._REL_BUILD_PATH = lambda _buildNum: os.path.join(self._buildRoot + self._configs[Config.REL_BUILD_ROOT], _buildNum, 'Build')
         self._DEV_BUILD_LIST = None
         self._REL_BUILD_LIST = None
+        self._catalog = None
+
+    @property
+    def catalog(self) -> BuildCatalog:
+        '''persistent build index, opened on first use'''
+        if self._catalog is None:
+            self._catalog = BuildCatalog(self._configs.get(Config.BUILD_CATALOG, BUILD_CATALOG_FILE))
+        return self._catalog
+
+    @property
+    def dev_build_root(self) -> str:
+        return self._buildRoot + self._configs[Config.DEV_BUILD_ROOT]
+
+    @property
+    def rel_build_root(self) -> str:
+        return self._buildRoot + self._configs[Config.REL_BUILD_ROOT]
 
     #
     # build version strings look like a.b.c.d, with a,b,c,d integers
@@ -51,16 +75,12 @@ class Config:
     #
 
     def get_dev_build_list(self):
-        # go through the folder list
-        # extract the nnn part, take only if it's a number
-        # get folder list, 
+        # build folders (a.b.c.d) holding an updateDevice, sorted by version (latest will be last)
+        # the catalog only looks at folders it hasn't seen before
         if self._DEV_BUILD_LIST is None:
-            buildList = [ build for build in os.listdir(self._buildRoot + self._configs[Config.DEV_BUILD_ROOT]) \
-                if build.split('.')[-1].isdigit() and 
-                   os.path.exists(f'{self._DEV_BUILD_PATH(build)}{os.path.sep}updateDevice') ]
-            # sort it based on build number (digits after last period, latest will be last)
-            self._DEV_BUILD_LIST = sorted(buildList, key=version_sort_key)
-            logging.debug(buildList)
+            self.catalog.refresh(self.dev_build_root, Config.UPDATE_DEVICE_FILE)
+            self._DEV_BUILD_LIST = self.catalog.versions(self.dev_build_root)
+            logging.debug(self._DEV_BUILD_LIST)
         return self._DEV_BUILD_LIST
 
     def get_latest_dev_build_version(self) -> str:
@@ -77,11 +97,9 @@ class Config:
 
     def get_rel_build_list(self):
         if self._REL_BUILD_LIST is None:
-            buildList = [ build for build in os.listdir(self._buildRoot + self._configs[Config.REL_BUILD_ROOT]) \
-                if build.split('.')[-1].isdigit() and
-                   os.path.exists(f'{self._REL_BUILD_PATH(build)}{os.path.sep}device.mender')]
-            self._REL_BUILD_LIST = sorted(buildList, key=version_sort_key)
-            logging.debug(buildList)
+            self.catalog.refresh(self.rel_build_root, Config.MENDER_FILE)
+            self._REL_BUILD_LIST = self.catalog.versions(self.rel_build_root)
+            logging.debug(self._REL_BUILD_LIST)
         return self._REL_BUILD_LIST
 
     def get_latest_rel_build_version(self) -> str:
@@ -94,5 +112,32 @@ class Config:
             self._REL_BUILD_PATH(buildVersion),
             Config.MENDER_FILE)
 
+    def get_dev_builds_between(self, first: str, last: str) -> list:
+        self.get_dev_build_list()
+        return self.catalog.between(self.dev_build_root, first, last)
+
+    def get_previous_dev_build_version(self, buildVersion: str, n: int = 1) -> str:
+        '''nth dev build before buildVersion, None if there aren't that many'''
+        self.get_dev_build_list()
+        return self.catalog.previous(self.dev_build_root, buildVersion, n)
+
+    def get_rel_builds_between(self, first: str, last: str) -> list:
+        self.get_rel_build_list()
+        return self.catalog.between(self.rel_build_root, first, last)
+
+    def get_previous_rel_build_version(self, buildVersion: str, n: int = 1) -> str:
+        '''nth rel build before buildVersion, None if there aren't that many'''
+        self.get_rel_build_list()
+        return self.catalog.previous(self.rel_build_root, buildVersion, n)
+
+    def refresh_build_lists(self):
+        '''forget the build lists, next call lists the build share again (new builds show up)'''
+        self._DEV_BUILD_LIST = None
+        self._REL_BUILD_LIST = None
+
+    def get(self, key: str, default: str = None) -> str:
+        '''value of an optional key'''
+        return self._configs.get(key, default)
+
     def __getitem__(self, key: str) -> str:
         return self._configs[key]
\ No newline at end of file
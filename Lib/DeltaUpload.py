@@ -0,0 +1,190 @@
+import logging
+import hashlib
+import json
+import mmap
+import os
+import time
+import zlib
+
+#
+# rsync style delta transfer
+#
+# the device's copy of a file is described by per-block signatures (weak adler32 + strong md5),
+# remembered locally for every file uploaded (keyed by its sha256, see SignatureCache),
+# so nothing has to be computed on the device
+# a rolling weak checksum over the new file finds blocks the device already has at any offset,
+# the delta is a list of ops:
+#   ('C', firstBlock, count) - copy count blocks of the old file, starting at firstBlock
+#   ('L', offset, length)    - take length bytes of the literal data, starting at offset
+# and is applied on the device by PATCH_SCRIPT with plain dd/tail/head
+#
+
+BLOCK_SIZE = 64 * 1024
+# not worth a delta (fall back to full transfer) if more than this fraction of the file is new data
+MAX_LITERAL_FRACTION = 0.5
+# the byte by byte search runs at about 1MB/s, a full transfer is quicker than a delta given up on late:
+# give up once this much was scanned without finding a single block the device has (an unrelated file),
+# or once the search took MAX_DELTA_SECONDS
+MAX_UNMATCHED_SCAN = 2 * 1024 * 1024
+MAX_DELTA_SECONDS = 30
+SIGNATURE_DIR = 'signatures'
+ADLER_MOD = 65521
+
+# device side helper, args: old file, delta ops file, literal data file, new file, block size
+# every literal is read by offset with its own dd, no reader shares a file position with another
+# (BusyBox head reads ahead of what it outputs); dd reads whole blocks, tail/head cut out the bytes
+PATCH_SCRIPT = '''#!/bin/sh
+OLD=$1; DELTA=$2; LIT=$3; NEW=$4; BS=$5
+: > $NEW || exit 1
+while read op a b; do
+    case $op in
+        C) dd if=$OLD bs=$BS skip=$a count=$b 2>/dev/null >> $NEW || exit 1;;
+        L) dd if=$LIT bs=$BS skip=$((a / BS)) count=$(((a % BS + b + BS - 1) / BS)) 2>/dev/null \\
+               | tail -c +$((a % BS + 1)) | head -c $b >> $NEW || exit 1;;
+        *) exit 2;;
+    esac
+done < $DELTA
+'''
+
+
+def block_signatures(path: str, blockSize: int = BLOCK_SIZE) -> list:
+    '''[weak, strong] signature of every full block of the file (a short last block is left out)'''
+    signatures = []
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            if len(block) == blockSize:
+                signatures.append([zlib.adler32(block), hashlib.md5(block).hexdigest()])
+    return signatures
+
+
+def roll_adler32(weak: int, outByte: int, inByte: int, blockSize: int) -> int:
+    '''zlib adler32 of the window moved one byte: outByte leaves, inByte enters'''
+    a = weak & 0xffff
+    b = weak >> 16
+    a = (a - outByte + inByte) % ADLER_MOD
+    b = (b - blockSize * outByte + a - 1) % ADLER_MOD
+    return (b << 16) | a
+
+
+def compute_delta(data, signatures: list, literalOut, blockSize: int = BLOCK_SIZE,
+                  maxLiteralFraction: float = MAX_LITERAL_FRACTION, maxUnmatched: int = MAX_UNMATCHED_SCAN,
+                  maxSeconds: float = MAX_DELTA_SECONDS):
+    '''
+    data - new file content (bytes or mmap), signatures - block_signatures() of the old file
+    literal data is written to binary file literalOut as it's found, not kept in memory
+    returns ops, None if a delta isn't worth it: more than maxLiteralFraction of data would be literal,
+    no block found in the first maxUnmatched bytes, or still not done after maxSeconds
+    '''
+    index = {}
+    for (blockIndex, (weak, strong)) in enumerate(signatures):
+        index.setdefault(weak, []).append((strong, blockIndex))
+    maxLiteral = int(len(data) * maxLiteralFraction)
+    deadline = time.time() + maxSeconds
+    ops = []
+    literalSize = 0
+
+    def addLiteral(start, end):
+        nonlocal literalSize
+        if end > start:
+            literalOut.write(data[start:end])
+            ops.append(('L', literalSize, end - start))
+            literalSize += end - start
+
+    n = len(data)
+    pos = 0
+    literalStart = 0
+    matched = False
+    # bytes the window was moved by one, the slow part
+    rolled = 0
+    weak = None
+    while pos + blockSize <= n:
+        if weak is None:
+            weak = zlib.adler32(data[pos:pos + blockSize])
+        candidates = index.get(weak)
+        if candidates is not None:
+            strong = hashlib.md5(data[pos:pos + blockSize]).hexdigest()
+            match = next((blockIndex for (s, blockIndex) in candidates if s == strong), None)
+            if match is not None:
+                addLiteral(literalStart, pos)
+                if len(ops) > 0 and ops[-1][0] == 'C' and ops[-1][1] + ops[-1][2] == match:
+                    ops[-1] = ('C', ops[-1][1], ops[-1][2] + 1)
+                else:
+                    ops.append(('C', match, 1))
+                pos += blockSize
+                literalStart = pos
+                matched = True
+                weak = None
+                continue
+        if literalSize + pos - literalStart > maxLiteral:
+            return None
+        rolled += 1
+        if rolled & 0xffff == 0:
+            if not matched and pos >= maxUnmatched:
+                logging.info(f'No block in common in the first {pos} bytes, giving up on a delta')
+                return None
+            if time.time() > deadline:
+                logging.info(f'Delta not computed within {maxSeconds}s ({pos}/{n} bytes), giving up on it')
+                return None
+        if pos + blockSize < n:
+            weak = roll_adler32(weak, data[pos], data[pos + blockSize], blockSize)
+        pos += 1
+    addLiteral(literalStart, n)
+    if literalSize > maxLiteral:
+        return None
+    return ops
+
+
+def apply_delta(oldData: bytes, ops: list, literal: bytes, blockSize: int = BLOCK_SIZE) -> bytes:
+    '''local equivalent of PATCH_SCRIPT'''
+    out = bytearray()
+    for op in ops:
+        if op[0] == 'C':
+            out.extend(oldData[op[1] * blockSize:(op[1] + op[2]) * blockSize])
+        else:
+            out.extend(literal[op[1]:op[1] + op[2]])
+    return bytes(out)
+
+
+def format_ops(ops: list) -> str:
+    '''ops as read by PATCH_SCRIPT, one per line'''
+    return ''.join(' '.join(str(x) for x in op) + '\n' for op in ops)
+
+
+def delta_for_file(path: str, signatures: list, literalOut, blockSize: int = BLOCK_SIZE):
+    '''compute_delta() over a file, memory mapped rather than read in'''
+    with open(path, 'rb') as f:
+        if os.path.getsize(path) == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return compute_delta(data, signatures, literalOut, blockSize)
+
+
+class SignatureCache:
+    """block signatures of uploaded files, stored by the file's sha256"""
+
+    def __init__(self, signatureDir: str = SIGNATURE_DIR):
+        self._signatureDir = signatureDir
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self._signatureDir, sha256 + '.json')
+
+    def load(self, sha256: str, blockSize: int = BLOCK_SIZE) -> list:
+        '''signatures of the content with given sha256, None if not known'''
+        if sha256 is None or not os.path.exists(self._path(sha256)):
+            return None
+        with open(self._path(sha256), 'rt') as f:
+            entry = json.load(f)
+        if entry['blockSize'] != blockSize:
+            return None
+        return entry['blocks']
+
+    def save(self, sha256: str, path: str, blockSize: int = BLOCK_SIZE):
+        if os.path.exists(self._path(sha256)):
+            return
+        logging.info(f'Computing block signatures of {path}')
+        os.makedirs(self._signatureDir, exist_ok=True)
+        # write then rename, regr processes for other devices may be reading it
+        tmpFile = self._path(sha256) + f'.{os.getpid()}.tmp'
+        with open(tmpFile, 'wt') as f:
+            json.dump({'blockSize': blockSize, 'blocks': block_signatures(path, blockSize)}, f)
+        os.replace(tmpFile, self._path(sha256))
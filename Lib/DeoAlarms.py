@@ -0,0 +1,115 @@
+import logging
+import asyncio
+import collections
+import threading
+from typing import NamedTuple
+
+logger = None
+
+ALARM_MANAGER='AlarmManagerData'
+# _activeAlarmsList0 .. _activeAlarmsList9
+ACTIVE_ALARMS_SLOTS = 10
+# AlarmEvent kinds
+RAISED='raised'
+CLEARED='cleared'
+# events kept in AlarmTracker.history
+HISTORY_SIZE = 1000
+
+class AlarmEvent(NamedTuple):
+    kind: str
+    alarm: str
+    # device time of the DEO update the change showed up in
+    systemTime: str
+    # host time that update was received
+    receivedAt: float
+
+
+def active_alarms(alarmManager: dict) -> list:
+    '''alarms listed in AlarmManagerData._activeAlarmsList0..9, in slot order'''
+    alarms = []
+    for n in range(ACTIVE_ALARMS_SLOTS):
+        alarm = alarmManager.get(f'_activeAlarmsList{n}', '')
+        if len(alarm) > 0:
+            alarms.append(alarm)
+    return alarms
+
+
+class AlarmEventStream:
+    """
+    async iterator over the AlarmEvents of an AlarmTracker, to be created and iterated on an asyncio loop:
+        async for event in tracker.events(): ...
+    """
+
+    def __init__(self, tracker):
+        self._tracker = tracker
+        self._loop = asyncio.get_event_loop()
+        self._queue = asyncio.Queue()
+
+    def _push(self, event: AlarmEvent):
+        # called from the receiving thread
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> AlarmEvent:
+        return await self._queue.get()
+
+    def close(self):
+        self._tracker.remove_callback(self._push)
+
+
+class AlarmTracker:
+    """
+    turns DEO updates into alarm events: the active alarm list of every AlarmManagerData update is compared
+    with the previous one, each alarm appearing is RAISED, each alarm gone is CLEARED
+    nothing is missed between samples, every update is looked at as it arrives
+    events go to registered callbacks (called from the receiving thread, should be quick) and event streams
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = []
+        self._callbacks = []
+        # most recent events
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+
+    def add_callback(self, callback):
+        '''callback(AlarmEvent) for every event from now on'''
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def events(self) -> AlarmEventStream:
+        stream = AlarmEventStream(self)
+        self.add_callback(stream._push)
+        return stream
+
+    def active(self) -> list:
+        with self._lock:
+            return list(self._active)
+
+    def update(self, alarmManager: dict, systemTime: str, receivedAt: float) -> list:
+        '''AlarmManagerData structureData of a DEO update, returns the resulting events'''
+        active = active_alarms(alarmManager)
+        with self._lock:
+            events = [AlarmEvent(RAISED, alarm, systemTime, receivedAt) for alarm in active if alarm not in self._active] + \
+                     [AlarmEvent(CLEARED, alarm, systemTime, receivedAt) for alarm in self._active if alarm not in active]
+            self._active = active
+            self.history += events
+            callbacks = list(self._callbacks)
+        for event in events:
+            logger.info(f'Alarm {event.kind}: {event.alarm} (device time {event.systemTime})')
+            for callback in callbacks:
+                try:
+                    callback(event)
+                except Exception as e:
+                    logger.error(f'Alarm event callback failed: {e}')
+        return events
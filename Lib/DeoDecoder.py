@@ -0,0 +1,102 @@
+import json
+import re
+
+try:
+    # several times faster than json, optional
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+from Lib.DeoSnapshot import DEVICE_DATA_CONFIG, DEVICE_DATA, STRUCTURE_NAME, STRUCTURE_DATA, SYSTEM_TIME
+
+# what has to precede a container name for it to be one: "structureName": "<name>"
+_NAME_KEY = re.compile(r'"' + STRUCTURE_NAME + r'"\s*:\s*$')
+_NAME_KEY_LOOKBEHIND = 64
+_DATA_KEY = f'"{STRUCTURE_DATA}"'
+_SYSTEM_TIME_KEY = f'"{SYSTEM_TIME}"'
+_scanner = json.JSONDecoder()
+
+def _value_after(text: str, key: int):
+    '''decodes the JSON value following the key (a string) starting at offset key'''
+    colon = text.index(':', key)
+    start = colon + 1
+    while text[start] in ' \t\r\n':
+        start += 1
+    return _scanner.raw_decode(text, start)[0]
+
+class DeoDecoder:
+    """
+    decodes DEO messages, optionally only the containers of interest
+
+    a DeviceData message holds every container the device has, most callers only look at a few of them
+    (AlarmManagerData to watch alarms), with containers given only those are located in the message text
+    and decoded, the rest is never parsed; a message that can't be handled that way (DeviceDataConfig,
+    unexpected layout) is decoded in full and filtered
+    full decodes use orjson when installed
+    """
+
+    def __init__(self, containers: list = None):
+        '''containers - structureNames to decode, None for all'''
+        self.containers = None if containers is None else list(containers)
+
+    def decode(self, message) -> dict:
+        '''
+        message - DEO message, str or bytes
+        returns the message as json.loads would, with DeviceData holding only the containers of interest
+        (those present in the message)
+        raises ValueError if message isn't valid JSON
+        '''
+        if self.containers is not None:
+            if isinstance(message, bytes):
+                message = message.decode()
+            deoJson = self._decode_selected(message)
+            if deoJson is not None:
+                return deoJson
+        deoJson = _loads(message)
+        if self.containers is not None and DEVICE_DATA in deoJson:
+            deoJson[DEVICE_DATA] = [container for container in deoJson[DEVICE_DATA]
+                                    if container[STRUCTURE_NAME] in self.containers]
+        return deoJson
+
+    def _decode_selected(self, text: str) -> dict:
+        '''None if text can't be decoded selectively'''
+        if DEVICE_DATA_CONFIG in text or DEVICE_DATA not in text:
+            return None
+        try:
+            # (position, container), kept in message order
+            containers = sorted(found for found in (self._container(text, name) for name in self.containers) if found is not None)
+            deoJson = {DEVICE_DATA: [container for (pos, container) in containers]}
+            # top level systemTime follows DeviceData
+            systemTime = text.rfind(_SYSTEM_TIME_KEY)
+            if systemTime >= 0:
+                deoJson[SYSTEM_TIME] = _value_after(text, systemTime)
+        except (ValueError, IndexError):
+            return None
+        return deoJson
+
+    def _container(self, text: str, name: str) -> tuple:
+        '''
+        (position, container name) located in text, None if it isn't in there
+        raises ValueError if its layout is unexpected
+        '''
+        quotedName = f'"{name}"'
+        pos = text.find(quotedName)
+        while pos >= 0 and _NAME_KEY.search(text, max(0, pos - _NAME_KEY_LOOKBEHIND), pos) is None:
+            pos = text.find(quotedName, pos + 1)
+        if pos < 0:
+            return None
+        # {"structureData": {...}, "structureName": "<name>"} or the other way round
+        end = pos + len(quotedName)
+        while text[end] in ' \t\r\n':
+            end += 1
+        if text[end] == '}':
+            dataKey = text.rfind(_DATA_KEY, 0, pos)
+        elif text[end] == ',':
+            dataKey = text.find(_DATA_KEY, end)
+        else:
+            raise ValueError(f'unexpected DEO container layout at {end}')
+        if dataKey < 0:
+            raise ValueError(f'no {STRUCTURE_DATA} for {name}')
+        return (pos, {STRUCTURE_DATA: _value_after(text, dataKey), STRUCTURE_NAME: name})
@@ -0,0 +1,80 @@
+import logging
+import gzip
+import json
+import threading
+import time
+import zlib
+
+logger = None
+
+# seconds between flushes of the compressed stream, at most this much is lost if the recording process dies
+FLUSH_INTERVAL = 10
+
+class DeoRecorder:
+    """
+    records DEO messages to a gzip compressed NDJSON file, a line per message as received:
+        {"receivedAt": <host time>, "message": "<DEO message text>"}
+    recordings are read back by read_recording(), played back by DeoReplayServer
+    """
+
+    def __init__(self, recordingFile: str):
+        self.recordingFile = recordingFile
+        self._lock = threading.Lock()
+        self._file = gzip.open(recordingFile, 'wt', encoding='utf-8')
+        self._lastFlush = time.time()
+        self.count = 0
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+        logger.info(f'Recording DEO messages to {recordingFile}')
+
+    def record(self, message: str, receivedAt: float = None):
+        if receivedAt is None:
+            receivedAt = time.time()
+        line = json.dumps({'receivedAt': receivedAt, 'message': message}) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self.count += 1
+            if receivedAt - self._lastFlush >= FLUSH_INTERVAL:
+                # sync flush, what's written so far can be decompressed even if the file is never closed
+                self._file.flush()
+                self._file.buffer.flush(zlib.Z_SYNC_FLUSH)
+                self._lastFlush = receivedAt
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                logger.info(f'Recorded {self.count} DEO messages to {self.recordingFile}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_recording(recordingFile: str):
+    '''
+    yields (receivedAt, message) of a DeoRecorder recording in order
+    a recording cut short (recorder never closed) is read up to its last complete line
+    '''
+    with gzip.open(recordingFile, 'rt', encoding='utf-8') as f:
+        while True:
+            try:
+                line = f.readline()
+            except (EOFError, zlib.error):
+                logging.warning(f'{recordingFile} is truncated, replaying what was recorded')
+                return
+            if len(line) == 0:
+                return
+            try:
+                frame = json.loads(line)
+            except ValueError:
+                # the partial last line of a truncated recording
+                logging.warning(f'{recordingFile}: ignoring incomplete line {line[:80]}...')
+                return
+            yield (frame['receivedAt'], frame['message'])
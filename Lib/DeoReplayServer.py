@@ -0,0 +1,115 @@
+import logging
+import asyncio
+import threading
+from aiohttp import web, WSMsgType
+from Lib.DeoRecorder import read_recording
+from Lib.DeoWebSocket import DEO_PORT
+
+logger = None
+
+START_TIMEOUT = 30
+
+class DeoReplayServer:
+    """
+    local DEO WebSocket server playing back a DeoRecorder recording, so DeoWebSocket and whatever sits on
+    top of it (alarm polling, container reads) can be run and load tested without a device
+
+    every client connecting gets the whole recording from the start, with the recorded gaps between
+    messages divided by speed (speed 0: as fast as possible), repeat plays it over and over
+    start() runs the server on a background thread, or await run() it on an existing loop
+    """
+
+    def __init__(self, recordingFile: str, speed: float = 1.0, repeat: bool = False,
+                 host: str = '127.0.0.1', port: int = DEO_PORT):
+        '''port - 0 to take any free port, see self.port once started'''
+        self.frames = list(read_recording(recordingFile))
+        if len(self.frames) == 0:
+            raise Exception(f'No DEO messages in {recordingFile}')
+        self.speed = speed
+        self.repeat = repeat
+        self.host = host
+        self.port = port
+        self.clients = 0
+        self._runner = None
+        self._loop = None
+        self._thread = None
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+        duration = self.frames[-1][0] - self.frames[0][0]
+        logger.info(f'Replaying {len(self.frames)} DEO messages ({duration:.0f}s recorded) from {recordingFile}')
+
+    async def _play(self, ws: web.WebSocketResponse):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        duration = self.frames[-1][0] - self.frames[0][0]
+        # recorded time, continued across repeats
+        offset = -self.frames[0][0]
+        while True:
+            for (receivedAt, message) in self.frames:
+                # sleep(0) at least, sends don't necessarily yield and other clients have to get their turn
+                delay = start + (receivedAt + offset) / self.speed - loop.time() if self.speed > 0 else 0
+                await asyncio.sleep(max(0, delay))
+                if ws.closed:
+                    return
+                await ws.send_str(message)
+            if not self.repeat:
+                return
+            # the recording's last message, then the first again a second later
+            offset += duration + 1
+
+    async def _handle(self, request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.clients += 1
+        logger.info(f'DEO replay client {request.remote} connected')
+        player = asyncio.ensure_future(self._play(ws))
+        try:
+            # until the client goes away, it doesn't send anything DEO cares about
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            player.cancel()
+            self.clients -= 1
+            logger.info(f'DEO replay client {request.remote} disconnected')
+        return ws
+
+    async def run(self):
+        '''starts serving, returns once the server is listening'''
+        app = web.Application()
+        app.router.add_get('/', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info(f'DEO replay server on ws://{self.host}:{self.port}/')
+
+    async def shutdown(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start(self) -> int:
+        '''runs the server on a background thread, returns the port it listens on'''
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='DeoReplayServer', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.run(), self._loop).result(START_TIMEOUT)
+        return self.port
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self._loop).result(START_TIMEOUT)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(START_TIMEOUT)
+        self._loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
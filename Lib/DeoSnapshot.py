@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+
+# DEO top level JSON fields
+DEVICE_DATA_CONFIG='DeviceDataConfig'
+DEVICE_DATA='DeviceData'
+# container fields
+STRUCTURE_NAME='structureName'
+STRUCTURE_DATA='structureData'
+SYSTEM_TIME='systemTime'
+
+class DeoSnapshot:
+    """
+    latest state of every DEO container (structureData by structureName), updated from each DEO message
+    as it is received, so reads don't have to wait for (or parse) a message
+    containers missing from a message keep their last value
+    """
+
+    def __init__(self, decoder = None):
+        '''decoder - DeoDecoder for the messages, None to decode them in full with json'''
+        self._decode = decoder.decode if decoder is not None else json.loads
+        self._cond = threading.Condition()
+        self._containers = {}
+        self._config = None
+        self._systemTime = None
+        self._receivedAt = None
+        # last DeviceData message as received
+        self._raw = None
+        # bumped on every DeviceData message, see wait_for_update()
+        self._version = 0
+
+    def update(self, message, receivedAt: float = None) -> list:
+        '''
+        message - DEO message, JSON string or already decoded
+        returns structureNames of the containers updated
+        raises ValueError if message isn't valid JSON
+        '''
+        deoJson = self._decode(message) if isinstance(message, (str, bytes)) else message
+        with self._cond:
+            if DEVICE_DATA_CONFIG in deoJson:
+                self._config = deoJson[DEVICE_DATA_CONFIG]
+            if DEVICE_DATA not in deoJson:
+                return []
+            updated = []
+            for container in deoJson[DEVICE_DATA]:
+                self._containers[container[STRUCTURE_NAME]] = container[STRUCTURE_DATA]
+                updated.append(container[STRUCTURE_NAME])
+            self._systemTime = deoJson.get(SYSTEM_TIME)
+            self._receivedAt = receivedAt if receivedAt is not None else time.time()
+            self._raw = message if isinstance(message, str) else json.dumps(deoJson)
+            self._version += 1
+            self._cond.notify_all()
+            return updated
+
+    def version(self) -> int:
+        with self._cond:
+            return self._version
+
+    def wait_for_update(self, version: int, timeout: float = None) -> bool:
+        '''blocks until a DeviceData message newer than snapshot version arrived, or timeout'''
+        with self._cond:
+            return self._cond.wait_for(lambda: self._version != version, timeout)
+
+    def container(self, name: str, timeout: float = None) -> dict:
+        '''structureData of container name, waits up to timeout for it to show up, None if it didn't'''
+        with self._cond:
+            if not self._cond.wait_for(lambda: name in self._containers, timeout):
+                return None
+            return self._containers[name]
+
+    def value(self, container_value: str, timeout: float = None):
+        '''container.value, None if there is no such container (yet)'''
+        (container, value) = container_value.split('.')
+        containerData = self.container(container, timeout)
+        return containerData[value] if containerData is not None else None
+
+    def containers(self) -> dict:
+        '''structureName -> structureData of all containers seen'''
+        with self._cond:
+            return dict(self._containers)
+
+    @property
+    def config(self):
+        '''DeviceDataConfig, None if not received'''
+        return self._config
+
+    @property
+    def systemTime(self) -> str:
+        '''device time of the last DeviceData message'''
+        return self._systemTime
+
+    @property
+    def receivedAt(self) -> float:
+        '''host time the last DeviceData message was received'''
+        return self._receivedAt
+
+    def raw(self, timeout: float = None) -> str:
+        '''last DeviceData message, waits up to timeout for the first one, None if none yet'''
+        with self._cond:
+            self._cond.wait_for(lambda: self._raw is not None, timeout)
+            return self._raw
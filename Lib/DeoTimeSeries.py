@@ -0,0 +1,216 @@
+import logging
+import glob
+import os
+import threading
+import numpy as np
+from typing import NamedTuple
+
+logger = None
+
+# samples per column kept in memory, written out as one chunk file when full
+CHUNK_SIZE = 3600
+CHUNK_FILE = 'chunk_{:05}.npz'
+TIME = 'time'
+
+class WindowStats(NamedTuple):
+    # samples with a value in the window
+    count: int
+    min: float
+    max: float
+    mean: float
+
+
+class _Chunk(NamedTuple):
+    # a chunk written to disk with its per field summary, so windows covering it don't need to load it
+    file: str
+    start: float
+    end: float
+    # field -> (count, min, max, sum)
+    summary: dict
+
+
+def _summary(values: np.ndarray) -> tuple:
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return (0, np.nan, np.nan, 0.0)
+    return (len(values), float(values.min()), float(values.max()), float(values.sum()))
+
+def _combine(summaries: list) -> WindowStats:
+    summaries = [summary for summary in summaries if summary[0] > 0]
+    count = sum(summary[0] for summary in summaries)
+    if count == 0:
+        return WindowStats(0, np.nan, np.nan, np.nan)
+    return WindowStats(count, min(summary[1] for summary in summaries), max(summary[2] for summary in summaries),
+                       sum(summary[3] for summary in summaries) / count)
+
+
+class DeoTimeSeries:
+    """
+    captures numeric DEO fields (container.field) over time into columns: receive time and a float64 per field,
+    NaN where the field had no numeric value
+
+    columns are preallocated for CHUNK_SIZE samples and written to captureDir (chunk_NNNNN.npz) whenever
+    full, memory stays the same however long the capture runs; queries (series, stats, downsample) cover
+    both the chunks on disk and the samples in memory
+    interval - keep at most one sample per interval seconds, 0 for every DEO update
+    """
+
+    def __init__(self, fields: list, captureDir: str, interval: float = 0, chunkSize: int = CHUNK_SIZE):
+        self.fields = list(fields)
+        self.captureDir = captureDir
+        self.interval = interval
+        self._chunkSize = chunkSize
+        self._time = np.empty(chunkSize, dtype=np.float64)
+        self._columns = {field: np.empty(chunkSize, dtype=np.float64) for field in self.fields}
+        self._lock = threading.Lock()
+        self._count = 0
+        # samples in chunks on disk
+        self._flushed = 0
+        self._lastSample = None
+        self._chunks = []
+        # field -> (container, value)
+        self._paths = {field: tuple(field.split('.')) for field in self.fields}
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+        #
+        os.makedirs(captureDir, exist_ok=True)
+        if len(glob.glob(os.path.join(captureDir, 'chunk_*.npz'))) > 0:
+            raise Exception(f'{captureDir} already holds a capture')
+
+    @property
+    def containers(self) -> list:
+        '''containers the fields are in'''
+        return sorted(set(container for (container, value) in self._paths.values()))
+
+    def add(self, containers: dict, receivedAt: float) -> bool:
+        '''
+        containers - structureName -> structureData as of receivedAt (missing ones give NaN)
+        returns whether it was sampled (see interval)
+        '''
+        with self._lock:
+            return self._add(containers, receivedAt)
+
+    def _add(self, containers: dict, receivedAt: float) -> bool:
+        if self._lastSample is not None and receivedAt - self._lastSample < self.interval:
+            return False
+        self._lastSample = receivedAt
+        n = self._count
+        self._time[n] = receivedAt
+        for (field, (container, value)) in self._paths.items():
+            data = containers.get(container)
+            sample = data.get(value) if data is not None else None
+            self._columns[field][n] = sample if isinstance(sample, (int, float)) else np.nan
+        self._count += 1
+        if self._count == self._chunkSize:
+            self._flush()
+        return True
+
+    def sample(self, snapshot, receivedAt: float) -> bool:
+        '''add() the current state of a DeoSnapshot'''
+        return self.add({container: snapshot.container(container, 0) for container in self.containers}, receivedAt)
+
+    def flush(self):
+        '''writes the samples in memory out as a chunk'''
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._count == 0:
+            return
+        n = self._count
+        chunkFile = os.path.join(self.captureDir, CHUNK_FILE.format(len(self._chunks)))
+        arrays = {TIME: self._time[:n]}
+        arrays.update({field: column[:n] for (field, column) in self._columns.items()})
+        # write then rename, a chunk file is complete or not there
+        with open(chunkFile + '.tmp', 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(chunkFile + '.tmp', chunkFile)
+        self._chunks.append(_Chunk(chunkFile, float(self._time[0]), float(self._time[n - 1]),
+                                   {field: _summary(column[:n]) for (field, column) in self._columns.items()}))
+        self._flushed += n
+        self._count = 0
+        logger.debug(f'{n} samples written to {chunkFile}')
+
+    def close(self):
+        self.flush()
+
+    def __len__(self) -> int:
+        return self._flushed + self._count
+
+    def _window(self, field: str, start: float, end: float, covered: bool = False) -> tuple:
+        '''
+        (times, values) of field with start <= time < end, from the chunks on disk and memory
+        covered - leave out chunks entirely in the window, returning them as a third element
+        '''
+        with self._lock:
+            # one consistent state, samples in memory are copied as the receiving thread goes on filling the columns
+            chunks = [chunk for chunk in self._chunks if chunk.end >= start and chunk.start < end]
+            inMemory = (self._time[:self._count].copy(), self._columns[field][:self._count].copy())
+        coveredChunks = [chunk for chunk in chunks if chunk.start >= start and chunk.end < end] if covered else []
+        times = []
+        values = []
+        for chunk in chunks:
+            if chunk in coveredChunks:
+                continue
+            with np.load(chunk.file) as arrays:
+                times.append(arrays[TIME])
+                values.append(arrays[field])
+        times.append(inMemory[0])
+        values.append(inMemory[1])
+        times = np.concatenate(times)
+        values = np.concatenate(values)
+        inWindow = (times >= start) & (times < end)
+        if covered:
+            return (times[inWindow], values[inWindow], coveredChunks)
+        return (times[inWindow], values[inWindow])
+
+    def series(self, field: str, start: float = -np.inf, end: float = np.inf) -> tuple:
+        '''(times, values) arrays of field with start <= time < end'''
+        return self._window(field, start, end)
+
+    def stats(self, field: str, start: float = -np.inf, end: float = np.inf) -> WindowStats:
+        '''min/max/mean of field over start <= time < end, chunks entirely in the window aren't loaded'''
+        (times, values, covered) = self._window(field, start, end, covered=True)
+        return _combine([chunk.summary[field] for chunk in covered] + [_summary(values)])
+
+    def downsample(self, field: str, step: float, start: float = None, end: float = None) -> tuple:
+        '''
+        (bucket start times, min, max, mean) arrays of field in buckets of step seconds from start,
+        NaN for buckets without values
+        '''
+        (times, values) = self.series(field, -np.inf if start is None else start, np.inf if end is None else end)
+        if start is None:
+            start = times[0] if len(times) > 0 else 0.0
+        if end is not None:
+            buckets = max(0, int(np.ceil((end - start) / step)))
+        else:
+            # up to the bucket of the last sample
+            buckets = int((times[-1] - start) // step) + 1 if len(times) > 0 else 0
+        hasValue = ~np.isnan(values)
+        index = ((times[hasValue] - start) // step).astype(np.int64)
+        values = values[hasValue]
+        inBuckets = index < buckets
+        (index, values) = (index[inBuckets], values[inBuckets])
+        counts = np.bincount(index, minlength=buckets)
+        sums = np.bincount(index, weights=values, minlength=buckets)
+        mins = np.full(buckets, np.inf)
+        maxs = np.full(buckets, -np.inf)
+        np.minimum.at(mins, index, values)
+        np.maximum.at(maxs, index, values)
+        empty = counts == 0
+        mins[empty] = np.nan
+        maxs[empty] = np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(empty, np.nan, sums / counts)
+        return (start + np.arange(buckets) * step, mins, maxs, means)
+
+
+def load_capture(captureDir: str) -> dict:
+    '''column name (time and fields) -> array of a whole capture, for looking at it after the run'''
+    columns = {}
+    for chunkFile in sorted(glob.glob(os.path.join(captureDir, 'chunk_*.npz'))):
+        with np.load(chunkFile) as arrays:
+            for name in arrays.files:
+                columns.setdefault(name, []).append(arrays[name])
+    return {name: np.concatenate(arrays) for (name, arrays) in columns.items()}
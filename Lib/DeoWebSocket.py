@@ -1,82 +1,175 @@
 import logging
 import asyncio
 import json
+import queue
+import threading
 import time
-from aiohttp import ClientSession
+import weakref
+from aiohttp import ClientSession, WSMsgType
+from Lib.DeoSnapshot import DeoSnapshot, DEVICE_DATA_CONFIG, DEVICE_DATA, STRUCTURE_NAME, STRUCTURE_DATA, SYSTEM_TIME
+from Lib.DeoDecoder import DeoDecoder
+from Lib.DeoRecorder import DeoRecorder
+from Lib.DeoAlarms import AlarmTracker, AlarmEvent, ALARM_MANAGER, RAISED
 from utils import *
 
 logger = None
 
-# DEO top level JSON fields
-DEVICE_DATA_CONFIG='DeviceDataConfig'
-DEVICE_DATA='DeviceData'
-# container fields
-STRUCTURE_NAME='structureName'
-STRUCTURE_DATA='structureData'
-SYSTEM_TIME='systemTime'
+# port the device serves DEO on
+DEO_PORT = 8080
+# messages kept for getWSData(), oldest dropped when nobody reads them
+RECEIVE_QUEUE_SIZE = 1000
+CONNECT_TIMEOUT = 30
+# how long reads wait for DEO data to show up (right after connecting)
+DATA_TIMEOUT = 30
+# seconds between reconnect attempts after the connection dropped
+RECONNECT_DELAY = 5
 
 class DeoWebSocket():
-    """description of class"""
+    """
+    DEO WebSocket client
+    a background thread runs the asyncio loop receiving every DEO message as it arrives,
+    keeping the latest state of all containers in a DeoSnapshot, reads are served from the snapshot
+    alarms raised/cleared are reported by self.alarms (AlarmTracker) the moment the update arrives
+    use as a context manager (or call closeSession()), the loop thread is stopped by __del__ otherwise
+    """
 
-    def __init__(self, IP: str):
-        self.URL = f'ws://{IP}:8080/'
-        self.session = ClientSession()
+    def __init__(self, IP: str, containers: list = None, recordFile: str = None, port: int = DEO_PORT, timeSeries = None):
+        '''
+        containers - structureNames the snapshot is kept for (only those are decoded), None for all
+        recordFile - DeoRecorder file to record every message received to
+        port - other than DEO_PORT for a DeoReplayServer
+        timeSeries - DeoTimeSeries sampled on every update, closed with the session
+        '''
+        self._closed = False
+        self.URL = f'ws://{IP}:{port}/'
+        self.session = None
         self.ws = None
-        self.evtLoop = asyncio.get_event_loop()
-        self.evtLoop.run_until_complete(self.connect())
-        self.__receivedData = None
+        self.recorder = DeoRecorder(recordFile) if recordFile is not None else None
+        self.timeSeries = timeSeries
+        if containers is not None and timeSeries is not None:
+            containers = sorted(set(containers) | set(timeSeries.containers))
+        self.snapshot = DeoSnapshot(DeoDecoder(containers))
+        self.alarms = AlarmTracker()
+        self._messages = queue.Queue(RECEIVE_QUEUE_SIZE)
+        self._closing = False
         #
         global logger
         logger = logging.getLogger(__name__)
+        #
+        self.evtLoop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.evtLoop.run_forever, name=f'DeoWebSocket-{IP}', daemon=True)
+        self._thread.start()
+        try:
+            # raises if the connection can't be made
+            self._run(self.connect(), CONNECT_TIMEOUT)
+        except:
+            self.closeSession()
+            raise
+        self._consumer = asyncio.run_coroutine_threadsafe(self._consume(weakref.ref(self)), self.evtLoop)
+
+    def __del__(self):
+        if getattr(self, 'evtLoop', None) is not None:
+            self.closeSession()
 
-    def __delete__(self):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
         self.closeSession()
-        self.evtLoop.close()
+
+    def _run(self, coroutine, timeout: float = None):
+        '''runs coroutine on the receiving loop, returns its result'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.evtLoop).result(timeout)
 
     async def connect(self):
-        if self.ws is not None: return
+        if self.session is None:
+            # belongs to the loop it's created on
+            self.session = ClientSession()
+        if self.ws is not None and not self.ws.closed: return
         self.ws = await self.session.ws_connect(self.URL)
 
-    async def receive(self, receiveTimeout = None):
-        await self.connect()
-        # set __receiveData, empty if timed out
-        try:
-            self.__receivedData = (await self.ws.receive(receiveTimeout)).data
-        except asyncio.TimeoutError:
-            self.__receivedData = ''
-
-    async def getLastMsg(self, receiveTimeout:float):
+    @staticmethod
+    async def _consume(ref):
         '''
-        call ws.receive() until timeout encountered, then return last msg
-        empties buffer
+        receives messages until closed, reconnecting whenever the connection drops
+        ref - weak reference to the DeoWebSocket, the loop thread must not keep it alive (see __del__)
+        while waiting, so it's only held in between
         '''
-        if receiveTimeout is None:
-            receiveTimeout = 0.5
-        await self.connect()
-        bufferEmpty = False
-        data = ''
-        while not bufferEmpty:
+        while True:
+            deoWS = ref()
+            if deoWS is None or deoWS._closing:
+                return
             try:
-                data = (await self.ws.receive(receiveTimeout)).data
-            except asyncio.TimeoutError:
-                bufferEmpty = True
-        self.__receivedData = data
+                await deoWS.connect()
+                ws = deoWS.ws
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'DEO websocket connect failed ({e}), retrying in {RECONNECT_DELAY}s')
+                ws = None
+            deoWS = None
+            if ws is None:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                msg = await ws.receive()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'DEO websocket receive failed ({e}), reconnecting in {RECONNECT_DELAY}s')
+                msg = None
+            deoWS = ref()
+            if deoWS is None or deoWS._closing:
+                return
+            if msg is not None and msg.type == WSMsgType.TEXT:
+                deoWS._deliver(msg.data)
+            elif msg is None or msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+                if msg is not None:
+                    logger.warning(f'DEO websocket closed, reconnecting in {RECONNECT_DELAY}s')
+                deoWS.ws = None
+                deoWS = None
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def _deliver(self, data: str):
+        receivedAt = time.time()
+        if self.recorder is not None:
+            self.recorder.record(data, receivedAt)
+        try:
+            updated = self.snapshot.update(data, receivedAt)
+            if ALARM_MANAGER in updated:
+                self.alarms.update(self.snapshot.container(ALARM_MANAGER), self.snapshot.systemTime, receivedAt)
+            if self.timeSeries is not None and len(updated) > 0:
+                self.timeSeries.sample(self.snapshot, receivedAt)
+        except ValueError as e:
+            logger.warning(f'Ignoring malformed DEO message: {e}')
+        while True:
+            try:
+                self._messages.put_nowait(data)
+                return
+            except queue.Full:
+                # nobody reading getWSData(), keep the most recent
+                try:
+                    self._messages.get_nowait()
+                except queue.Empty:
+                    pass
 
     def getWSData(self, receiveTimeout = None) -> str:
         '''
-        retrieves a msg from WS (from head of buffer)
+        retrieves a msg from WS (from head of buffer), empty if none within receiveTimeout
         '''
-        self.evtLoop.run_until_complete(self.receive(receiveTimeout))
-        return self.__receivedData
+        try:
+            return self._messages.get(timeout=receiveTimeout)
+        except queue.Empty:
+            return ''
 
     def getLatestDeoData(self) -> str:
         '''
-        retrieves last DEO msg from WS (from tail of buffer)
-        sleeps 1s to guarantee at least 1 DEO update
+        retrieves last DEO msg (DeviceData) received, waits for the first one if none yet
         '''
-        time.sleep(1)
-        self.evtLoop.run_until_complete(self.getLastMsg(0.5))
-        return self.__receivedData
+        data = self.snapshot.raw(DATA_TIMEOUT)
+        if data is None:
+            raise TimeoutError(f'No DEO data received from {self.URL} within {DATA_TIMEOUT}s')
+        return data
 
     def getDeoContainerByName(self, jsonList, containerName:str):
         '''
@@ -87,31 +180,30 @@ class DeoWebSocket():
 
     def getCurrentContainerValue(self, container_value: str):
         '''
-        returns container.value
+        returns container.value from the latest DEO state
         input container_value parameter is assumed to be in this form
         '''
-        (container, value) = container_value.split('.')
-        deoJson = json.loads(self.getLatestDeoData())
-        while DEVICE_DATA not in deoJson:
-            deoJson = json.loads(self.getLatestDeoData())
-        containerJson = self.getDeoContainerByName(deoJson[DEVICE_DATA], container)[0]
-        logger.debug(containerJson[STRUCTURE_DATA])
-        return containerJson[STRUCTURE_DATA][value]
+        value = self.snapshot.value(container_value, DATA_TIMEOUT)
+        if value is None:
+            raise TimeoutError(f'No DEO data for {container_value} received within {DATA_TIMEOUT}s')
+        return value
 
     def getCurrentAlarm0Condition(self):
         '''
-        poll DEO to get latest update
         returns value found for AlarmManagerData._activeAlarmsList0
         '''
         return self.getCurrentContainerValue('AlarmManagerData._activeAlarmsList0')
 
     def getAlarms(self) -> list:
         '''
-        returns list of alarms
+        returns list of alarms, all read from one DEO update
         '''
+        alarmManager = self.snapshot.container('AlarmManagerData', DATA_TIMEOUT)
+        if alarmManager is None:
+            raise TimeoutError(f'No DEO AlarmManagerData received within {DATA_TIMEOUT}s')
         alarms = []
         for n in range(0,10):
-            alarm = self.getCurrentContainerValue(f'AlarmManagerData._activeAlarmsList{n}')
+            alarm = alarmManager[f'_activeAlarmsList{n}']
             if len(alarm) > 0:
                 alarms.append(alarm)
             else:
@@ -119,23 +211,57 @@ class DeoWebSocket():
         return alarms
 
     def closeSession(self):
+        if self._closed:
+            return
+        self._closed = True
         logger.info('Closing session...')
-        self.evtLoop.run_until_complete(self.session.close())
+        self._closing = True
+        if getattr(self, '_consumer', None) is not None:
+            self._consumer.cancel()
+
+        async def close():
+            if self.ws is not None:
+                await self.ws.close()
+            if self.session is not None:
+                await self.session.close()
+
+        if self.evtLoop.is_running() and threading.current_thread() is self._thread:
+            # dropped by the loop thread itself (see __del__), it can't wait on itself
+            async def closeAndStop():
+                await close()
+                self.evtLoop.stop()
+            self.evtLoop.create_task(closeAndStop())
+        elif self.evtLoop.is_running():
+            try:
+                self._run(close(), CONNECT_TIMEOUT)
+            except Exception as e:
+                logger.warning(f'Closing DEO websocket: {e}')
+            self.evtLoop.call_soon_threadsafe(self.evtLoop.stop)
+            self._thread.join(CONNECT_TIMEOUT)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.timeSeries is not None:
+            self.timeSeries.close()
 
     @staticmethod
-    def pollDeoAlarm(netIP: str, pollTime: int) -> bool:
+    def pollDeoAlarm(netIP: str, pollTime: int, onAlarm = None, port: int = DEO_PORT) -> bool:
         '''
-        poll DEO through WebSocket to check alarm conditions
+        watch DEO alarm events through WebSocket for up to pollTime seconds, returning as soon as an alarm is raised
         return True means an alarm was seen, otherwise, no alarm happened in the polling period
+        onAlarm - optional callback(AlarmEvent), called for every alarm raised/cleared while watching
+        port - other than DEO_PORT for a DeoReplayServer
+        raises if DEO can't be watched (no connection, no AlarmManagerData, updates stopped coming)
+        rather than reporting no alarms
         '''
         logging.info('Connecting to DEO WebSocket, check if any alarms raised...')
         # try a couple of times to connect
         tries = 3
+        deoWS = None
         try:
             for i in range(0,tries):
                 try:
                     logging.info('connecting...')
-                    deoWS = DeoWebSocket(netIP)
+                    deoWS = DeoWebSocket(netIP, containers=[ALARM_MANAGER], port=port)
                     # if we get here, it means the connection succeeded, break from loop
                     break
                 except:
@@ -146,20 +272,36 @@ class DeoWebSocket():
                         logging.error(f'Unable to connect to DEO websocket after {tries} attempts, aborting')
                         raise Exception('Cannot poll for alarms ==> unable to make websocket connnection to DEO')
 
-            def isAlarm0():
-                alarms = deoWS.getAlarms()
-                if len(alarms) == 0:
-                    logging.info('No alarms...')
-                    return False
-                else:
-                    logging.info('Alarms seen: ' + str(alarms))
-                    return True
+            # alarm events as DEO updates arrive, an alarm raised and cleared again in between is seen too
+            alarmSeen = threading.Event()
+
+            def onAlarmEvent(event: AlarmEvent):
+                if event.kind == RAISED:
+                    alarmSeen.set()
+                if onAlarm is not None:
+                    onAlarm(event)
 
-            # poll for alarms for up to pollTime seconds at 30s intervals
-            return poll_wait_until(isAlarm0, pollTime, 30)
+            deoWS.alarms.add_callback(onAlarmEvent)
+            # without any alarm data, not seeing an alarm means nothing
+            if deoWS.snapshot.container(ALARM_MANAGER, DATA_TIMEOUT) is None:
+                raise Exception(f'Cannot poll for alarms ==> no DEO {ALARM_MANAGER} received within {DATA_TIMEOUT}s')
+            # alarms already active before the callback was in place
+            for alarm in deoWS.alarms.active():
+                logging.info('Alarm active: ' + alarm)
+                alarmSeen.set()
+            if alarmSeen.wait(pollTime):
+                logging.info('Alarms seen: ' + str([event.alarm for event in deoWS.alarms.history if event.kind == RAISED]))
+                return True
+            # the connection may have dropped during the poll
+            lastUpdate = time.time() - deoWS.snapshot.receivedAt
+            if lastUpdate > DATA_TIMEOUT:
+                raise Exception(f'Cannot poll for alarms ==> no DEO update received for the last {lastUpdate:.0f}s')
+            logging.info('No alarms...')
+            return False
 
         finally:
-            deoWS.closeSession()
+            if deoWS is not None:
+                deoWS.closeSession()
 
 
 
@@ -1,16 +1,46 @@
 import logging
 import paramiko
 import os
+import time
+import threading
+import hashlib
+import io
+import tempfile
 from scp import SCPClient
+from Lib.CommandResult import CommandResult
+from Lib.Artifacts import Sha256Cache, ArtifactVerificationError, UploadProgress, sha256_file
+from Lib import DeltaUpload
+from utils import *
 
 logger = None
-lastPercent = 0
+# seconds between SSH keepalive packets
+KEEPALIVE_INTERVAL = 15
+SSH_PORT = 22
+# chunked uploads: progress is recorded per chunk, writes within a chunk are pipelined
+CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_RETRIES = 5
+# how long to wait for the device to take SSH connections again after a drop mid-upload
+RECONNECT_TIMEOUT = 300
 
-def progress(filename, size, sent):
-    global lastPercent
-    if sent*100//size != lastPercent:
-        logger.info("%s\'s progress: %d/%d bytes  %.2f%%  \r" % (filename, sent, size, float(sent)/float(size)*100) )
-        lastPercent = sent*100//size
+def progress_logger():
+    '''
+    transfer progress callback, one per transfer: logs whenever the percentage done changes,
+    concurrent transfers each keep their own
+    rate (bytes/s) and number of times the transfer was resumed are reported by chunked uploads
+    '''
+    lastPercent = None
+
+    def progress(filename, size, sent, rate: float = None, resumes: int = 0):
+        nonlocal lastPercent
+        if sent*100//size != lastPercent:
+            stats = ''
+            if rate is not None:
+                stats = '  %.2f MB/s' % (rate / 1e6)
+            if resumes > 0:
+                stats += f'  (resumed {resumes}x)'
+            logger.info("%s\'s progress: %d/%d bytes  %.2f%%%s  \r" % (filename, sent, size, float(sent)/float(size)*100, stats) )
+            lastPercent = sent*100//size
+    return progress
 
 class DeviceSSH:
     """SSH and SCP handling"""
@@ -21,25 +51,63 @@ class DeviceSSH:
         self._IP = IP
         self._user = user
         self._password = password
-        #
-        self._sshClient = paramiko.SSHClient()
-        #self._sshClient.load_system_host_keys()
-        self._sshClient.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        try:
-            self._sshClient.connect(IP, username=user, password=password)
-        except:
-            # if first connect attempt fails, try again with an empty password
-            # (because some devices maybe setup with no password)
-            self._sshClient.connect(IP, username=user, password="")
-        #
-        self._scpClient = SCPClient(self._sshClient.get_transport(), progress=progress)
+        self._sshClient = None
+        self._scpClient = None
+        # held while (re)connecting, so a background reconnect and a caller don't both do it
+        self._lock = threading.RLock()
         #
         global logger
         logger = logging.getLogger(__name__)
+        #
+        self.connect()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def IP(self) -> str:
+        return self._IP
+
+    def connect(self):
+        '''
+        (re)establishes the SSH session, closing any previous one first
+        transport sends keepalives so a dead link (device rebooted) shows up in is_active()
+        '''
+        with self._lock:
+            self.close()
+            self._sshClient = paramiko.SSHClient()
+            #self._sshClient.load_system_host_keys()
+            self._sshClient.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                self._sshClient.connect(self._IP, username=self._user, password=self._password)
+            except:
+                # if first connect attempt fails, try again with an empty password
+                # (because some devices maybe setup with no password)
+                self._sshClient.connect(self._IP, username=self._user, password="")
+            self._sshClient.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+            #
+            self._scpClient = SCPClient(self._sshClient.get_transport(), progress=progress_logger())
+            logger.info(f'SSH connected to {self._IP}')
+
+    def reconnect(self, IP: str = None):
+        '''reconnect, to a new address if IP given'''
+        with self._lock:
+            if IP is not None:
+                self._IP = IP
+            self.connect()
+
+    def close(self):
+        with self._lock:
+            if self._scpClient is not None:
+                self._scpClient.close()
+                self._scpClient = None
+            if self._sshClient is not None:
+                self._sshClient.close()
+                self._sshClient = None
 
-    def __delete__(self):
-        self._scpClient.close()
-        self._sshClient.close()
+    def open_sftp(self) -> paramiko.SFTPClient:
+        '''SFTP channel on the session transport, caller closes it'''
+        return self._sshClient.open_sftp()
 
     def executeCommand(self, commandString: str):
         '''
@@ -51,6 +119,27 @@ class DeviceSSH:
         return ([s.strip() for s in stdout.readlines()], \
                 [s.strip() for s in stderr.readlines()])
 
+    def is_active(self) -> bool:
+        '''True while the SSH transport is up'''
+        client = self._sshClient
+        transport = client.get_transport() if client is not None else None
+        return transport is not None and transport.is_active()
+
+    def runCommand(self, commandString: str, timeout: float = None) -> CommandResult:
+        '''
+        execute command on SSH session, waiting for its exit status
+        raises socket.timeout if no answer within timeout seconds
+        '''
+        logger.debug('Running command line: ' + commandString)
+        start = time.time()
+        stdin,stdout,stderr = self._sshClient.exec_command(commandString, timeout=timeout)
+        out = [s.strip() for s in stdout.readlines()]
+        err = [s.strip() for s in stderr.readlines()]
+        exitCode = stdout.channel.recv_exit_status()
+        if len(err) > 0:
+            logger.debug(err)
+        return CommandResult(out, exitCode, time.time() - start)
+
     def removeRemoteFile(self, remoteFile: str):
         '''simply make sure the remote file is not there'''
         return self.executeCommand('rm -f ' + remoteFile)
@@ -63,6 +152,151 @@ class DeviceSSH:
             logger.debug('  Uploading to: ' + remoteFile)
             self._scpClient.put(uploadFile, remoteFile)
 
+    def remoteSha256(self, remoteFile: str) -> str:
+        '''hex sha256 of remote file, None if there is no such file'''
+        (out, err) = self.executeCommand(f'sha256sum {remoteFile} 2>/dev/null')
+        if len(out) == 0 or len(out[0]) == 0:
+            return None
+        return out[0].split()[0]
+
+    def upload_artifact(self, uploadFile: str, remoteFile: str, hashCache: Sha256Cache = None, 
+                        signatures: DeltaUpload.SignatureCache = None) -> bool:
+        '''
+        uploads file unless the remote file already has identical content (same sha256),
+        every transfer is verified the same way
+        signatures - if given, only the blocks that differ from the remote file are sent when possible
+        returns True if a transfer took place
+        raises ArtifactVerificationError if remote content doesn't match after transfer
+        '''
+        if hashCache is None:
+            hashCache = Sha256Cache()
+        localSha256 = hashCache.get(uploadFile)
+        remoteSha256 = self.remoteSha256(remoteFile)
+        if remoteSha256 == localSha256:
+            logger.info(f'{remoteFile} already identical to {uploadFile}, skipping upload')
+            return False
+        if signatures is None or not self.upload_file_delta(uploadFile, remoteFile, localSha256, remoteSha256, signatures):
+            self.upload_file_chunked(uploadFile, remoteFile, localSha256)
+        remoteSha256 = self.remoteSha256(remoteFile)
+        if remoteSha256 != localSha256:
+            raise ArtifactVerificationError(
+                f'{remoteFile} sha256 {remoteSha256} does not match {uploadFile} sha256 {localSha256}')
+        logger.info(f'{remoteFile} upload verified, sha256 {localSha256}')
+        if signatures is not None:
+            # what the device has now, base for the next delta
+            signatures.save(localSha256, uploadFile)
+        return True
+
+    def upload_file_delta(self, uploadFile: str, remoteFile: str, localSha256: str, remoteSha256: str, 
+                          signatures: DeltaUpload.SignatureCache) -> bool:
+        '''
+        rsync style transfer against the file already on the device, see DeltaUpload
+        the patched file is checked and only then moved over remoteFile
+        returns False if no delta was possible (remote content unknown, too little in common, patch failed),
+        the caller then falls back to a full transfer
+        '''
+        blocks = signatures.load(remoteSha256)
+        if blocks is None:
+            logger.info(f'No block signatures for {remoteFile}, full upload')
+            return False
+        start = time.time()
+        (literalFile, opsFile, scriptFile, newFile) = \
+            (remoteFile + '.literal', remoteFile + '.delta', remoteFile + '.patch.sh', remoteFile + '.new')
+        # literal data can be up to half the file, kept on disk
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            localLiteral = f.name
+            ops = DeltaUpload.delta_for_file(uploadFile, blocks, f)
+        try:
+            if ops is None:
+                logger.info(f'{uploadFile} has too little in common with {remoteFile}, full upload')
+                return False
+            logger.info(f'Delta of {uploadFile} against {remoteFile}: {len(ops)} ops, {os.path.getsize(localLiteral)} of '
+                        f'{os.path.getsize(uploadFile)} bytes to send, computed in {time.time() - start:.1f}s')
+            self.upload_file_chunked(localLiteral, literalFile, sha256_file(localLiteral))
+        finally:
+            os.remove(localLiteral)
+        sftp = self.open_sftp()
+        try:
+            sftp.putfo(io.BytesIO(DeltaUpload.format_ops(ops).encode()), opsFile)
+            sftp.putfo(io.BytesIO(DeltaUpload.PATCH_SCRIPT.encode()), scriptFile)
+        finally:
+            sftp.close()
+        result = self.runCommand(
+            f'sh {scriptFile} {remoteFile} {opsFile} {literalFile} {newFile} {DeltaUpload.BLOCK_SIZE}')
+        patched = result.succeeded and self.remoteSha256(newFile) == localSha256
+        if patched:
+            self.runCommand(f'mv {newFile} {remoteFile}')
+        else:
+            logger.warning(f'Patching {remoteFile} failed (exit code {result.exitCode}), full upload')
+        self.runCommand(f'rm -f {literalFile} {opsFile} {scriptFile} {newFile}')
+        return patched
+
+    def upload_file_chunked(self, uploadFile: str, remoteFile: str, sourceSha256: str, 
+                            chunkSize: int = CHUNK_SIZE, retries: int = UPLOAD_RETRIES):
+        '''
+        SFTP upload in chunks with pipelined writes
+        progress is recorded after every chunk, so if the connection drops (or a previous run was aborted)
+        the upload resumes from the last verified offset instead of starting over
+        sourceSha256 identifies the local file content, progress recorded for other content is discarded
+        '''
+        size = os.path.getsize(uploadFile)
+        record = UploadProgress(self._IP, remoteFile)
+        resumes = 0
+        for attempt in range(retries + 1):
+            try:
+                offset = self._verified_offset(record, remoteFile, sourceSha256, size)
+                if offset > 0:
+                    logger.info(f'Resuming upload of {uploadFile} at {offset}/{size} bytes')
+                self._upload_chunks(uploadFile, remoteFile, sourceSha256, size, offset, chunkSize, record, resumes)
+                record.clear()
+                return
+            except (paramiko.SSHException, EOFError, OSError) as e:
+                if attempt == retries:
+                    raise
+                resumes += 1
+                logger.warning(f'Upload of {uploadFile} interrupted ({e}), waiting to reconnect...')
+                if not wait_until(lambda: port_is_open(self._IP, SSH_PORT), RECONNECT_TIMEOUT):
+                    raise
+                self.reconnect()
+
+    def _verified_offset(self, record: UploadProgress, remoteFile: str, sourceSha256: str, size: int) -> int:
+        '''offset to resume from: recorded offset if its last chunk checks out on the device, otherwise 0'''
+        state = record.load()
+        if state is None or state['sha256'] != sourceSha256 or state['size'] != size or state['offset'] == 0:
+            return 0
+        start = state['offset'] - state['chunkLength']
+        (out, err) = self.executeCommand(
+            f"tail -c +{start + 1} {remoteFile} 2>/dev/null | head -c {state['chunkLength']} | sha256sum")
+        if len(out) > 0 and out[0].split()[0] == state['chunkSha256']:
+            return state['offset']
+        logger.info(f'Recorded upload progress for {remoteFile} does not match device content, starting over')
+        return 0
+
+    def _upload_chunks(self, uploadFile: str, remoteFile: str, sourceSha256: str, size: int, offset: int, 
+                       chunkSize: int, record: UploadProgress, resumes: int):
+        sftp = self.open_sftp()
+        try:
+            with open(uploadFile, 'rb') as local, sftp.open(remoteFile, 'r+b' if offset > 0 else 'wb') as remote:
+                # don't wait for each write to be acknowledged, keeps the link busy
+                remote.set_pipelined(True)
+                local.seek(offset)
+                remote.seek(offset)
+                start = time.time()
+                startOffset = offset
+                progress = progress_logger()
+                while offset < size:
+                    chunk = local.read(chunkSize)
+                    remote.write(chunk)
+                    remote.flush()
+                    # a round trip, so all writes of the chunk are acknowledged before recording it
+                    remote.stat()
+                    offset += len(chunk)
+                    record.save(sourceSha256, size, offset, len(chunk), hashlib.sha256(chunk).hexdigest())
+                    progress(os.path.basename(uploadFile), size, offset, 
+                             (offset - startOffset) / max(time.time() - start, 1e-3), resumes)
+        finally:
+            sftp.close()
+
     def download_file(self, downloadFile: str, targetPath: str = ''):
         logger.debug(f'Downloading file: {downloadFile}   target: {targetPath}')
         self._scpClient.get(downloadFile, targetPath)
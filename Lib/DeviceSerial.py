@@ -3,35 +3,96 @@ import serial
 import re
 import time
 import sys
+import uuid
 from utils import *
+from Lib.CommandResult import CommandResult
+from Lib.DeviceState import DeviceState
+from Lib.SerialReader import SerialReader
 
 PROMPT = 'root@'
 LOGIN = 'login'
 LOGOUT = 'logout'
+# login prompt at the end of a boot, 'Last login: ...' after logging in doesn't count
+LOGIN_PROMPT_PATTERN = r'login:\s*$'
+# shell prompt as seen at the end of the output, e.g. 'root@orion:~# '
+PROMPT_PATTERN = re.compile(r'root@\S*[#$]\s*$')
+# default deadline (seconds) for a command to answer with a prompt
+EXPECT_TIMEOUT = 10
+# deadline for a 3 packet ping
+PING_TIMEOUT = 30
+# the network is up once SSH answers on the driver IP, DEO on the net IP may take longer and
+# is waited for separately by the steps using it, see wait_deo_ready()
+SSH_PORT = 22
+DEO_PORT = 8080
+DEO_READY_TIMEOUT = 120
+# how long last known addresses get to answer before rediscovering them over serial
+KNOWN_IP_PROBE_TIMEOUT = 90
 logger = None
+# device state queries, see get_device_state()
+VERSIONS_QUERY = 'grep _VERSION /usr/local/etc/ProjectInfo.txt'
+DEVICE_TYPE_QUERY = r'''grep -o 'deviceType="[^"]\+"' /usr/local/etc/protocol/*.xml'''
+IP_ADDRESSES_QUERY = 'lxc-ls -f'
 APPLICATION = '/usr/local/etc/config/Application'
 NETWORKINFO = '/data/config/NetworkInfo'
 VISTA_SERVER = 'Usbwsutsvr01.bct.gambro.net'
 
+def _strip_echo(lines: list) -> list:
+    '''output lines without the empty line the newline before an end marker adds after a trailing newline'''
+    return lines[:-1] if len(lines) > 0 and lines[-1] == '' else lines
+
 class DeviceSerial:
     """class for handling serial port connection to device"""
 
     def __init__(self, serialPort):
         self._serialPort = serialPort
         self._ser = serial.Serial(serialPort, 115200, timeout=1)
+        # all reading from the port is done by the reader thread,
+        # _readMark is how far decoded_output() got in its ring buffer
+        self._reader = SerialReader(self._ser)
+        self._reader.start()
+        self._readMark = self._reader.mark()
+        # cached device state (versions, IP addresses, device types), see invalidate_cache()
+        self._cache = {}
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        # a login prompt means the device (re)booted, nothing cached can be trusted anymore
+        self._reader.watch(LOGIN_PROMPT_PATTERN, lambda line: self.invalidate_cache('login prompt seen'))
+        # DeviceSSH session used for commands when healthy, see attachSSH()
+        self._ssh = None
+        # last (driverIP, netIP) seen, survives cache invalidation, see wait_network_ready()
+        self._lastIPs = None
         #
         global logger
         logger = logging.getLogger(__name__)
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        self._reader.stop()
+        self._reader.join(2 * self._ser.timeout)
         self._ser.close()
 
     def reset_buffers(self):
         self._ser.reset_input_buffer()
         self._ser.reset_output_buffer()
+        self._readMark = self._reader.mark()
 
     def decoded_output(self):
-        return [ line.decode('ISO-8859-1').strip() for line in self._ser.readlines() ]
+        '''
+        output lines received since last read, returns once the device has been
+        quiet for the port timeout (like serial readlines() did)
+        '''
+        version = self._reader.version()
+        while self._reader.wait_for_data(version, self._ser.timeout):
+            version = self._reader.version()
+        (version, entries, partial) = self._reader.snapshot(self._readMark)
+        if len(entries) > 0:
+            self._readMark = entries[-1][0]
+        output = [line for (seq, timestamp, line) in entries]
+        if len(partial.strip()) > 0:
+            output.append(partial.strip())
+        return output
     
     def enterString(self, commandString: str):
         '''type string and hit enter'''
@@ -39,6 +100,100 @@ class DeviceSerial:
         self._ser.write(str.encode(commandString + '\n'))
         time.sleep(2)
 
+    def output_mark(self) -> int:
+        '''position in the serial output, use as since for wait_for_output() on output after this point'''
+        return self._reader.mark()
+
+    def wait_for_output(self, pattern: str, timeout, since: int = None, cancel: CancelToken = None):
+        '''
+        blocks until a line matching regex pattern shows up on the serial output,
+        also matching lines received after since (see output_mark())
+        timeout - seconds or Deadline, cancel - optional CancelToken
+        returns the matching line, None on timeout
+        '''
+        subscription = self._reader.subscribe(pattern, since)
+        try:
+            # woken up by the reader thread the moment the line arrives
+            wait_until(lambda: subscription.match is not None, timeout, Backoff(1, 2, 60), cancel, subscription.event)
+        finally:
+            self._reader.unsubscribe(subscription)
+        line = subscription.match[2] if subscription.match else None
+        if line is None:
+            logger.warning(f'"{pattern}" not seen within {timeout}s')
+        else:
+            logger.info(f'Seen: {line}')
+            # output up to the match has been dealt with, later reads (e.g. login()) must not see it
+            self._readMark = max(self._readMark, subscription.match[0])
+        return line
+
+    def flush_pending_output(self):
+        '''skips any output not read yet, so it's not mistaken for the answer to a new command'''
+        for (seq, timestamp, line) in self._reader.lines_since(self._readMark):
+            logger.debug('Skipping pending output: ' + line)
+        self._readMark = self._reader.mark()
+
+    def expect(self, pattern: str = None, timeout: float = EXPECT_TIMEOUT, echo: str = None, since: int = None):
+        '''
+        reads serial output incrementally until a line matches regex pattern,
+        or until the shell prompt shows up, or timeout seconds elapse
+        echo - command string just typed, its echoed line is left out of the output
+        since - output mark to start reading after (default: where last read ended)
+
+        returns (matched, lines) tuple:
+          matched is True if pattern (or the prompt, when no pattern given) was seen
+          lines are the output lines read so far, without the echo and the trailing prompt
+        '''
+        regex = re.compile(pattern) if pattern is not None else None
+        echoKey = re.sub(r'\s', '', echo or '') or None
+        lines = []
+        # a prompt only counts once the device answered with at least one line,
+        # otherwise it's the stale prompt from before the command was typed
+        answered = False
+        if since is None:
+            since = self._readMark
+        deadline = time.time() + timeout
+        while True:
+            (version, entries, partial) = self._reader.snapshot(since)
+            for (seq, timestamp, line) in entries:
+                since = self._readMark = seq
+                answered = True
+                if echoKey is not None:
+                    # first line is the device echoing the command back (long ones wrapped with \r)
+                    if re.sub(r'\s', '', line).endswith(echoKey):
+                        echoKey = None
+                        continue
+                    echoKey = None
+                lines.append(line)
+                if regex is not None and regex.search(line):
+                    return (True, lines)
+            # prompt has no newline after it, so look at the incomplete line
+            if answered and PROMPT_PATTERN.search(partial):
+                if regex is not None:
+                    return (regex.search(partial) is not None, lines)
+                return (True, lines)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self._reader.wait_for_data(version, remaining)
+        logger.warning(f'No prompt seen within {timeout}s, output so far: {lines + [partial]}')
+        return (False, lines)
+
+    def sendCommand(self, commandString: str, pattern: str = None, timeout: float = EXPECT_TIMEOUT):
+        '''
+        types command and returns (matched, lines) as soon as the device answers,
+        see expect() for details
+        '''
+        self.flush_pending_output()
+        mark = self._reader.mark()
+        self._ser.write(str.encode(commandString + '\n'))
+        return self.expect(pattern, timeout, commandString, mark)
+
+    def commandOutput(self, commandString: str, timeout: float = EXPECT_TIMEOUT) -> list:
+        '''runs command (over SSH when available, see runCommand()) and returns its output lines'''
+        output = self.runCommand(commandString, timeout).stdout
+        logger.debug(output)
+        return output
+
     def get_last_output_line(self):
         output = self.decoded_output()
         logger.debug(output)
@@ -47,19 +202,59 @@ class DeviceSerial:
             return output[-1]
         return None
 
+    def invalidate_cache(self, reason: str = ''):
+        '''forget cached device state, to be called whenever the device may have changed'''
+        if len(self._cache) > 0:
+            logger.debug(f'Device state cache invalidated: {reason}')
+        self._cache = {}
+
+    def cache_stats(self) -> dict:
+        return {'hits': self.cacheHits, 'misses': self.cacheMisses}
+
+    def _cached(self, key: str, query, valid = lambda value: True):
+        '''
+        returns cached value for key, or runs query() and caches its result,
+        results not passing valid() (e.g. IP addresses not assigned yet) are not cached
+        '''
+        cache = self._cache
+        if key in cache:
+            self.cacheHits += 1
+            return cache[key]
+        self.cacheMisses += 1
+        value = query()
+        if valid(value):
+            cache[key] = value
+        return value
+
+    def get_device_types(self) -> tuple:
+        '''deviceType values found in the protocol files'''
+        return self._cached('deviceTypes', 
+                            lambda: self.parse_device_types(self.commandOutput(DEVICE_TYPE_QUERY)),
+                            lambda types: len(types) > 0)
+
     def checkDeviceType(self, deviceType: str) -> bool:
-        self.enterString(f'grep deviceType /usr/local/etc/protocol/*.xml|grep -i {deviceType}')
-        if len(self.decoded_output()) >2:
+        deviceTypes = self.get_device_types()
+        if any(deviceType.lower() in t.lower() for t in deviceTypes):
             print('----------------DeviceType ' + deviceType)
             return True
         # given deviceType not found in protocol files, printout what is found
-        self.enterString(r'''grep -o 'deviceType="[^"]\+"' /usr/local/etc/protocol/*.xml''')
-        list(map(logger.info, [s for s in self.decoded_output() 
-                                if 'deviceType' in s and not 'grep' in s]))
+        list(map(logger.info, deviceTypes))
         return False
 
+    @staticmethod
+    def parse_device_types(lines: list) -> tuple:
+        '''deviceType values out of DEVICE_TYPE_QUERY output'''
+        return tuple(m.group(1) for m in map(re.compile(r'deviceType="([^"]+)"').search, lines) if m)
+
     def read_single_line(self):
-        return self._ser.readline().decode('utf-8').strip()
+        (version, entries, partial) = self._reader.snapshot(self._readMark)
+        if len(entries) == 0:
+            self._reader.wait_for_data(version, self._ser.timeout)
+            entries = self._reader.lines_since(self._readMark)
+        if len(entries) == 0:
+            return ''
+        self._readMark = entries[0][0]
+        return entries[0][2]
 
     def outputContains(self, chkString: str) -> bool:
         outputList = self.decoded_output()
@@ -82,6 +277,8 @@ class DeviceSerial:
         '''log in (if not already)'''
         self.user = user
         self.password = password
+        # only the answer to the enters counts, not a prompt echoed before (e.g. with the reboot command)
+        self.flush_pending_output()
         self._ser.write(b'\n\n')
         if self.outputContains(PROMPT): 
             logger.info('Already logged in')
@@ -111,9 +308,13 @@ class DeviceSerial:
         '''
         reboots device, wait until login: prompt seen, then log again
         '''
+        self.invalidate_cache('reboot')
+        # SSH session won't survive the reboot
+        self.detachSSH()
+        mark = self.output_mark()
         self.enterString('reboot')
         # expected reboot time (to get to a login prompt) shouldn't be >1min
-        poll_wait_until(self.get_output_contains_function('login:'), 120)
+        self.wait_for_output('login:', 120, mark)
         if not self.login(self.user, self.password):
             logging.error('Login failed after 2 attempts!')
             sys.exit(1)
@@ -126,7 +327,7 @@ class DeviceSerial:
                 self.enterString('lxc-attach -n net -- systemctl stop ui')
         # poll/wait until device app IP shows up
         if waitForIP:
-            if not poll_wait_until(lambda : self.get_ip_addresses()[1] is not None, 100):
+            if None in self.wait_network_ready(100):
                 logging.warn('Did not see device IP, possibly problem with network interface')
         logging.info('Device rebooting done')
 
@@ -137,7 +338,7 @@ class DeviceSerial:
         '''
         netFile = '/etc/systemd/network/eth.network'
         if self.executeCommandAndVerifyOutput('grep -i dhcp ' + netFile, 'DHCP=', False):
-            if poll_wait_until(lambda : self.get_ip_addresses()[0] is not None, 50):
+            if self.get_ip_addresses(False, 50)[0] is not None:
                 logger.info('DHCP already setup')
                 return True
             else:
@@ -150,7 +351,7 @@ class DeviceSerial:
             logger.info('DHCP configured, rebooting to take effect...')
         self.reboot()
         logger.info('Rebooting done, check IP addresses again...')
-        if not poll_wait_until(lambda : self.get_ip_addresses()[0] is not None, 100):
+        if self.get_ip_addresses(False, 100)[0] is None:
             logger.error('Setup DHCP failed, maybe check network connection?')
             return False
         logger.info(f'Device IP setup via DHCP: {self.get_ip_addresses()[0]}')
@@ -158,10 +359,58 @@ class DeviceSerial:
 
     def poll_ip_addresses(self):
         '''Host(Driver) and net container IP addresses as tuple'''
-        self.enterString('lxc-ls -f')
+        ips = self._cached('ipAddresses', 
+                           lambda: self.parse_ip_addresses(self.commandOutput(IP_ADDRESSES_QUERY)),
+                           lambda ips: None not in ips)
+        if None not in ips:
+            self._lastIPs = ips
+        return ips
+
+    @staticmethod
+    def ssh_up(ips) -> bool:
+        '''TCP probe of SSH on driver IP'''
+        (driverIP, netIP) = ips
+        return port_is_open(driverIP, SSH_PORT)
+
+    def wait_network_ready(self, timeout = 300, discoveryTimeout = 60):
+        '''
+        waits until SSH (driver IP) accepts TCP connections,
+        returns (driverIP, netIP), (None, None) if no address could be found within discoveryTimeout
+        the last known addresses are probed first, serial (lxc-ls) discovery only runs
+        if there are none yet, or when they stop answering (addresses changed)
+        DEO isn't waited for, see wait_deo_ready()
+        '''
+        deadline = Deadline.of(timeout)
+        ips = self._lastIPs
+        if ips is not None:
+            if wait_until(lambda: self.ssh_up(ips), deadline.child(KNOWN_IP_PROBE_TIMEOUT), Backoff(1, 1.5, 5)):
+                logger.info(f'Network up at known addresses: {ips}')
+                return ips
+            logger.info(f'No answer at known addresses {ips}, looking them up again')
+            self.invalidate_cache('network not answering')
+        ips = self.get_ip_addresses(False, deadline.child(discoveryTimeout))
+        if None in ips:
+            return ips
+        if not wait_until(lambda: self.ssh_up(ips), deadline, Backoff(1, 1.5, 5)):
+            logger.warn(f'SSH port not answering at {ips[0]}')
+        return ips
+
+    @staticmethod
+    def wait_deo_ready(netIP: str, timeout = DEO_READY_TIMEOUT) -> bool:
+        '''waits until DEO (net IP) accepts TCP connections, False if it didn't within timeout'''
+        if netIP is None:
+            return False
+        if wait_until(lambda: port_is_open(netIP, DEO_PORT), timeout, Backoff(1, 1.5, 5)):
+            return True
+        logger.warn(f'DEO port not answering at {netIP}')
+        return False
+
+    @staticmethod
+    def parse_ip_addresses(lines: list):
+        '''Host(Driver) and net container IP addresses as tuple, out of lxc-ls -f output'''
         driverIP = None
         netIP = None
-        for line in self.decoded_output():
+        for line in lines:
             if line.startswith('driver'):
                 s = re.split(r',?\s+', line)[4]
                 if len(s) >= 7:
@@ -174,10 +423,9 @@ class DeviceSerial:
                     logger.debug(f"Appl IP: {s}")
         return (driverIP, netIP)
 
-    def get_ip_addresses(self, rebootIfNone:bool = False, timeout:int = 300):
-        # wait up to 300s for both IP addresses to show up
-        poll_wait_until(lambda : self.poll_ip_addresses()[0] is not None, timeout)
-        poll_wait_until(lambda : self.poll_ip_addresses()[1] is not None, timeout)
+    def get_ip_addresses(self, rebootIfNone:bool = False, timeout = 300):
+        # wait up to 300s (timeout may also be a Deadline shared with the caller) for both IP addresses to show up
+        wait_until(lambda : None not in self.poll_ip_addresses(), timeout)
         driverIP, netIP = self.poll_ip_addresses()
         if driverIP is not None and netIP is not None:
             # IP addresses found, do a quick ping out to Vista server
@@ -195,17 +443,45 @@ class DeviceSerial:
 
     def get_versions(self):
         '''Build/OS version strings as tuple'''
-        self.enterString('grep _VERSION /usr/local/etc/ProjectInfo.txt')
-        output = self.decoded_output()
-        logger.debug(output)
+        return self._cached('versions', 
+                            lambda: self.parse_versions(self.commandOutput(VERSIONS_QUERY)),
+                            lambda versions: versions[0] is not None)
+
+    @staticmethod
+    def parse_versions(lines: list):
+        '''Build/OS version strings as tuple, out of ProjectInfo.txt lines'''
         build = os_version = None
-        for line in output:
+        for line in lines:
             if 'BUILD_VERSION' in line:
                 build = line.split('"')[1]
             elif 'OS_VERSION' in line:
                 os_version = line.split('"')[1]
         return (build, os_version)
 
+    def get_device_state(self) -> DeviceState:
+        '''
+        build, os version, device type and IP addresses in a single serial round trip,
+        or none at all if all of it is cached
+        '''
+        cache = self._cache
+        if all(key in cache for key in ('versions', 'deviceTypes', 'ipAddresses')):
+            self.cacheHits += 1
+        else:
+            self.cacheMisses += 1
+            sections = self.queryBatch({'versions': VERSIONS_QUERY,
+                                        'deviceTypes': DEVICE_TYPE_QUERY,
+                                        'ipAddresses': IP_ADDRESSES_QUERY})
+            cache = {'versions': self.parse_versions(sections['versions']),
+                     'deviceTypes': self.parse_device_types(sections['deviceTypes']),
+                     'ipAddresses': self.parse_ip_addresses(sections['ipAddresses'])}
+            if cache['versions'][0] is not None and len(cache['deviceTypes']) > 0 and None not in cache['ipAddresses']:
+                self._cache = cache
+            if None not in cache['ipAddresses']:
+                self._lastIPs = cache['ipAddresses']
+        state = DeviceState(*cache['versions'], cache['deviceTypes'], *cache['ipAddresses'])
+        logger.info(state)
+        return state
+
     def output_nonempty(self) -> bool:
         '''
         small function retrieving and checking serial output buffer
@@ -228,7 +504,7 @@ class DeviceSerial:
 
     def killSoundPlayer(self) -> bool:
         logging.info('killing SoundlPlayer if present')
-        self.enterString('ps -ef|grep SoundPlayer|grep -v grep|awk \'{print "kill",$2}\'|sh')
+        self.runCommand('ps -ef|grep SoundPlayer|grep -v grep|awk \'{print "kill",$2}\'|sh')
         return False
 
     #
@@ -238,14 +514,15 @@ class DeviceSerial:
     # returns True/False indicating whether a reboot is needed for changes to take effect
     #
     def enableNTP(self, NTPtimeout: int = 45) -> bool:
-        ntpIsEnabled = self.bachExecuteCommand(f'grep EnableNTP {NETWORKINFO}.xml|grep -i true > /dev/null')
+        ntpIsEnabled = self.runCommand(f'grep EnableNTP {NETWORKINFO}.xml|grep -i true > /dev/null').succeeded
+        currentTimeout = None
         if NTPtimeout <= 0: 
             wantEnabled = False 
         else: 
             wantEnabled = True
             # get current NTPTimeoutSeconds setting
-            self.enterString(f'grep NTPTimeoutSeconds {NETWORKINFO}.xml|grep -oP \'(?<=value=")\d+\'')
-            outDigits = [out for out in self.decoded_output() if out.isdigit()]
+            result = self.runCommand(f'grep NTPTimeoutSeconds {NETWORKINFO}.xml|grep -oP \'(?<=value=")\d+\'')
+            outDigits = [out for out in result.stdout if out.isdigit()]
             if len(outDigits) == 0:
                 raise Exception(f'Unable to get NTPTimeoutSeconds value from {NETWORKINFO}.xml')
             currentTimeout = int(outDigits[0])
@@ -262,27 +539,29 @@ class DeviceSerial:
                 _from = 'false'
                 _to = 'true'
             logging.info(f'NTP set to: {wantEnabled}')
-            self.enterString(
+            self.runCommand(
                 f"sed -i 's/\(.*EnableNTP.*value=\"\){_from}\(.*\)/\\1{_to}\\2/' {NETWORKINFO}.xml")
-        if currentTimeout != NTPtimeout:
+        if wantEnabled and currentTimeout != NTPtimeout:
             logging.info(f'NTP timeout set to: {NTPtimeout}')
-            self.enterString(
+            self.runCommand(
                 f"sed -i 's/\(.*NTPTimeoutSeconds.*value=\"\).*\(\".*\)/\\1{NTPtimeout}\\2/' {NETWORKINFO}.xml")
-        self.enterString(f"sha256sum {NETWORKINFO}.xml > {NETWORKINFO}.sha256sum")
+        if not self.runCommand(f"sha256sum {NETWORKINFO}.xml > {NETWORKINFO}.sha256sum").succeeded:
+            logging.error(f'Failed to update {NETWORKINFO}.sha256sum')
 
         return True
 
     def setCPA(self, ip: str) -> bool:
         # check if Applcation xml file exists
-        if not self.bachExecuteCommand(f'[ -e {APPLICATION}.xml ]'):
+        if not self.runCommand(f'[ -e {APPLICATION}.xml ]').succeeded:
             logging.info(f'device does not have {APPLICATION}.xml')
             return False
-        if self.executeCommandAndVerifyOutput(f'grep -i IPAddress {APPLICATION}.xml', ip, False):
+        if any(ip in line for line in self.runCommand(f'grep -i IPAddress {APPLICATION}.xml').stdout):
             logging.info(f'CPA already set to: {ip}')
             return False
         logging.info(f'setting CPA to: {ip}')
-        self.enterString(
-            f"sed -i 's/\(IPAddress.*value=\"\).*\(\".*\)/\\1{ip}\\2/' {APPLICATION}.xml; sha256sum {APPLICATION}.xml > {APPLICATION}.sha256sum")
+        if not self.runCommand(
+            f"sed -i 's/\(IPAddress.*value=\"\).*\(\".*\)/\\1{ip}\\2/' {APPLICATION}.xml && sha256sum {APPLICATION}.xml > {APPLICATION}.sha256sum").succeeded:
+            logging.error(f'Failed to set CPA in {APPLICATION}.xml')
         return True
 
     def pingToRemote(self, remote: str = VISTA_SERVER) -> bool:
@@ -292,11 +571,11 @@ class DeviceSerial:
         this method is mainly used to mitigate (hopefully) network problems in Vista lab
         '''
         for i in range(3):
-            result1 = self.bachExecuteCommand(f'ping -c 3 {remote} > /dev/null')
+            result1 = self.runCommand(f'ping -c 3 {remote} > /dev/null', PING_TIMEOUT).succeeded
             if result1: break
             time.sleep(5)
         for i in range(3):
-            result2 = self.bachExecuteCommand(f'lxc-attach -n net -- ping -c 3 {remote} > /dev/null')
+            result2 = self.runCommand(f'lxc-attach -n net -- ping -c 3 {remote} > /dev/null', PING_TIMEOUT).succeeded
             if result2: break
             time.sleep(5)
         return result1 and result2
@@ -307,17 +586,90 @@ class DeviceSerial:
     # or to just check any output string (default: True)
     # contains expected string
     #
+    # returns as soon as the expected string shows up, or the prompt comes back without it
+    #
     def executeCommandAndVerifyOutput(self, commandString: str, outputString: str, exact: bool = True) -> bool:
-        self.enterString(commandString)
         if exact:
-            return self.outputContainsExact(outputString)
-        return self.outputContains(outputString)
+            pattern = '^' + re.escape(outputString) + '$'
+        else:
+            pattern = re.escape(outputString)
+        (matched, outputList) = self.sendCommand(commandString, pattern)
+        list(map(logging.info, outputList))
+        return matched
 
     #
     # executes the input bash command and return the exit status
     #
     def bachExecuteCommand(self, commandString: str) -> bool:
-        self.enterString(commandString)
-        if not commandString.strip().endswith('echo $?'):
-            commandString = commandString + '; echo $?'
-        return self.executeCommandAndVerifyOutput(commandString, '0')
\ No newline at end of file
+        return self.runCommand(commandString).succeeded
+
+    #
+    # SSH fast path: while an SSH session is attached and healthy, runCommand() goes through it,
+    # serial is used during boot, network outages, or once the session drops
+    #
+    def attachSSH(self, deviceSSH):
+        self._ssh = deviceSSH
+
+    def detachSSH(self):
+        self._ssh = None
+
+    def runCommand(self, commandString: str, timeout: float = EXPECT_TIMEOUT) -> CommandResult:
+        if self._ssh is not None:
+            if self._ssh.is_active():
+                try:
+                    return self._ssh.runCommand(commandString, timeout)
+                except Exception as e:
+                    logger.warning(f'SSH command failed ({e}), falling back to serial')
+            logger.info('SSH session no longer active, using serial')
+            self.detachSSH()
+        return self.runSerialCommand(commandString, timeout)
+
+    #
+    # executes the command framed by unique begin/end markers, the end marker carries the exit status,
+    # so output and exit status come back in a single round trip
+    # the end marker is printed after a newline, so it starts a line even after output without a trailing newline
+    #
+    def runSerialCommand(self, commandString: str, timeout: float = EXPECT_TIMEOUT) -> CommandResult:
+        tag = uuid.uuid4().hex[:8]
+        begin = f'__BEGIN_{tag}__'
+        end = f'__END_{tag}_'
+        start = time.time()
+        (matched, lines) = self.sendCommand(f"echo {begin}; {commandString}; printf '\\n{end}%d__\\n' $?", 
+                                            f'^{end}\\d+__$', timeout)
+        elapsed = time.time() - start
+        if not matched:
+            logging.error(f'Command did not finish within {timeout}s: {commandString}')
+            return CommandResult(lines, None, elapsed)
+        exitCode = int(lines[-1][len(end):-2])
+        stdout = _strip_echo(lines[lines.index(begin) + 1:-1] if begin in lines else lines[:-1])
+        logger.debug(f'exit code {exitCode} after {elapsed:.2f}s: {commandString}')
+        return CommandResult(stdout, exitCode, elapsed)
+
+    #
+    # runs several named queries as one compound command line, each one's output preceded by a section marker
+    # returns dict of query name => output lines
+    #
+    def queryBatch(self, queries: dict, timeout: float = EXPECT_TIMEOUT) -> dict:
+        tag = uuid.uuid4().hex[:8]
+        marker = lambda name: f'__Q_{tag}_{name}__'
+        endMarker = f'__Q_{tag}__'
+        # echo before every marker, a query's output without a trailing newline doesn't swallow the next one
+        result = self.runCommand(''.join(f'echo {marker(name)}; {query}; echo; ' for (name, query) in queries.items())
+                                 + f'echo {endMarker}', timeout)
+        sections = {}
+        current = None
+        for line in result.stdout:
+            names = [name for name in queries if line == marker(name)]
+            if len(names) > 0 or line == endMarker:
+                if current is not None:
+                    sections[current] = _strip_echo(sections[current])
+                current = names[0] if len(names) > 0 else None
+                if current is not None:
+                    sections[current] = []
+            elif current is not None:
+                sections[current].append(line)
+        for name in queries:
+            if name not in sections:
+                logger.warning(f'No output section for query {name}')
+                sections[name] = []
+        return sections
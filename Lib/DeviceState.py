@@ -0,0 +1,15 @@
+from typing import NamedTuple
+
+class DeviceState(NamedTuple):
+    """device build/type/network state, as read in one go by DeviceSerial.get_device_state()"""
+
+    build: str
+    os_version: str
+    # deviceType values found in the protocol files
+    device_types: tuple
+    driver_ip: str
+    net_ip: str
+
+    def has_device_type(self, deviceType: str) -> bool:
+        '''case insensitive, like grep -i on the protocol files'''
+        return any(deviceType.lower() in t.lower() for t in self.device_types)
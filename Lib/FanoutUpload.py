@@ -0,0 +1,171 @@
+import logging
+import collections
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from Lib.Artifacts import Sha256Cache, ArtifactVerificationError
+
+logger = None
+
+# read/send unit
+CHUNK_SIZE = 4 * 1024 * 1024
+# most recent chunks kept in memory, targets further behind read them back from the local spool file
+WINDOW_CHUNKS = 16
+# seconds between progress log lines
+PROGRESS_INTERVAL = 10
+
+class FanoutUpload:
+    """
+    uploads one artifact to many devices, reading the source (build share) only once
+
+    a reader thread streams the source into a local spool file plus an in-memory window of recent chunks,
+    one sender thread per target writes the chunks to its device over SFTP at its own pace:
+    a slow device only falls behind (and reads from the spool), it never holds up the reader or the other targets
+    so the share is read once and the wall clock time is that of the slowest device
+    """
+
+    def __init__(self, sourceFile: str, chunkSize: int = CHUNK_SIZE, windowChunks: int = WINDOW_CHUNKS,
+                 hashCache: Sha256Cache = None):
+        self._sourceFile = sourceFile
+        self._chunkSize = chunkSize
+        self._windowChunks = windowChunks
+        self._hashCache = hashCache if hashCache is not None else Sha256Cache()
+        self._cond = threading.Condition()
+        # offset -> chunk, most recent windowChunks chunks
+        self._window = collections.OrderedDict()
+        # bytes read from the source so far (all in the spool file)
+        self._available = 0
+        self._done = False
+        self._readError = None
+        self._sha256 = None
+        self._spoolFile = None
+        # target name -> bytes sent
+        self._sent = {}
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+
+    def upload(self, targets: dict) -> dict:
+        '''
+        targets - name -> (deviceSSH, remoteFile)
+        returns name -> None if the target got a verified copy (or already had it), the exception otherwise
+        '''
+        results = {}
+        # skip targets already holding the content, only if the source sha256 is known without reading it
+        knownSha256 = self._hashCache.peek(self._sourceFile)
+        if knownSha256 is not None:
+            for (name, (deviceSSH, remoteFile)) in list(targets.items()):
+                if deviceSSH.remoteSha256(remoteFile) == knownSha256:
+                    logger.info(f'{name}: {remoteFile} already identical to {self._sourceFile}, skipping')
+                    results[name] = None
+            targets = {name: target for (name, target) in targets.items() if name not in results}
+        if len(targets) == 0:
+            return results
+
+        spoolDir = tempfile.mkdtemp(prefix='fanout')
+        self._spoolFile = os.path.join(spoolDir, os.path.basename(self._sourceFile))
+        # senders open it right away, the reader fills it
+        open(self._spoolFile, 'wb').close()
+        size = os.path.getsize(self._sourceFile)
+        # every key set before the senders start: they only update values while the progress log iterates
+        self._sent = {name: 0 for name in targets}
+        reader = threading.Thread(target=self._read, name='FanoutReader', daemon=True)
+        senders = {name: threading.Thread(target=self._sendTarget, args=(name, deviceSSH, remoteFile, results),
+                                          name=f'Fanout-{name}', daemon=True)
+                   for (name, (deviceSSH, remoteFile)) in targets.items()}
+        try:
+            start = time.time()
+            reader.start()
+            for sender in senders.values():
+                sender.start()
+            while True:
+                alive = [sender for sender in senders.values() if sender.is_alive()]
+                if len(alive) == 0:
+                    break
+                alive[0].join(PROGRESS_INTERVAL)
+                elapsed = max(time.time() - start, 1e-3)
+                logger.info(f'Fan-out of {os.path.basename(self._sourceFile)}: read {self._available}/{size}, ' +
+                            ', '.join(f'{name} {sent * 100 // max(size, 1)}% {sent / elapsed / 1e6:.2f} MB/s'
+                                      for (name, sent) in self._sent.items()))
+            reader.join()
+        finally:
+            shutil.rmtree(spoolDir, ignore_errors=True)
+        if self._readError is None:
+            self._hashCache.put(self._sourceFile, self._sha256)
+        # all transfers done, check every copy
+        for (name, (deviceSSH, remoteFile)) in targets.items():
+            if results.get(name) is not None:
+                logger.error(f'{name}: upload of {self._sourceFile} failed: {results[name]}')
+                continue
+            try:
+                remoteSha256 = deviceSSH.remoteSha256(remoteFile)
+                if remoteSha256 != self._sha256:
+                    raise ArtifactVerificationError(
+                        f'{name}: {remoteFile} sha256 {remoteSha256} does not match {self._sourceFile} sha256 {self._sha256}')
+                logger.info(f'{name}: {remoteFile} upload verified, sha256 {self._sha256}')
+                results[name] = None
+            except Exception as e:
+                logger.error(str(e))
+                results[name] = e
+        return results
+
+    def _read(self):
+        sha = hashlib.sha256()
+        try:
+            with open(self._sourceFile, 'rb') as source, open(self._spoolFile, 'r+b') as spool:
+                for chunk in iter(lambda: source.read(self._chunkSize), b''):
+                    spool.write(chunk)
+                    # in the spool before it's announced, senders behind the window read it back from there
+                    spool.flush()
+                    sha.update(chunk)
+                    with self._cond:
+                        self._window[self._available] = chunk
+                        while len(self._window) > self._windowChunks:
+                            self._window.popitem(last=False)
+                        self._available += len(chunk)
+                        self._cond.notify_all()
+            self._sha256 = sha.hexdigest()
+        except Exception as e:
+            self._readError = e
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def _nextChunk(self, offset: int, spool) -> bytes:
+        '''chunk at offset, waits for the reader if needed, empty once all is sent'''
+        with self._cond:
+            self._cond.wait_for(lambda: self._available > offset or self._done)
+            if self._readError is not None:
+                raise self._readError
+            if offset >= self._available:
+                return b''
+            chunk = self._window.get(offset)
+            available = self._available
+        if chunk is None:
+            # fell behind the memory window
+            spool.seek(offset)
+            chunk = spool.read(min(self._chunkSize, available - offset))
+        return chunk
+
+    def _sendTarget(self, name: str, deviceSSH, remoteFile: str, results: dict):
+        try:
+            sftp = deviceSSH.open_sftp()
+            try:
+                with open(self._spoolFile, 'rb') as spool, sftp.open(remoteFile, 'wb') as remote:
+                    remote.set_pipelined(True)
+                    offset = 0
+                    for chunk in iter(lambda: self._nextChunk(offset, spool), b''):
+                        remote.write(chunk)
+                        remote.flush()
+                        # a round trip per chunk, keeps this target's queue of unacknowledged writes bounded
+                        remote.stat()
+                        offset += len(chunk)
+                        self._sent[name] = offset
+            finally:
+                sftp.close()
+        except Exception as e:
+            results[name] = e
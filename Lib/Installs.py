@@ -3,11 +3,29 @@ import sys
 import logging
 from Lib.DeviceSerial import DeviceSerial
 from Lib.DeviceSSH import DeviceSSH
+from Lib.SSHSessionManager import SSHSessionManager
 from Lib.Config import Config
 from Lib.DeoWebSocket import DeoWebSocket
+from Lib.DeltaUpload import SignatureCache
 from utils import *
 
-def updateDevice(deviceSerial: DeviceSerial, deviceSSH: DeviceSSH, updateDevicePath:str, postProcessFunctions:list = []):
+def uploadUpdateDevice(deviceSSH: DeviceSSH, updateDevicePath: str, delta: bool = False) -> bool:
+    '''
+    uploads updateDevice file, True if anything was sent
+    delta - only send what changed since the last one (see DeviceSSH.upload_artifact), consecutive builds
+            mostly share content, but finding the changes costs host CPU time on builds that don't
+    '''
+    logging.debug(f'Uploading {updateDevicePath} to {Config.DEVICE_UPDATE_PATH}')
+    return deviceSSH.upload_artifact(updateDevicePath, Config.DEVICE_UPDATE_PATH,
+                                     signatures=SignatureCache() if delta else None)
+
+def uploadMender(deviceSSH: DeviceSSH, menderPath: str) -> bool:
+    '''uploads mender file, True if anything was sent'''
+    logging.debug(f'Uploading {menderPath} to {Config.DEVICE_MENDER_PATH}')
+    return deviceSSH.upload_artifact(menderPath, Config.DEVICE_MENDER_PATH)
+
+def updateDevice(deviceSerial: DeviceSerial, deviceSSH: DeviceSSH, updateDevicePath:str, postProcessFunctions:list = [],
+                 upload: bool = True, delta: bool = False):
     '''
     Function to perform an updateDevice
     Inputs:
@@ -16,26 +34,33 @@ def updateDevice(deviceSerial: DeviceSerial, deviceSSH: DeviceSSH, updateDeviceP
     * updateDevicePath - full path/name to updateDevice file
     * [Optional] postProcessFunctions - list of functions to be executed after install
                     each function should take no argument and return bool indicating whether any changes were made
+    * [Optional] upload - False if the file was already uploaded (uploadUpdateDevice)
+    * [Optional] delta - upload as a block delta, see uploadUpdateDevice
 
     '''
 
-    remotePath = Config.DEVICE_UPDATE_PATH
-    logging.debug(f'Uploading {updateDevicePath} to {remotePath}')
-    deviceSSH.removeRemoteFile(remotePath) # make sure no existing file there
-    deviceSSH.upload_file(updateDevicePath, remotePath)
+    # device build changes from here on
+    deviceSerial.invalidate_cache('updateDevice')
+    if upload:
+        # skipped if the identical file is already there (e.g. from an aborted earlier attempt)
+        uploadUpdateDevice(deviceSSH, updateDevicePath, delta)
 
     # upload done, first reboot, deviceSSH will lose connection
     logging.info('Uploading done, proceed to 1st reboot')
+    deviceSerial.detachSSH()
     # first reboot won't see any IP addresses assigned
+    mark = deviceSerial.output_mark()
     deviceSerial.reboot(True, False)
     # wait for update device process to start, up to a minute and half
-    poll_wait_until(deviceSerial.get_output_contains_function('Reboot when ready'), 90)
+    # (marker may have already shown up while rebooting, hence the mark)
+    deviceSerial.wait_for_output('Reboot when ready', 90, mark)
 
     [x() for x in postProcessFunctions]
     # 2nd reboot, we expect IP addresses now
     deviceSerial.reboot()
 
-def menderInstall(deviceSerial: DeviceSerial, deviceSSH: DeviceSSH, menderPath:str, postProcessFunctions:list = []):
+def menderInstall(deviceSerial: DeviceSerial, deviceSSH: DeviceSSH, menderPath:str, postProcessFunctions:list = [],
+                  upload: bool = True, reboot: bool = True) -> bool:
     '''
     Function to perform a mender install
     * deviceSerial
@@ -43,34 +68,65 @@ def menderInstall(deviceSerial: DeviceSerial, deviceSSH: DeviceSSH, menderPath:s
     * menderPath - full path/name to mender file
     * [Optional] postProcessFunctions - list of functions to be executed after install
                     each function should take no argument and return bool indicating whether any changes were made
+    * [Optional] upload - False if the file was already uploaded (uploadMender)
+    * [Optional] reboot - False to leave the reboot applying post processing changes to an install following
+                    right after (updateDevice reboots twice anyway)
+    returns True if post processing made changes still waiting for that reboot (reboot False)
     '''
 
-    # upload device.mender
-    remotePath = Config.DEVICE_MENDER_PATH
-    logging.debug(f'Uploading {menderPath} to {remotePath}')
-    deviceSSH.removeRemoteFile(remotePath) # make sure no existing file there
-    deviceSSH.upload_file(menderPath, remotePath)
+    # device build changes from here on
+    deviceSerial.invalidate_cache('menderInstall')
+    if upload:
+        # skipped if the identical file is already there (e.g. from an aborted earlier attempt)
+        uploadMender(deviceSSH, menderPath)
 
     # upload done, start request mender script
     logging.info('Uploading done, start mender install')
+    # mender reboots the device, deviceSSH will lose connection
+    deviceSerial.detachSSH()
+    mark = deviceSerial.output_mark()
     deviceSerial.enterString('/usr/local/sbin/requestMenderUpdate.sh')
 
     # first wait until message of Mender succeeded, before reboot
     waitForMenderSucceeded = 36000
-    if not poll_wait_until(deviceSerial.get_output_contains_function('menderCommonPostInstall'), waitForMenderSucceeded):
+    if deviceSerial.wait_for_output('menderCommonPostInstall', waitForMenderSucceeded, mark) is None:
         logging.error(f'Failed to get to Mender succeeded message after {waitForMenderSucceeded}s')
         sys.exit(1)
     # second message comes after a reboot
     waitForMenderCommit = 150
-    if not poll_wait_until(deviceSerial.get_output_contains_function('Mender commit succeeded'), waitForMenderCommit):
+    if deviceSerial.wait_for_output('Mender commit succeeded', waitForMenderCommit, mark) is None:
         logging.warn(f'Failed to get to Mender commit message after {waitForMenderCommit}s')
         logging.warn('Unable to verify Mender commit')
-    # should be ready for login at this point
+    # should be ready for login at this point, anything read during the install is stale
+    deviceSerial.invalidate_cache('menderInstall')
     if not deviceSerial.login():
         logging.error('Login failed after 2 attempts!')
         sys.exit(1)
 
-    if any([x() for x in postProcessFunctions]):
+    changed = any([x() for x in postProcessFunctions])
+    if changed and reboot:
         # 2nd reboot for post processing to take effect, and make sure partition switch stuck
         deviceSerial.reboot()
+    return changed and not reboot
 
+def reconnect(deviceSerial: DeviceSerial, user: str, password: str, timeout: int = 300, 
+              sessions: SSHSessionManager = None, device: str = None):
+    '''
+    Function to get back on the network after a (re)boot
+    waits for SSH to answer (setting up DHCP if no IP address shows up at all),
+    then logs in over SSH and attaches the session to deviceSerial
+    * [Optional] sessions, device - reuse (reconnect) the device's session kept by the session manager
+                    instead of opening a new one
+    returns (deviceIP, netIP, deviceSSH)
+    '''
+    (deviceIP, netIP) = deviceSerial.wait_network_ready(timeout)
+    if deviceIP == netIP == None:
+        # no IP addresses at all seen, try setting up DHCP
+        if not deviceSerial.setup_dhcp_network(): sys.exit(1)
+        (deviceIP, netIP) = deviceSerial.wait_network_ready(timeout)
+    if sessions is not None:
+        deviceSSH = sessions.session(device, deviceIP, user, password)
+    else:
+        deviceSSH = DeviceSSH(deviceIP, user, password)
+    deviceSerial.attachSSH(deviceSSH)
+    return (deviceIP, netIP, deviceSSH)
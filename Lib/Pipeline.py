@@ -0,0 +1,101 @@
+import logging
+import json
+import os
+import time
+
+logger = None
+
+class Pipeline:
+    """
+    runs named steps in order, persisting each step's outcome to a checkpoint file
+
+    a step is a function returning a json-serializable dict (its result), with 'failed': True if it didn't succeed
+    when resuming, a step that completed in the checkpointed run is skipped (its recorded result returned)
+    provided verify(result) confirms the device still is in that state; failed or unverified steps run again
+    a step interrupted mid-way (e.g. host crash during an install) is skipped too if verify confirms its expected result
+    the checkpoint only applies to a run with the same identity (e.g. same requested builds and settings)
+    """
+
+    def __init__(self, checkpointFile: str, identity: dict, resume: bool = False):
+        self._checkpointFile = checkpointFile
+        self._identity = identity
+        self._steps = {}
+        # steps skipped thanks to the checkpoint
+        self.resumed = []
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+        #
+        if resume:
+            checkpoint = self._load()
+            if checkpoint is None:
+                logger.info(f'No checkpoint {checkpointFile}, starting from the beginning')
+            elif checkpoint['identity'] != identity:
+                logger.warning(f'Checkpoint {checkpointFile} is for a different run ({checkpoint["identity"]}), '
+                               'starting from the beginning')
+            else:
+                self._steps = checkpoint['steps']
+                logger.info(f'Resuming from checkpoint, steps completed: '
+                            f'{[name for (name, step) in self._steps.items() if step["status"] == "done"]}')
+        self._save()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self._checkpointFile):
+            return None
+        try:
+            with open(self._checkpointFile, 'rt') as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning(f'Ignoring corrupt checkpoint {self._checkpointFile}')
+            return None
+
+    def _save(self):
+        # write then rename, a crash mid-write must not lose the previous checkpoint
+        tmpFile = self._checkpointFile + '.tmp'
+        with open(tmpFile, 'wt') as f:
+            json.dump({'identity': self._identity, 'steps': self._steps}, f, indent=1)
+        os.replace(tmpFile, self._checkpointFile)
+
+    def done(self, name: str) -> bool:
+        '''whether step completed (in this run or the checkpointed one)'''
+        step = self._steps.get(name)
+        return step is not None and step['status'] == 'done'
+
+    def result(self, name: str) -> dict:
+        '''result of a step, None if it hasn't run'''
+        step = self._steps.get(name)
+        return step['result'] if step is not None else None
+
+    def step(self, name: str, func, verify=None, expected: dict = None) -> dict:
+        '''
+        runs step name (func) unless already done and verify(recorded result) agrees, returns the step result
+        verify - None to trust the checkpoint as is
+        expected - result the step should produce, checkpointed while it runs: if the run got interrupted
+                   during the step, verify(expected) confirming the device state counts the step as done
+        '''
+        step = self._steps.get(name)
+        if self.done(name):
+            result = step['result']
+            if verify is None or verify(result):
+                logger.info(f'Step {name}: already done, skipping')
+                self.resumed.append(name)
+                return result
+            logger.info(f'Step {name}: recorded as done, but the device state does not confirm it, running again')
+        elif step is not None and step['status'] == 'running' and verify is not None and step.get('expected'):
+            if verify(step['expected']):
+                logger.info(f'Step {name}: interrupted, but the device state confirms it completed, skipping')
+                self._steps[name] = {'status': 'done', 'result': step['expected'], 'start': step['start']}
+                self._save()
+                self.resumed.append(name)
+                return step['expected']
+            logger.info(f'Step {name}: interrupted and the device state does not confirm it, running again')
+        logger.info(f'Step {name}: running')
+        start = time.time()
+        self._steps[name] = {'status': 'running', 'result': None, 'expected': expected, 'start': start}
+        self._save()
+        result = func()
+        self._steps[name] = {'status': 'failed' if result.get('failed') else 'done', 'result': result,
+                             'start': start, 'elapsed': time.time() - start}
+        self._save()
+        logger.info(f'Step {name}: {self._steps[name]["status"]} in {time.time() - start:.0f}s')
+        return result
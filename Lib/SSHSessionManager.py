@@ -0,0 +1,76 @@
+import logging
+import threading
+from Lib.DeviceSSH import DeviceSSH, SSH_PORT
+from utils import *
+
+logger = None
+# seconds between checks of the sessions
+MONITOR_INTERVAL = 5
+
+class SSHSessionManager:
+    """
+    one persistent DeviceSSH session per device (key is up to the caller, e.g. DEVICE name)
+    a monitor thread notices sessions dropped (device rebooted) and reconnects them
+    in the background as soon as port 22 accepts connections again
+    """
+
+    def __init__(self, monitorInterval: float = MONITOR_INTERVAL):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._monitorInterval = monitorInterval
+        self._monitor = threading.Thread(target=self._monitorSessions, name='SSHSessionMonitor', daemon=True)
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+        #
+        self._monitor.start()
+
+    def session(self, device: str, IP: str, user: str, password: str) -> DeviceSSH:
+        '''
+        returns the session for device, connecting it if needed
+        existing session is reused if still alive, reconnected (to the new IP if it changed) otherwise
+        '''
+        with self._lock:
+            deviceSSH = self._sessions.get(device)
+            if deviceSSH is None:
+                deviceSSH = DeviceSSH(IP, user, password)
+                self._sessions[device] = deviceSSH
+                return deviceSSH
+        if deviceSSH.IP != IP:
+            logger.info(f'{device} address changed {deviceSSH.IP} => {IP}, reconnecting')
+            deviceSSH.reconnect(IP)
+        elif not deviceSSH.is_active():
+            logger.info(f'{device} SSH session dropped, reconnecting')
+            deviceSSH.reconnect()
+        return deviceSSH
+
+    def get(self, device: str) -> DeviceSSH:
+        '''session for device, None if there is none'''
+        with self._lock:
+            return self._sessions.get(device)
+
+    def _monitorSessions(self):
+        while not self._stopping.wait(self._monitorInterval):
+            with self._lock:
+                sessions = list(self._sessions.items())
+            for (device, deviceSSH) in sessions:
+                if deviceSSH.is_active() or not port_is_open(deviceSSH.IP, SSH_PORT):
+                    continue
+                try:
+                    logger.info(f'{device} SSH port open again, reconnecting in background')
+                    deviceSSH.reconnect()
+                except Exception as e:
+                    # services may still be starting, try again on next check
+                    logger.debug(f'{device} background reconnect failed: {e}')
+
+    def close(self, device: str = None):
+        '''closes session of device, or all sessions (and stops monitoring) if no device given'''
+        with self._lock:
+            if device is not None:
+                devices = [device] if device in self._sessions else []
+            else:
+                devices = list(self._sessions)
+                self._stopping.set()
+            for d in devices:
+                self._sessions.pop(d).close()
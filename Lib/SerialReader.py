@@ -0,0 +1,163 @@
+import logging
+import threading
+import collections
+import time
+import re
+
+logger = None
+
+# number of lines kept in the ring buffer
+RING_SIZE = 10000
+
+class Subscription:
+    """one-shot wait on a line matching a regex pattern"""
+
+    def __init__(self, pattern: str):
+        self.regex = re.compile(pattern)
+        self.event = threading.Event()
+        # (seq, timestamp, line) of the line that matched
+        self.match = None
+
+    def _check(self, seq: int, timestamp: float, line: str) -> bool:
+        if self.regex.search(line):
+            self.match = (seq, timestamp, line)
+            self.event.set()
+            return True
+        return False
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.event.wait(timeout)
+
+
+class SerialReader(threading.Thread):
+    """
+    drains a serial port continuously into a bounded, timestamped ring buffer
+    lines are stored as (seq, timestamp, line), seq increasing by 1 for every line
+    the incomplete last line (e.g. a prompt) is kept separately, see partial()
+    """
+
+    def __init__(self, ser, ringSize: int = RING_SIZE):
+        super().__init__(name=f'SerialReader-{ser.port}', daemon=True)
+        self._ser = ser
+        self._lines = collections.deque(maxlen=ringSize)
+        self._seq = 0
+        self._partial = ''
+        # bumped on every chunk of data received, see wait_for_data()
+        self._version = 0
+        self._cond = threading.Condition()
+        self._subscriptions = []
+        # persistent (regex, callback) pairs, see watch()
+        self._watchers = []
+        self._stopping = threading.Event()
+        #
+        global logger
+        logger = logging.getLogger(__name__)
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                # blocks (up to the port timeout) only while nothing at all is available
+                data = self._ser.read(self._ser.in_waiting or 1)
+            except Exception as e:
+                if not self._stopping.is_set():
+                    logger.error(f'Serial reader stopped: {e}')
+                break
+            if len(data) > 0:
+                self._feed(data.decode('ISO-8859-1'))
+
+    def stop(self):
+        self._stopping.set()
+
+    def _feed(self, text: str):
+        with self._cond:
+            self._partial += text
+            *complete, self._partial = self._partial.split('\n')
+            now = time.time()
+            for line in complete:
+                self._seq += 1
+                line = line.strip()
+                self._lines.append((self._seq, now, line))
+                self._notify(self._seq, now, line)
+            # prompts ('login: ', 'root@...# ') never get a newline, check them too
+            if len(self._partial.strip()) > 0:
+                self._notify(self._seq, now, self._partial.strip())
+            self._version += 1
+            self._cond.notify_all()
+
+    def _notify(self, seq: int, timestamp: float, line: str):
+        self._subscriptions = [s for s in self._subscriptions if not s._check(seq, timestamp, line)]
+        for (regex, callback) in self._watchers:
+            if regex.search(line):
+                callback(line)
+
+    def mark(self) -> int:
+        '''seq of the last complete line received, use as "since" to look only at newer lines'''
+        with self._cond:
+            return self._seq
+
+    def version(self) -> int:
+        with self._cond:
+            return self._version
+
+    def partial(self) -> str:
+        with self._cond:
+            return self._partial
+
+    def lines_since(self, since: int) -> list:
+        '''(seq, timestamp, line) for all buffered lines newer than since'''
+        with self._cond:
+            if len(self._lines) > 0 and self._lines[0][0] > since + 1:
+                logger.warning(f'Ring buffer overrun, {self._lines[0][0] - since - 1} lines lost')
+            return [entry for entry in self._lines if entry[0] > since]
+
+    def snapshot(self, since: int):
+        '''(version, lines newer than since, partial line) read consistently'''
+        with self._cond:
+            return (self._version, [entry for entry in self._lines if entry[0] > since], self._partial)
+
+    def wait_for_data(self, version: int, timeout: float) -> bool:
+        '''blocks until data newer than snapshot version arrived, or timeout'''
+        with self._cond:
+            return self._cond.wait_for(lambda: self._version != version, timeout)
+
+    def subscribe(self, pattern: str, since: int = None) -> Subscription:
+        '''
+        registers regex pattern, subscription event fires the moment a matching line arrives
+        since - also match lines already buffered after this mark (no race with a command just sent)
+        '''
+        subscription = Subscription(pattern)
+        with self._cond:
+            if since is not None:
+                for entry in self._lines:
+                    if entry[0] > since and subscription._check(*entry):
+                        return subscription
+                if len(self._partial.strip()) > 0 and subscription._check(self._seq, time.time(), self._partial.strip()):
+                    return subscription
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._cond:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def watch(self, pattern: str, callback):
+        '''
+        calls callback(line) for every line matching regex pattern, from the reader thread,
+        so callback should be quick
+        '''
+        with self._cond:
+            self._watchers.append((re.compile(pattern), callback))
+
+    def wait_for(self, pattern: str, timeout: float, since: int = None):
+        '''
+        blocks until a line matching pattern arrives (or was buffered after since)
+        returns the matching line, None on timeout
+        '''
+        subscription = self.subscribe(pattern, since)
+        try:
+            if subscription.wait(timeout):
+                return subscription.match[2]
+            return None
+        finally:
+            self.unsubscribe(subscription)
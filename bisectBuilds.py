@@ -0,0 +1,105 @@
+#
+# Script to find the first bad dev build between a known good and a known bad one,
+# installing builds on the device in binary search order and running a health check after each install
+#
+# (not named bisect.py, that would shadow the standard library module)
+#
+
+import sys
+import os
+import logging
+import argparse
+import subprocess
+from Lib.DeviceSerial import DeviceSerial
+from Lib.Config import Config
+from Lib.DeoWebSocket import DeoWebSocket
+from Lib.Installs import *
+from Lib.SSHSessionManager import SSHSessionManager
+from Lib.Artifacts import ArtifactCache
+from Lib.Bisect import bisect_builds
+from utils import *
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to bisect dev builds on a device, requires serial and ssh access'
+        )
+    aparser.add_argument('device', help='specify device type: ORION, FINIA, ERIC, CWCE, etc')
+    aparser.add_argument('-g', '--good', dest='goodBuild', required=True, help='dev build known to be good')
+    aparser.add_argument('-b', '--bad', dest='badBuild', help='dev build known to be bad, latest dev build if not given')
+    aparser.add_argument('--check', dest='check', choices=['alarm', 'sanity', 'command'], default='alarm',
+                         help='health check after each install: no DEO alarms (default), '
+                              'tests/pytest_<DEVICE>_sanity.py passing, or --command exiting with 0')
+    aparser.add_argument('--command', dest='command', help='host command for --check command')
+    aparser.add_argument('-p', '--pollTime', dest='pollTime', type=int, default=200,
+                         help='seconds to watch for DEO alarms for --check alarm')
+    aparser.add_argument('-n', '--noTestInstall', dest='noTestInstall', action='store_true',
+                         help='install regular instead of test build (TORION, TFINIA, etc)')
+    aparser.add_argument('-s', '--serial', dest='serial', help="serial port to connect to device overrides what's in <DEVICE.INI> file")
+    return aparser.parse_args()
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.check == 'command' and not args.command:
+        logging.error('--check command needs --command')
+        sys.exit(-1)
+
+    DEVICE = args.device.upper()
+    configs = Config(DEVICE + '.INI')
+    badBuild = args.badBuild if args.badBuild else configs.get_latest_dev_build_version()
+    builds = configs.get_dev_builds_between(args.goodBuild, badBuild)
+    if args.goodBuild not in builds or badBuild not in builds:
+        logging.error(f'Dev builds {args.goodBuild} and {badBuild} must both exist')
+        sys.exit(-1)
+    logging.info(f'{len(builds) - 2} dev builds between good {args.goodBuild} and bad {badBuild}')
+
+    deviceSerial = DeviceSerial(args.serial if args.serial else configs[Config.SERIAL_PORT])
+    deviceSerial.login(configs[Config.USER], configs[Config.PASSWORD])
+    sshSessions = SSHSessionManager()
+    artifactCache = ArtifactCache.from_config(configs)
+    # network state changes with every install
+    state = {}
+    (state['deviceIP'], state['netIP'], state['deviceSSH']) = reconnect(
+        deviceSerial, configs[Config.USER], configs[Config.PASSWORD], sessions=sshSessions, device=DEVICE)
+
+    def restoreEth():
+        deviceSerial.runCommand('cp /data/eth.network /etc/systemd/network/')
+        return True
+
+    def healthCheck() -> bool:
+        if args.check == 'alarm':
+            return not DeoWebSocket.pollDeoAlarm(state['netIP'], args.pollTime)
+        if args.check == 'sanity':
+            sanity = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', f'pytest_{DEVICE}_sanity.py')
+            return subprocess.run([sys.executable, '-m', 'pytest', sanity]).returncode == 0
+        return subprocess.run(args.command, shell=True).returncode == 0
+
+    def isGood(version: str):
+        updateDevicePath = configs.get_dev_build_updateDevice_path(version)
+        if not args.noTestInstall:
+            updateDevicePath += f'_T{DEVICE}'
+        deviceSerial.runCommand('cp /etc/systemd/network/eth.network /data/')
+        updateDevice(deviceSerial, state['deviceSSH'], artifactCache.local_path(updateDevicePath), [restoreEth])
+        (state['deviceIP'], state['netIP'], state['deviceSSH']) = reconnect(
+            deviceSerial, configs[Config.USER], configs[Config.PASSWORD], sessions=sshSessions, device=DEVICE)
+        installed = deviceSerial.get_versions()[0]
+        if installed != version:
+            logging.warning(f'Device on {installed} after installing {version}, install failed?')
+            return None
+        good = healthCheck()
+        logging.info(f'Build {version} is {"good" if good else "BAD"}')
+        return good
+
+    result = bisect_builds(builds, args.goodBuild, badBuild, isGood)
+
+    logging.info("\n======================================================\nBisect result\n")
+    for (version, good) in result.tested.items():
+        logging.info(f'  {version}: {"untestable" if good is None else "good" if good else "bad"}')
+    logging.info(f'Last good build: {result.lastGood}')
+    logging.info(f'First bad build: {result.firstBad}')
+    if len(result.untestable) > 0:
+        logging.warning(f'Builds that could not be tested, any of them may be the first bad one: {result.untestable}')
+    sshSessions.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#
+# Script to run regr.py on devices as soon as a new dev/rel build shows up on the build share,
+# instead of at fixed times, see Lib/BuildWatcher.py
+#
+# run from the folder holding the <DEVICE>.INI files (as the batch files do), exit with Ctrl-c
+#
+
+import logging
+import argparse
+import shlex
+from Lib.Config import Config
+from Lib.BuildWatcher import BuildWatcher, RegressionRunner, WATCH_INTERVAL, STABLE_SECONDS
+from utils import *
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to start regressions on devices whenever a new build is complete on the build share'
+        )
+    aparser.add_argument('devices', nargs='+', help='devices to run regressions on: ORION, FINIA, ERIC, CWCE, etc')
+    aparser.add_argument('-a', '--regrArgs', dest='regrArgs', action='append', default=[],
+                         help='extra regr.py arguments for a device, e.g. -a "CWCE=-s COM4 --ntp off --cpa 10.183.129.106"')
+    aparser.add_argument('-i', '--interval', dest='interval', type=float, default=WATCH_INTERVAL,
+                         help='seconds between checks of the build share')
+    aparser.add_argument('--stable', dest='stableSeconds', type=float, default=STABLE_SECONDS,
+                         help='seconds an artifact must stay unchanged to be taken as complete')
+    return aparser.parse_args()
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    devices = [device.upper() for device in args.devices]
+    regrArgs = {}
+    for deviceArgs in args.regrArgs:
+        (device, extra) = deviceArgs.split('=', 1)
+        regrArgs[device.upper()] = shlex.split(extra)
+
+    runner = RegressionRunner(regrArgs)
+    watcher = BuildWatcher({device: Config(device + '.INI') for device in devices}, runner.submit,
+                           args.interval, args.stableSeconds)
+    watcher.start()
+    try:
+        while watcher.is_alive():
+            watcher.join(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+        logging.info('Waiting for running regressions to finish...')
+        runner.wait()
+
+if __name__ == '__main__':
+    main()
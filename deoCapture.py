@@ -0,0 +1,51 @@
+#
+# Script to capture numeric DEO fields over a soak run (see Lib/DeoTimeSeries.py) and summarize them,
+# the capture (chunk_*.npz) stays in the capture folder for a closer look, Lib.DeoTimeSeries.load_capture()
+#
+
+import time
+import logging
+import argparse
+from Lib.DeoWebSocket import DeoWebSocket
+from Lib.DeoTimeSeries import DeoTimeSeries
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to capture DEO fields over time'
+        )
+    aparser.add_argument('netIP', help='device IP address DEO is served on')
+    aparser.add_argument('captureDir', help='folder to write the capture to, must not hold one already')
+    aparser.add_argument('-f', '--field', dest='fields', action='append', required=True,
+                         help='container.field to capture, e.g. AlarmLightData._dutyCyclePct, can be repeated')
+    aparser.add_argument('-t', '--time', dest='captureTime', type=int, default=3600,
+                         help='seconds to capture, default 3600, Ctrl-C stops earlier')
+    aparser.add_argument('-i', '--interval', dest='interval', type=float, default=0,
+                         help='keep at most one sample per interval seconds, default every DEO update')
+    aparser.add_argument('-s', '--summary', dest='summary', type=int, default=600,
+                         help='seconds per line of the min/max/mean summary, default 600')
+    return aparser.parse_args()
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    timeSeries = DeoTimeSeries(args.fields, args.captureDir, args.interval)
+    with DeoWebSocket(args.netIP, containers=[], timeSeries=timeSeries):
+        try:
+            end = time.time() + args.captureTime
+            while time.time() < end:
+                time.sleep(min(60, max(0, end - time.time())))
+                logging.info(f'{len(timeSeries)} samples captured')
+        except KeyboardInterrupt:
+            pass
+
+    logging.info("\n======================================================\nCapture summary\n")
+    for field in args.fields:
+        stats = timeSeries.stats(field)
+        logging.info(f'{field}: {stats.count} samples, min {stats.min}, max {stats.max}, mean {stats.mean:.3f}')
+        (starts, mins, maxs, means) = timeSeries.downsample(field, args.summary)
+        for (start, low, high, mean) in zip(starts, mins, maxs, means):
+            logging.info(f'    {time.strftime("%H:%M:%S", time.localtime(start))}  min {low:10.3f}  max {high:10.3f}  mean {mean:10.3f}')
+
+if __name__ == '__main__':
+    main()
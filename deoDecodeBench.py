@@ -0,0 +1,82 @@
+#
+# Script to measure DEO message decoding speed: plain json.loads vs DeoDecoder (full, orjson when installed)
+# vs DeoDecoder decoding only the containers of interest
+#
+# frames come from a deoRecord.py recording (.gz) or a file with one DEO message per line,
+# without one, synthetic frames of about the size of a device's are used
+#
+
+import json
+import time
+import random
+import logging
+import argparse
+from Lib.DeoDecoder import DeoDecoder, orjson
+from Lib.DeoSnapshot import DEVICE_DATA, STRUCTURE_NAME
+from Lib.DeoRecorder import read_recording
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to benchmark DEO message decoding'
+        )
+    aparser.add_argument('-f', '--frames', dest='framesFile', help='deoRecord.py recording (.gz) or file with one DEO message per line')
+    aparser.add_argument('-c', '--container', dest='containers', action='append',
+                         help='container of interest, can be repeated, AlarmManagerData if not given')
+    aparser.add_argument('-n', '--repeat', dest='repeat', type=int, default=5, help='passes over the frames')
+    aparser.add_argument('--synthContainers', dest='synthContainers', type=int, default=60,
+                         help='containers per synthetic frame')
+    aparser.add_argument('--synthFields', dest='synthFields', type=int, default=25,
+                         help='fields per synthetic container')
+    return aparser.parse_args()
+
+def synthetic_frames(count: int, containers: int, fields: int) -> list:
+    frames = []
+    for i in range(count):
+        deviceData = [{'structureData': {f'_activeAlarmsList{n}': '' for n in range(10)}, 'structureName': 'AlarmManagerData'}]
+        for c in range(containers - 1):
+            deviceData.append({'structureData': {f'_field{f}': random.random() * 100 for f in range(fields)},
+                               'structureName': f'Container{c}Data'})
+        random.shuffle(deviceData)
+        frames.append(json.dumps({'DeviceData': deviceData, 'systemTime': f'05/31/2019 19:{i // 60 % 60:02}:{i % 60:02}'}))
+    return frames
+
+def measure(decode, frames: list, repeat: int) -> float:
+    '''seconds per frame'''
+    start = time.perf_counter()
+    for n in range(repeat):
+        for frame in frames:
+            decode(frame)
+    return (time.perf_counter() - start) / (repeat * len(frames))
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.framesFile and args.framesFile.endswith('.gz'):
+        frames = [message for (receivedAt, message) in read_recording(args.framesFile)]
+    elif args.framesFile:
+        with open(args.framesFile, 'rt') as f:
+            frames = [line for line in f.read().splitlines() if len(line.strip()) > 0]
+    else:
+        frames = synthetic_frames(200, args.synthContainers, args.synthFields)
+    containers = args.containers if args.containers else ['AlarmManagerData']
+    logging.info(f'{len(frames)} frames, {sum(len(frame) for frame in frames) // len(frames)} bytes on average, '
+                 f'containers of interest {containers}, orjson {"installed" if orjson is not None else "not installed"}')
+
+    selective = DeoDecoder(containers)
+    # same result as decoding the whole frame
+    for frame in frames:
+        full = json.loads(frame)
+        if DEVICE_DATA in full:
+            full[DEVICE_DATA] = [container for container in full[DEVICE_DATA] if container[STRUCTURE_NAME] in containers]
+        if selective.decode(frame) != full:
+            raise Exception(f'Selective decode differs from json.loads for frame: {frame[:200]}...')
+
+    baseline = measure(json.loads, frames, args.repeat)
+    logging.info(f'{"json.loads":<24} {baseline * 1e6:10.1f} us/frame')
+    for (name, decoder) in [('DeoDecoder full', DeoDecoder()), ('DeoDecoder selective', selective)]:
+        perFrame = measure(decoder.decode, frames, args.repeat)
+        logging.info(f'{name:<24} {perFrame * 1e6:10.1f} us/frame   x{baseline / perFrame:.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+#
+# Script to record a device's DEO messages to a file (gzip NDJSON, see Lib/DeoRecorder.py),
+# to be played back by deoReplay.py for running the DEO client and alarm handling without a device
+#
+
+import time
+import logging
+import argparse
+from Lib.DeoWebSocket import DeoWebSocket
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to record DEO messages of a device'
+        )
+    aparser.add_argument('netIP', help='device IP address DEO is served on')
+    aparser.add_argument('recordFile', help='recording to write, e.g. orion_soak.ndjson.gz')
+    aparser.add_argument('-t', '--time', dest='recordTime', type=int, default=600,
+                         help='seconds to record, default 600, Ctrl-C stops earlier')
+    return aparser.parse_args()
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with DeoWebSocket(args.netIP, recordFile=args.recordFile) as deoWS:
+        try:
+            end = time.time() + args.recordTime
+            while time.time() < end:
+                time.sleep(min(10, max(0, end - time.time())))
+                logging.info(f'{deoWS.recorder.count} messages recorded')
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
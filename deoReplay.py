@@ -0,0 +1,36 @@
+#
+# Script to play back a DEO recording (made by deoRecord.py) on a local WebSocket server,
+# point DeoWebSocket (or a sanity run) at it instead of a device, e.g. DeoWebSocket('127.0.0.1')
+#
+
+import time
+import logging
+import argparse
+from Lib.DeoReplayServer import DeoReplayServer
+from Lib.DeoWebSocket import DEO_PORT
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to replay recorded DEO messages'
+        )
+    aparser.add_argument('recordFile', help='recording to play back')
+    aparser.add_argument('-s', '--speed', dest='speed', type=float, default=1.0,
+                         help='playback speed, 1 as recorded (default), 10 ten times faster, 0 as fast as possible')
+    aparser.add_argument('-r', '--repeat', dest='repeat', action='store_true', help='play the recording over and over')
+    aparser.add_argument('--host', dest='host', default='127.0.0.1', help='address to listen on, default 127.0.0.1')
+    aparser.add_argument('-p', '--port', dest='port', type=int, default=DEO_PORT, help=f'port to listen on, default {DEO_PORT}')
+    return aparser.parse_args()
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with DeoReplayServer(args.recordFile, args.speed, args.repeat, args.host, args.port):
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#
+# Script to upload the same rel (mender) or dev (updateDevice) build to several devices at once,
+# reading it from the build share only once, see Lib/FanoutUpload.py
+#
+# rigs are given as device names (ORION -> ORION.INI) or INI files (ORION_2.INI, more rigs of one device type),
+# as for fleet.py, run from the folder holding the INI files
+#
+# regr.py run afterwards on each rig (with the same -r/-d/-n arguments and --config) finds the file already in place
+# and skips its own upload; without -r/-d, what regr.py installs first by default (latest rel or dev test build)
+# is uploaded, never an updateDevice that a mender install would come before: the device applies
+# /data/updateDevice on its next reboot, which would be the mender install's
+#
+
+import sys
+import logging
+import argparse
+from Lib.DeviceSerial import DeviceSerial
+from Lib.DeviceSSH import DeviceSSH
+from Lib.Config import Config
+from Lib.DeltaUpload import SignatureCache
+from Lib.Artifacts import Sha256Cache
+from Lib.FanoutUpload import FanoutUpload
+from utils import *
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to upload one build to several devices, requires serial and ssh access'
+        )
+    aparser.add_argument('rigs', nargs='+', help='devices (ORION, FINIA, ...) or their INI files (ORION_2.INI, ...) to upload to')
+    mgroup = aparser.add_mutually_exclusive_group()
+    mgroup.add_argument('-r', '--rel', dest='relBuild', help='rel (mender) build version, or mender file, to upload')
+    mgroup.add_argument('-d', '--dev', dest='devBuild', help='dev build version, or updateDevice file, to upload')
+    aparser.add_argument('-n', '--noTestInstall', dest='noTestInstall', action='store_true',
+                         help='as for regr.py: regular instead of test build (TORION, TFINIA, etc) when neither -r nor -d given')
+    return aparser.parse_args()
+
+def regr_artifact(args, configs: Config, DEVICE: str, currentBuild: str) -> tuple:
+    '''
+    (sourceFile, remoteFile) regr.py with the same arguments uploads first to the device, (None, None) if nothing
+    (same choice as regr.py discover())
+    '''
+    if args.relBuild:
+        return (args.relBuild if 'mender' in args.relBuild else configs.get_rel_build_menderUpdate_path(args.relBuild),
+                Config.DEVICE_MENDER_PATH)
+    if args.devBuild:
+        return (args.devBuild if 'update' in args.devBuild else configs.get_dev_build_updateDevice_path(args.devBuild),
+                Config.DEVICE_UPDATE_PATH)
+    lastRelBuild = configs.get_latest_rel_build_version()
+    lastDevBuild = configs.get_latest_dev_build_version()
+    if '.' not in currentBuild or second_build_is_newer(currentBuild, lastRelBuild):
+        (sourceFile, remoteFile, testExtension) = (configs.get_rel_build_menderUpdate_path(lastRelBuild),
+                                                   Config.DEVICE_MENDER_PATH, f'.T{DEVICE}')
+    elif second_build_is_newer(currentBuild, lastDevBuild):
+        (sourceFile, remoteFile, testExtension) = (configs.get_dev_build_updateDevice_path(lastDevBuild),
+                                                   Config.DEVICE_UPDATE_PATH, f'_T{DEVICE}')
+    else:
+        return (None, None)
+    return (sourceFile if args.noTestInstall else sourceFile + testExtension, remoteFile)
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # source file -> {rig: (deviceSSH, remoteFile)}, rigs may resolve to different files
+    uploads = {}
+    for configFile in [rig_config_file(rig) for rig in args.rigs]:
+        RIG = rig_name(configFile)
+        configs = Config(configFile)
+        # device type (ORION for ORION_2.INI), picks the test build extension as in regr.py
+        DEVICE = configs[Config.DEVICE].upper()
+        deviceSerial = DeviceSerial(configs[Config.SERIAL_PORT])
+        deviceSerial.login(configs[Config.USER], configs[Config.PASSWORD])
+        (sourceFile, remoteFile) = regr_artifact(args, configs, DEVICE, deviceSerial.get_versions()[0])
+        if sourceFile is None:
+            logging.info(f'{RIG}: up to date, nothing for regr.py to install')
+            continue
+        logging.info(f'{RIG}: {sourceFile}')
+        (deviceIP, netIP) = deviceSerial.get_ip_addresses(False)
+        if deviceIP is None:
+            logging.error(f'{RIG}: no IP address, skipping')
+            continue
+        uploads.setdefault(sourceFile, {})[RIG] = (DeviceSSH(deviceIP, configs[Config.USER], configs[Config.PASSWORD]), remoteFile)
+
+    failed = []
+    hashCache = Sha256Cache()
+    for (sourceFile, targets) in uploads.items():
+        logging.info(f'Uploading {sourceFile} to {", ".join(targets)}')
+        results = FanoutUpload(sourceFile, hashCache=hashCache).upload(targets)
+        failed += [rig for (rig, error) in results.items() if error is not None]
+        isUpdateDevice = any(remoteFile == Config.DEVICE_UPDATE_PATH for (deviceSSH, remoteFile) in targets.values())
+        if isUpdateDevice and any(error is None for error in results.values()):
+            # base for later delta uploads of updateDevice, see DeviceSSH.upload_artifact
+            SignatureCache().save(hashCache.get(sourceFile), sourceFile)
+        [deviceSSH.close() for (deviceSSH, remoteFile) in targets.values()]
+
+    if len(failed) > 0:
+        logging.error(f'Upload failed for: {", ".join(failed)}')
+        sys.exit(1)
+    logging.info('All uploads done')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#
+# Script to run regr.py on several devices (rigs) at the same time and summarize the results,
+# overnight regression then takes about as long as the slowest device instead of the sum of all
+#
+# rigs are given as device names (ORION -> ORION.INI) or INI files (ORION_2.INI, more rigs of one device type),
+# run from the folder holding the INI files
+#
+
+import sys
+import os
+import time
+import logging
+import argparse
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from Lib.Config import Config
+from utils import *
+
+REGR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regr.py')
+# regr.py exit codes
+EXIT_CODES = {0: 'OK', -1: 'wrong config file', 255: 'wrong config file', 1: 'mender install failed', 2: 'updateDevice failed',
+              3: 'alarm poll failed'}
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to run regr.py on several devices concurrently'
+        )
+    aparser.add_argument('rigs', nargs='+', help='devices (ORION, FINIA, ...) or their INI files (ORION_2.INI, ...)')
+    aparser.add_argument('-j', '--jobs', dest='jobs', type=int, default=4, help='max number of devices worked on at once')
+    aparser.add_argument('-c', '--common', dest='common', default='',
+                         help='regr.py arguments for all rigs, e.g. -c "--ntp off --cpa 10.183.129.106"')
+    aparser.add_argument('-a', '--regrArgs', dest='regrArgs', action='append', default=[],
+                         help='extra regr.py arguments for one rig, e.g. -a "CWCE=-s COM4"')
+    return aparser.parse_args()
+
+def run_rig(configFile: str, regrArgs: list, logDir: str) -> dict:
+    '''runs regr.py for one rig, its output goes to log/fleet_<RIG>.log'''
+    rig = rig_name(configFile)
+    command = [sys.executable, REGR_SCRIPT, '--config', configFile] + regrArgs + [Config(configFile)[Config.DEVICE]]
+    outputFile = os.path.join(logDir, f'fleet_{rig}.log')
+    logging.info(f'{rig}: starting {" ".join(command)}')
+    start = time.time()
+    with open(outputFile, 'wt') as output:
+        exitCode = subprocess.run(command, stdout=output, stderr=subprocess.STDOUT).returncode
+    elapsed = time.time() - start
+    logging.info(f'{rig}: done in {elapsed / 60:.1f} min, exit code {exitCode}')
+    # regr.py logs its own summary last
+    with open(outputFile, 'rt', errors='replace') as output:
+        lines = output.read().splitlines()
+    summaryStart = max((i for (i, line) in enumerate(lines) if line.endswith('Summary')), default=len(lines))
+    return {'rig': rig, 'exitCode': exitCode, 'elapsed': elapsed, 'output': outputFile,
+            'summary': [line for line in lines[summaryStart + 1:] if len(line.strip()) > 0]}
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    LOG_DIR = 'log'
+    os.makedirs(LOG_DIR, exist_ok=True)
+    configFiles = [rig_config_file(rig) for rig in args.rigs]
+    rigArgs = {}
+    for extra in args.regrArgs:
+        (rig, rigExtra) = extra.split('=', 1)
+        rigArgs[rig.upper()] = shlex.split(rigExtra)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_rig, configFile, shlex.split(args.common) + rigArgs.get(rig_name(configFile), []), LOG_DIR)
+                   for configFile in configFiles]
+        results = []
+        for (configFile, future) in zip(configFiles, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logging.error(f'{rig_name(configFile)}: could not run regr.py: {e}')
+                results.append({'rig': rig_name(configFile), 'exitCode': None, 'elapsed': 0, 'output': None,
+                                'summary': [str(e)]})
+
+    logging.info("\n======================================================\nFleet summary\n")
+    for result in results:
+        status = EXIT_CODES.get(result['exitCode'], f'exit code {result["exitCode"]}')
+        logging.info(f'{result["rig"]:<12} {status:<24} {result["elapsed"] / 60:6.1f} min   {result["output"]}')
+        for line in result['summary']:
+            logging.info(f'    {line}')
+    logging.info(f'Total {(time.time() - start) / 60:.1f} min, longest rig '
+                 f'{max(result["elapsed"] for result in results) / 60:.1f} min')
+    sys.exit(0 if all(result['exitCode'] == 0 for result in results) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#
+# Script to keep the local artifact cache filled with the latest rel/dev builds of the given devices,
+# copying them from the build share as soon as they show up, see Lib/Artifacts.py ArtifactPrefetcher
+#
+# regr.py then uploads from local disk, exit with Ctrl-c
+#
+
+import logging
+import argparse
+from Lib.Config import Config
+from Lib.Artifacts import ArtifactCache, ArtifactPrefetcher, PREFETCH_INTERVAL
+from utils import *
+
+def define_args():
+    aparser = argparse.ArgumentParser(
+            epilog='Script tool to prefetch latest builds from the build share into the local artifact cache'
+        )
+    aparser.add_argument('devices', nargs='+', help='devices to prefetch builds for: ORION, FINIA, ERIC, CWCE, etc')
+    aparser.add_argument('-i', '--interval', dest='interval', type=float, default=PREFETCH_INTERVAL,
+                         help='seconds between checks of the build share')
+    aparser.add_argument('-o', '--once', dest='once', action='store_true', help='prefetch once and exit')
+    return aparser.parse_args()
+
+def main():
+    args = define_args()
+    logging.basicConfig(level=logging.INFO)
+
+    configs = {device.upper(): Config(device.upper() + '.INI') for device in args.devices}
+    # cache settings of the first device's INI file apply
+    prefetcher = ArtifactPrefetcher(ArtifactCache.from_config(next(iter(configs.values()))), configs, args.interval)
+    if args.once:
+        prefetcher.prefetch_once()
+        return
+    prefetcher.start()
+    try:
+        while prefetcher.is_alive():
+            prefetcher.join(1)
+    except KeyboardInterrupt:
+        prefetcher.stop()
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,9 @@ from Lib.DeviceSSH import DeviceSSH
 from Lib.Config import Config
 from Lib.DeoWebSocket import DeoWebSocket
 from Lib.Installs import *
+from Lib.SSHSessionManager import SSHSessionManager
+from Lib.Artifacts import ArtifactCache, Sha256Cache
+from Lib.Pipeline import Pipeline
 from utils import *
 
 def define_args():
@@ -57,6 +60,16 @@ def define_args():
 
     aparser.add_argument('-s', '--serial', dest='serial', help="serial port to connect to device overrides what's in <DEVICE.INI> file")
 
+    # several rigs of the same device type each have their own INI file (e.g. ORION_2.INI),
+    # logs and dlogs are then named after the INI file instead of the device type
+    aparser.add_argument('--config', dest='configFile', help='config file to use instead of <DEVICE.INI>')
+
+    # pick up an interrupted run (same arguments) where it stopped, see Lib/Pipeline.py
+    aparser.add_argument('--resume', 
+                         dest='resume', 
+                         action='store_true', 
+                         help='skip the steps a previous, interrupted run with the same arguments completed')
+
     return aparser.parse_args()
 
 ######################################################################
@@ -69,6 +82,7 @@ def define_args():
 #  -1 - wrong config (*.INI) file for current device
 #   1 - mender install attempted and failed
 #   2 - updateDevice attempted and failed
+#   3 - installs fine, but alarms couldn't be polled (DEO not answering, no alarm data)
 #
 ######################################################################
 def main():
@@ -81,7 +95,8 @@ def main():
         logging.info(f'look for device serial connection on port {args.serial}')
 
     DEVICE = args.device.upper()
-    CONFIG_FILE = DEVICE + '.INI'
+    CONFIG_FILE = args.configFile if args.configFile else DEVICE + '.INI'
+    RIG = os.path.splitext(os.path.basename(CONFIG_FILE))[0].upper()
 
     # get config info, root buildoutput path depends on whether private build requested
     configs = Config(CONFIG_FILE)
@@ -92,98 +107,18 @@ def main():
     else:
         deviceSerial = DeviceSerial(configs[Config.SERIAL_PORT])
     deviceSerial.login(configs[Config.USER], configs[Config.PASSWORD])
+    # device type, build and IP addresses, all in one serial round trip
+    deviceState = deviceSerial.get_device_state()
     # check device type
-    if not deviceSerial.checkDeviceType(configs[Config.DEVICE]):
+    if not deviceState.has_device_type(configs[Config.DEVICE]):
         logging.error('Wrong device type found, config INI file is expecting {}; using wrong config INI file?'.format( 
                         configs[Config.DEVICE]))
+        logging.info(f'Device types found: {deviceState.device_types}')
         sys.exit(-1)
 
     # decide which rel/dev builds we will be working with
-    currentDeviceBuildVersion = deviceSerial.get_versions()[0]
-
-    # figure out the exact build file(s) we will be using
+    currentDeviceBuildVersion = deviceState.build
     logging.info(f'Device currently on build: {currentDeviceBuildVersion}')
-    deviceMenderPath = None
-    updateDevicePath = None
-    if args.relBuild:
-        # unconditionally installing specified rel build, no dev build needed
-        # install even if device is already at requested rel build (force switch partition)
-        logging.info(f'installing build: {args.relBuild} on device {args.device}')
-        if "mender" in args.relBuild:
-            # argument contains 'mender' assume it's pointing directly to the mender file
-            deviceMenderPath = args.relBuild
-            args.relBuild = None
-        else:
-            deviceMenderPath = configs.get_rel_build_menderUpdate_path(args.relBuild)
-        if not os.path.exists(deviceMenderPath):
-            # oops the specified rel build doesn't exist
-            logging.error('Requested rel build {} does not exist!'.format(deviceMenderPath))
-            sys.exit(1)
-        logging.info(f'Installing rel build {args.relBuild}')
-
-    elif args.devBuild:
-        # Dev build specified (this option is mutually exclusive with rel build option)
-        logging.info(f'installing build: {args.devBuild} on device {args.device}')
-        if 'update' in args.devBuild:
-            # argument contains 'update' assume it's pointing directly to the updateDevice file
-            updateDevicePath = args.devBuild
-            args.devBuild = None
-        else:
-            updateDevicePath = configs.get_dev_build_updateDevice_path(args.devBuild)
-        if not os.path.exists(updateDevicePath):
-            # oops the specified dev build doesn't exist
-            logging.warn('Requested dev build {} does not exist!'.format(updateDevicePath))
-            sys.exit(1)
-        logging.info(f'Installing dev build {args.devBuild}')
-
-    else:
-        logging.info('Updating device to latest builds...')
-        # no Rel/Dev build specified, installing latest versions
-        lastDevBuild = configs.get_latest_dev_build_version()
-        lastRelBuild = configs.get_latest_rel_build_version()
-        logging.info(f'Lastest rel build: {lastRelBuild}   dev build: {lastDevBuild}')
-        # for a private build, install latest Rel and/or Dev builds unconditionally
-        if '.' not in currentDeviceBuildVersion or second_build_is_newer(currentDeviceBuildVersion, lastRelBuild):
-            # need mender install
-            deviceMenderPath = configs.get_rel_build_menderUpdate_path(lastRelBuild)
-            logging.info(f'Will install new rel build {lastRelBuild}')
-            if second_build_is_newer(lastRelBuild, lastDevBuild):
-                # also needs a Dev install following the Rel install
-                updateDevicePath = configs.get_dev_build_updateDevice_path(lastDevBuild)
-                logging.info(f'Will install new dev build {lastDevBuild}')
-        else:
-            # no Rel install needed, check if we just need Dev install
-            logging.info(f'No new rel install needed...')
-            if second_build_is_newer(currentDeviceBuildVersion, lastDevBuild):
-                updateDevicePath = configs.get_dev_build_updateDevice_path(lastDevBuild)
-                logging.info(f'Will install new dev build {lastDevBuild}')
-            else:
-                logging.info('Device is up to date, no new build install needed')
-        args.relBuild = lastRelBuild
-        args.devBuild = lastDevBuild
-
-        # test build extensions
-        if not args.noTestInstall:
-            if deviceMenderPath is not None:
-                deviceMenderPath = deviceMenderPath + f'.T{DEVICE}'
-            if updateDevicePath is not None:
-                updateDevicePath = updateDevicePath + f'_T{DEVICE}'
-
-
-    # this list of functions to be executed after an install to finish up prepping the device
-    # add or subtract to list as needed
-    processFunctionsList = []
-    if args.cpaIP:
-        processFunctionsList.append(lambda : deviceSerial.setCPA(args.cpaIP))
-    if args.ntpState:
-        if not args.ntpState.isdigit():
-            args.ntpState = 0
-        processFunctionsList.append(lambda : deviceSerial.enableNTP(int(args.ntpState)))
-    if args.soundKill:
-        processFunctionsList.append(deviceSerial.killSoundPlayer)
-
-    # dict of results summary
-    summary = []
 
     # make sure all log and dlog directories are present
     LOG_DIR = 'log'
@@ -192,12 +127,96 @@ def main():
     DLOG_DIR = 'dlog'
     if not os.path.exists(DLOG_DIR):
         os.mkdir(DLOG_DIR)
-    DLOG_DEVICE_DIR = os.sep.join([DLOG_DIR, DEVICE])
+    DLOG_DEVICE_DIR = os.sep.join([DLOG_DIR, RIG])
     if not os.path.exists(DLOG_DEVICE_DIR):
         os.mkdir(DLOG_DEVICE_DIR)
 
+    # the run is a sequence of steps, each step's outcome is checkpointed so that --resume
+    # (after a crash or host reboot) picks up where the run stopped instead of starting over
+    # the checkpoint only applies to a rerun with the same arguments
+    pipeline = Pipeline(os.sep.join([LOG_DIR, f'{RIG}.checkpoint.json']),
+                        {'relBuild': args.relBuild, 'devBuild': args.devBuild, 'cpaIP': args.cpaIP, 
+                         'ntpState': args.ntpState, 'soundKill': args.soundKill, 'noTestInstall': args.noTestInstall},
+                        args.resume)
+
+    def discover() -> dict:
+        # figure out the exact build file(s) we will be using
+        deviceMenderPath = None
+        updateDevicePath = None
+        relBuild = args.relBuild
+        devBuild = args.devBuild
+        if relBuild:
+            # unconditionally installing specified rel build, no dev build needed
+            # install even if device is already at requested rel build (force switch partition)
+            logging.info(f'installing build: {relBuild} on device {args.device}')
+            if "mender" in relBuild:
+                # argument contains 'mender' assume it's pointing directly to the mender file
+                deviceMenderPath = relBuild
+                relBuild = None
+            else:
+                deviceMenderPath = configs.get_rel_build_menderUpdate_path(relBuild)
+            if not os.path.exists(deviceMenderPath):
+                # oops the specified rel build doesn't exist
+                logging.error('Requested rel build {} does not exist!'.format(deviceMenderPath))
+                sys.exit(1)
+            logging.info(f'Installing rel build {relBuild}')
+
+        elif devBuild:
+            # Dev build specified (this option is mutually exclusive with rel build option)
+            logging.info(f'installing build: {devBuild} on device {args.device}')
+            if 'update' in devBuild:
+                # argument contains 'update' assume it's pointing directly to the updateDevice file
+                updateDevicePath = devBuild
+                devBuild = None
+            else:
+                updateDevicePath = configs.get_dev_build_updateDevice_path(devBuild)
+            if not os.path.exists(updateDevicePath):
+                # oops the specified dev build doesn't exist
+                logging.warn('Requested dev build {} does not exist!'.format(updateDevicePath))
+                sys.exit(1)
+            logging.info(f'Installing dev build {devBuild}')
+
+        else:
+            logging.info('Updating device to latest builds...')
+            # no Rel/Dev build specified, installing latest versions
+            lastDevBuild = configs.get_latest_dev_build_version()
+            lastRelBuild = configs.get_latest_rel_build_version()
+            logging.info(f'Lastest rel build: {lastRelBuild}   dev build: {lastDevBuild}')
+            # for a private build, install latest Rel and/or Dev builds unconditionally
+            if '.' not in currentDeviceBuildVersion or second_build_is_newer(currentDeviceBuildVersion, lastRelBuild):
+                # need mender install
+                deviceMenderPath = configs.get_rel_build_menderUpdate_path(lastRelBuild)
+                logging.info(f'Will install new rel build {lastRelBuild}')
+                if second_build_is_newer(lastRelBuild, lastDevBuild):
+                    # also needs a Dev install following the Rel install
+                    updateDevicePath = configs.get_dev_build_updateDevice_path(lastDevBuild)
+                    logging.info(f'Will install new dev build {lastDevBuild}')
+            else:
+                # no Rel install needed, check if we just need Dev install
+                logging.info(f'No new rel install needed...')
+                if second_build_is_newer(currentDeviceBuildVersion, lastDevBuild):
+                    updateDevicePath = configs.get_dev_build_updateDevice_path(lastDevBuild)
+                    logging.info(f'Will install new dev build {lastDevBuild}')
+                else:
+                    logging.info('Device is up to date, no new build install needed')
+            relBuild = lastRelBuild
+            devBuild = lastDevBuild
+
+            # test build extensions
+            if not args.noTestInstall:
+                if deviceMenderPath is not None:
+                    deviceMenderPath = deviceMenderPath + f'.T{DEVICE}'
+                if updateDevicePath is not None:
+                    updateDevicePath = updateDevicePath + f'_T{DEVICE}'
+        return {'menderPath': deviceMenderPath, 'updateDevicePath': updateDevicePath, 
+                'relBuild': relBuild, 'devBuild': devBuild}
+
+    # on resume, the builds picked by the interrupted run (newer ones may have shown up since)
+    builds = pipeline.step('discover', discover)
+    (args.relBuild, args.devBuild) = (builds['relBuild'], builds['devBuild'])
+
     # with dev/rel build numbers, construct a log file name
-    logFile = os.sep.join([LOG_DIR, f'{DEVICE}_d{args.devBuild}_r{args.relBuild}.log'])
+    logFile = os.sep.join([LOG_DIR, f'{RIG}_d{args.devBuild}_r{args.relBuild}.log'])
 
     # create logger with current module namespace
     logger = logging.getLogger()
@@ -207,130 +226,209 @@ def main():
     logger.addHandler(fh)
     logger.info('Log file name: ' + logFile)
 
+    def stage() -> dict:
+        # upload from local disk rather than the build share (already there if prefetch.py is running)
+        artifactCache = ArtifactCache.from_config(configs)
+        return {'menderPath': artifactCache.local_path(builds['menderPath']) if builds['menderPath'] else None,
+                'updateDevicePath': artifactCache.local_path(builds['updateDevicePath']) if builds['updateDevicePath'] else None}
+
+    staged = pipeline.step('stage', stage, 
+                           lambda result: all(os.path.exists(path) for path in result.values() if path is not None))
+    deviceMenderPath = staged['menderPath']
+    updateDevicePath = staged['updateDevicePath']
+
+    # config settings, each function applies its setting if needed and returns True if a reboot is needed
+    # for it to take effect; planned up front so they go into the reboot the last install does anyway
+    processFunctionsList = []
+    if args.cpaIP:
+        processFunctionsList.append(lambda : deviceSerial.setCPA(args.cpaIP))
+    if args.ntpState:
+        if not args.ntpState.isdigit():
+            args.ntpState = 0
+        processFunctionsList.append(lambda : deviceSerial.enableNTP(int(args.ntpState)))
+    # runtime actions, only make sense once the device is done rebooting
+    actionFunctionsList = []
+    if args.soundKill:
+        actionFunctionsList.append(deviceSerial.killSoundPlayer)
+
+    # dict of results summary
+    summary = []
+
     # define 2 functions to execute before and after mender/updateDevice install
     # they save/restore /etc/systemd/network/eth.network file, which may help expedite network setup;
 
     def saveEth():
-        deviceSerial.enterString('cp /etc/systemd/network/eth.network /data/')
+        deviceSerial.runCommand('cp /etc/systemd/network/eth.network /data/')
         return False
 
     def restoreEth():
-        deviceSerial.enterString('cp /data/eth.network /etc/systemd/network/')
+        deviceSerial.runCommand('cp /data/eth.network /etc/systemd/network/')
         return True
 
-    exitCode = 0
-    # before attempting SSH login, check if host IP is enabled
-    (deviceIP, netIP) = deviceSerial.get_ip_addresses(False, 60)
-    if deviceIP == netIP == None:
-        # no IP addresses at all seen, try setting up DHCP
-        if not deviceSerial.setup_dhcp_network(): sys.exit(1)
-        (deviceIP, netIP) = deviceSerial.get_ip_addresses()
-    deviceSSH = DeviceSSH(deviceIP, 
-                          configs[Config.USER], 
-                          configs[Config.PASSWORD])
-    currentDeviceBuildVersion = deviceSerial.get_versions()[0]
+    # one SSH session kept alive for the whole run, reconnected after every reboot
+    sshSessions = SSHSessionManager()
+    # network state, changes with every reboot
+    net = {}
 
-    if deviceMenderPath:
-        # need mender install
+    def reconnectDevice():
+        # before attempting SSH login, check if host IP is enabled and SSH answering
+        (net['deviceIP'], net['netIP'], net['deviceSSH']) = reconnect(
+            deviceSerial, configs[Config.USER], configs[Config.PASSWORD], sessions=sshSessions, device=RIG)
+
+    reconnectDevice()
+
+    def installedAtLeast(result: dict) -> bool:
+        # device still on the installed build, or on a newer one installed by a later step
+        if result.get('build') is None:
+            # build not known, e.g. rel build given as a mender file path
+            return False
+        currentBuild = deviceSerial.get_versions()[0]
+        return currentBuild == result['build'] or second_build_is_newer(result['build'], currentBuild)
+
+    def upload() -> dict:
+        # only the mender file: the device applies /data/updateDevice on its next reboot, which would be the
+        # mender install's, so updateDevice goes up in install_dev
+        return {'mender': uploadMender(net['deviceSSH'], deviceMenderPath) if deviceMenderPath else None}
+
+    def uploaded(result: dict) -> bool:
+        # the file may be gone from the device once installed
+        return deviceMenderPath is None or pipeline.done('install_rel') or \
+            net['deviceSSH'].remoteSha256(Config.DEVICE_MENDER_PATH) == Sha256Cache().get(deviceMenderPath)
+
+    def collectDlog(currentDeviceBuildVersion: str) -> str:
+        return net['deviceSSH'].download_current_dlog(DLOG_DEVICE_DIR, currentDeviceBuildVersion)
+
+    def installRel() -> dict:
         logger.info(f'Mender installing build {deviceMenderPath}')
         saveEth()
-        menderInstall(deviceSerial, deviceSSH, deviceMenderPath, [restoreEth])
+        # a dev install following reboots twice anyway, settings are applied there instead
+        rebootPending = menderInstall(deviceSerial, net['deviceSSH'], deviceMenderPath, [restoreEth] + processFunctionsList,
+                                      upload=False, reboot=updateDevicePath is None)
         currentDeviceBuildVersion = deviceSerial.get_versions()[0]
+        # ssh login again
+        reconnectDevice()
         if args.relBuild is not None and currentDeviceBuildVersion != args.relBuild:
             logger.warn(f'Device version {currentDeviceBuildVersion} not expected rel build version {args.relBuild}, mender install failed?')
-            summary.append('Mender install failed or aborted: did NOT update to Rel build ' + args.relBuild)
-            exitCode = 1
-        else:
-            logger.info('Mender install done!')
-            summary.append('Mender install: updated to Rel build ' + deviceMenderPath)
-
-        (deviceIP, netIP) = deviceSerial.get_ip_addresses(False, 60)
-        if deviceIP == netIP == None:
-            # no IP addresses at all seen, try setting up DHCP
-            if not deviceSerial.setup_dhcp_network(): sys.exit(1)
-            (deviceIP, netIP) = deviceSerial.get_ip_addresses()
-        # ssh login again
-        (deviceIP, netIP) = deviceSerial.get_ip_addresses()
-        deviceSSH = DeviceSSH(deviceIP, 
-                              configs[Config.USER], 
-                              configs[Config.PASSWORD])
+            return {'failed': True, 'build': currentDeviceBuildVersion, 'rebootPending': rebootPending,
+                    'summary': ['Mender install failed or aborted: did NOT update to Rel build ' + args.relBuild]}
+        logger.info('Mender install done!')
         # retrieve dlog
-        if exitCode == 0:
-            summary.append('dlog downloaded to: ' + 
-                deviceSSH.download_current_dlog(DLOG_DEVICE_DIR, currentDeviceBuildVersion))
+        return {'build': currentDeviceBuildVersion, 'rebootPending': rebootPending,
+                'summary': ['Mender install: updated to Rel build ' + deviceMenderPath,
+                            'dlog downloaded to: ' + collectDlog(currentDeviceBuildVersion)]}
 
-    if exitCode == 0 and updateDevicePath:
+    def installDev() -> dict:
         logger.info(f'build {updateDevicePath} updateDevice installing')
         saveEth()
-        updateDevice(deviceSerial, deviceSSH, updateDevicePath, [restoreEth])
+        # uploaded only now, see upload()
+        updateDevice(deviceSerial, net['deviceSSH'], updateDevicePath, [restoreEth] + processFunctionsList,
+                     delta=configs.get(Config.DELTA_UPLOAD, 'no').lower() == 'yes')
         currentDeviceBuildVersion = deviceSerial.get_versions()[0]
+        # ssh login again
+        reconnectDevice()
         if args.devBuild is not None and currentDeviceBuildVersion != args.devBuild:
             logger.warn(f'Device version {currentDeviceBuildVersion} != expected dev version {args.devBuild}, update install failed?')
-            summary.append('Dev build install failed or aborted: did NOT update to Dev build ' + args.devBuild)
-            exitCode = 2
-        else:
-            logger.info(f'All done! Device now at version {currentDeviceBuildVersion}')
-            summary.append('Dev install: updated to dev build ' + updateDevicePath)
-
-        (deviceIP, netIP) = deviceSerial.get_ip_addresses(False, 60)
-        if deviceIP == netIP == None:
-            # no IP addresses at all seen, try setting up DHCP
-            if not deviceSerial.setup_dhcp_network(): sys.exit(1)
-            (deviceIP, netIP) = deviceSerial.get_ip_addresses()
-        # ssh login again
-        (deviceIP, netIP) = deviceSerial.get_ip_addresses()
-        deviceSSH = DeviceSSH(deviceIP, 
-                                configs[Config.USER], 
-                                configs[Config.PASSWORD])
+            return {'failed': True, 'build': currentDeviceBuildVersion,
+                    'summary': ['Dev build install failed or aborted: did NOT update to Dev build ' + args.devBuild]}
+        logger.info(f'All done! Device now at version {currentDeviceBuildVersion}')
         # retrieve dlog
-        if (exitCode == 0):
-            summary.append('dlog downloaded to: ' + 
-                deviceSSH.download_current_dlog(DLOG_DEVICE_DIR, currentDeviceBuildVersion))
-
-    # do a system check, this part runs even if no updates done
-    if any([x() for x in processFunctionsList]):
-        logger.info('Config settings applied, rebooting to take effect...')
-        deviceSerial.reboot()
-        # check config lambdas again, if any still return True, means one more didn't stick
-        if any([x() for x in processFunctionsList]):
-            logger.warn('WARNING: one or more config settings may have failed')
-        (deviceIP, netIP) = deviceSerial.get_ip_addresses()
-        deviceSSH = DeviceSSH(deviceIP, 
-                          configs[Config.USER], 
-                          configs[Config.PASSWORD])
-
-    # execute showProcessInfo.sh
-    (out, err) = deviceSSH.executeCommand('/usr/local/sbin/showProcessInfo.sh')
-    logger.info('showProcessInfo stdout')
-    list(map(logger.info, out))
-    logger.info('showProcessInfo stderr')
-    list(map(logger.info, err))
-    (out, err) = deviceSSH.executeCommand('/usr/local/sbin/showProcessInfo.sh |grep -v /usr/local|grep ": "|grep -v Running')
-    if len(out) > 0:
-        logger.warn("****** ====> One or more expected processes no in Running state")
+        return {'build': currentDeviceBuildVersion, 
+                'summary': ['Dev install: updated to dev build ' + updateDevicePath,
+                            'dlog downloaded to: ' + collectDlog(currentDeviceBuildVersion)]}
+
+    def configure() -> dict:
+        # do a system check, this part runs even if no updates done
+        # after an install this only verifies the settings applied during its reboot (each checked once),
+        # a reboot of its own is only needed without an install, or if a setting didn't stick,
+        # or if the rel install left its reboot to a dev install that then failed or didn't run
+        rebootPending = (pipeline.result('install_rel') or {}).get('rebootPending', False) and not pipeline.done('install_dev')
+        changed = any([x() for x in processFunctionsList])
+        if changed or rebootPending:
+            logger.info('Config settings applied, rebooting to take effect...')
+            deviceSerial.reboot()
+            # check config lambdas again, if any still return True, means one more didn't stick
+            if any([x() for x in processFunctionsList]):
+                logger.warn('WARNING: one or more config settings may have failed')
+            reconnectDevice()
+        [x() for x in actionFunctionsList]
+        return {'changed': changed or rebootPending}
+
+    def healthCheck() -> dict:
+        # execute showProcessInfo.sh
+        (out, err) = net['deviceSSH'].executeCommand('/usr/local/sbin/showProcessInfo.sh')
+        logger.info('showProcessInfo stdout')
+        list(map(logger.info, out))
+        logger.info('showProcessInfo stderr')
+        list(map(logger.info, err))
+        (out, err) = net['deviceSSH'].executeCommand('/usr/local/sbin/showProcessInfo.sh |grep -v /usr/local|grep ": "|grep -v Running')
+        if len(out) > 0:
+            logger.warn("****** ====> One or more expected processes no in Running state")
+        return {'notRunning': out}
 
     # poll DEO for alarms
     pollTime = 200
-    #try:
-    if DeoWebSocket.pollDeoAlarm(netIP, pollTime):
-        logger.warn("One or more alarms seen, DLOG downloaded")
+
+    def alarmPoll() -> dict:
+        # the network counts as up once SSH answers, DEO may still be starting
+        if not DeviceSerial.wait_deo_ready(net['netIP']):
+            return {'alarms': False, 'failed': True, 'error': f'DEO not answering at {net["netIP"]}'}
+        try:
+            alarms = DeoWebSocket.pollDeoAlarm(net['netIP'], pollTime)
+        except Exception as e:
+            # no alarm data isn't the same as no alarms
+            logger.error(f'Alarm poll failed: {e}')
+            return {'alarms': False, 'failed': True, 'error': str(e)}
+        if alarms:
+            logger.warn("One or more alarms seen, DLOG downloaded")
+        else:
+            logger.info(f'All set! No alarms observed in {pollTime} seconds')
+        return {'alarms': bool(alarms)}
+
+    def collectAlarmDlog() -> dict:
+        return {'dlog': collectDlog(deviceSerial.get_versions()[0])}
+
+    exitCode = 0
+    pipeline.step('upload', upload, uploaded)
+    if deviceMenderPath:
+        result = pipeline.step('install_rel', installRel, installedAtLeast,
+                               {'build': args.relBuild, 'rebootPending': False,
+                                'summary': [f'Mender install: device found on Rel build {args.relBuild} after an interrupted install']})
+        summary += result['summary']
+        if result.get('failed'):
+            exitCode = 1
+    if exitCode == 0 and updateDevicePath:
+        result = pipeline.step('install_dev', installDev, installedAtLeast,
+                               {'build': args.devBuild,
+                                'summary': [f'Dev install: device found on dev build {args.devBuild} after an interrupted install']})
+        summary += result['summary']
+        if result.get('failed'):
+            exitCode = 2
+    pipeline.step('configure', configure)
+    pipeline.step('health_check', healthCheck)
+    result = pipeline.step('alarm_poll', alarmPoll)
+    if result.get('failed'):
+        summary.append('**** Alarm poll FAILED, alarms unknown: ' + result['error'])
+        if exitCode == 0:
+            exitCode = 3
+    elif result['alarms']:
         summary.append('**** ALARMS seen ***')
-        summary.append('dlog downloaded to: ' + 
-            deviceSSH.download_current_dlog(DLOG_DEVICE_DIR, currentDeviceBuildVersion))
+        summary.append('dlog downloaded to: ' + pipeline.step('collect_dlog', collectAlarmDlog)['dlog'])
     else:
-        logger.info(f'All set! No alarms observed in {pollTime} seconds')
         summary.append(f'No alarms seen within {pollTime} seconds')
-    #except:
-    #    pass
 
+    if len(pipeline.resumed) > 0:
+        summary.append(f'Resumed from checkpoint, steps skipped: {", ".join(pipeline.resumed)}')
+    cacheStats = deviceSerial.cache_stats()
+    summary.append(f'Device state cache: {cacheStats["hits"]} hits, {cacheStats["misses"]} misses (serial round trips)')
     summary.append(f'Log file: {logFile}')
-    summary.append(f'Device (driver) IP: {deviceIP}')
-    summary.append(f'            net IP: {netIP}')
+    summary.append(f'Device (driver) IP: {net["deviceIP"]}')
+    summary.append(f'            net IP: {net["netIP"]}')
     logger.info("\n======================================================\nSummary\n")
     list(map(logger.info, summary))
 
+    sshSessions.close()
     sys.exit(exitCode)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -2,6 +2,8 @@ import unittest
 import logging
 import os
 import json
+import time
+import threading
 from utils import *
 
 # logging setup
@@ -80,5 +82,39 @@ class Test_test1(unittest.TestCase):
         self.assertFalse(second_build_is_newer('1.0.0.101', '1.0.0.101'))
         self.assertFalse(second_build_is_newer('1.0.0.1140', '1.0.0.1140'))
 
+    def test_backoff(self):
+        intervals = iter(Backoff(0.5, 2, 3))
+        self.assertEqual([next(intervals) for i in range(5)], [0.5, 1, 2, 3, 3])
+
+    def test_deadline_shared(self):
+        parent = Deadline(0.2)
+        child = parent.child(10)
+        self.assertLessEqual(child.remaining(), 0.2)
+        self.assertIsNone(Deadline().remaining())
+        start = time.time()
+        self.assertFalse(wait_until(lambda: False, child))
+        self.assertFalse(wait_until(lambda: False, parent))
+        self.assertLess(time.time() - start, 1)
+
+    def test_wait_until_wake(self):
+        wake = threading.Event()
+        flag = []
+        def later():
+            time.sleep(0.2)
+            flag.append(1)
+            wake.set()
+        threading.Thread(target=later).start()
+        start = time.time()
+        # 10s poll interval, the wake event has to cut it short
+        self.assertTrue(wait_until(lambda: len(flag) > 0, 5, Backoff(10, 1, 10), wake=wake))
+        self.assertLess(time.time() - start, 1)
+
+    def test_wait_until_cancel(self):
+        cancel = CancelToken()
+        threading.Timer(0.2, cancel.cancel).start()
+        start = time.time()
+        self.assertFalse(wait_until(lambda: False, 5, Backoff(10, 1, 10), cancel))
+        self.assertLess(time.time() - start, 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,105 @@
+import logging
+import os
+import hashlib
+import json
+import threading
+from Lib.Artifacts import Sha256Cache, UploadProgress, ArtifactCache, sha256_file
+
+'''
+PyTest tests for local artifact handling, no device needed
+'''
+
+def test_sha256_file(tmp_path):
+    path = tmp_path / 'artifact'
+    path.write_bytes(b'x' * 3000000)
+    assert sha256_file(str(path)) == hashlib.sha256(b'x' * 3000000).hexdigest()
+
+def test_sha256_cache_reused_until_file_changes(tmp_path):
+    path = tmp_path / 'artifact'
+    path.write_bytes(b'first')
+    cacheFile = str(tmp_path / 'cache.json')
+    first = Sha256Cache(cacheFile).get(str(path))
+    assert first == hashlib.sha256(b'first').hexdigest()
+    # a new cache instance reads the entry back from the json file
+    assert Sha256Cache(cacheFile).get(str(path)) == first
+    path.write_bytes(b'second, longer')
+    assert Sha256Cache(cacheFile).get(str(path)) == hashlib.sha256(b'second, longer').hexdigest()
+
+def test_upload_progress_record(tmp_path):
+    record = UploadProgress('10.0.0.5', '/data/update/device.mender', str(tmp_path / 'progress'))
+    assert record.load() is None
+    record.save('abc', 100, 40, 20, 'def')
+    assert record.load()['offset'] == 40
+    assert UploadProgress('10.0.0.5', '/data/update/device.mender', str(tmp_path / 'progress')).load()['chunkSha256'] == 'def'
+    record.clear()
+    assert record.load() is None
+
+def test_artifact_cache_copies_once_and_evicts_lru(tmp_path):
+    share = tmp_path / 'share'
+    share.mkdir()
+    for name in ('a', 'b', 'c'):
+        (share / name).write_bytes(name.encode() * 1000)
+    hashCache = Sha256Cache(str(tmp_path / 'cache.json'))
+    cache = ArtifactCache(str(tmp_path / 'artifactCache'), 2500, hashCache)
+    assert cache.lookup(str(share / 'a')) is None
+    localA = cache.fetch(str(share / 'a'))
+    assert localA != str(share / 'a')
+    assert open(localA, 'rb').read() == b'a' * 1000
+    # hash computed while copying is reused by uploads
+    assert hashCache.peek(localA) == hashlib.sha256(b'a' * 1000).hexdigest()
+    assert cache.fetch(str(share / 'a')) == localA
+    cache.fetch(str(share / 'b'))
+    cache.lookup(str(share / 'a'))
+    # over the size limit, b is least recently used
+    cache.fetch(str(share / 'c'))
+    assert cache.lookup(str(share / 'b')) is None
+    assert cache.lookup(str(share / 'a')) == localA
+
+def test_artifact_cache_detects_changes(tmp_path):
+    source = tmp_path / 'device.mender'
+    source.write_bytes(b'first')
+    cache = ArtifactCache(str(tmp_path / 'artifactCache'), hashCache=Sha256Cache(str(tmp_path / 'cache.json')))
+    local = cache.fetch(str(source))
+    # new build written over the old one on the share
+    source.write_bytes(b'second build')
+    os.utime(str(source), (1, 1))
+    assert cache.lookup(str(source)) is None
+    assert open(cache.fetch(str(source)), 'rb').read() == b'second build'
+    # local copy corrupted
+    with open(local, 'wb') as f:
+        f.write(b'corrupt data')
+    assert cache.lookup(str(source)) is None
+
+def test_sha256_cache_concurrent_runs(tmp_path):
+    # separate instances on one json file, as regr.py runs started by fleet.py
+    cacheFile = str(tmp_path / 'cache.json')
+    paths = []
+    for n in range(40):
+        path = tmp_path / f'artifact{n}'
+        path.write_bytes(str(n).encode())
+        paths.append(str(path))
+    caches = [Sha256Cache(cacheFile) for n in range(4)]
+    threads = [threading.Thread(target=lambda cache=cache, n=n: [cache.get(path) for path in paths[n::4]])
+               for (n, cache) in enumerate(caches)]
+    list(map(threading.Thread.start, threads))
+    list(map(threading.Thread.join, threads))
+    # nothing lost, and entries saved by the others are seen without hashing again
+    assert len(json.load(open(cacheFile))) == 40
+    assert all(caches[0].peek(path) == sha256_file(path) for path in paths)
+
+def test_artifact_cache_concurrent_runs(tmp_path):
+    share = tmp_path / 'share'
+    share.mkdir()
+    paths = []
+    for n in range(20):
+        path = share / f'artifact{n}'
+        path.write_bytes(str(n).encode() * 100)
+        paths.append(str(path))
+    caches = [ArtifactCache(str(tmp_path / 'artifactCache'), hashCache=Sha256Cache(str(tmp_path / 'cache.json')))
+              for n in range(4)]
+    threads = [threading.Thread(target=lambda cache=cache, n=n: [cache.fetch(path) for path in paths[n::4]])
+               for (n, cache) in enumerate(caches)]
+    list(map(threading.Thread.start, threads))
+    list(map(threading.Thread.join, threads))
+    # every copy is in the index, none fetched again
+    assert all(caches[0].lookup(path) is not None for path in paths)
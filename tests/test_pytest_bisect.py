@@ -0,0 +1,36 @@
+import pytest
+from Lib.Bisect import bisect_builds
+
+'''
+PyTest tests for build bisection
+'''
+
+BUILDS = [f'1.2.0.{n}' for n in range(100, 200)]
+
+def test_bisect_finds_first_bad_build_in_log2_steps():
+    firstBad = '1.2.0.137'
+    installs = []
+    def isGood(version):
+        installs.append(version)
+        return int(version.split('.')[-1]) < 137
+    result = bisect_builds(list(reversed(BUILDS)), '1.2.0.100', '1.2.0.199', isGood)
+    assert result.firstBad == firstBad
+    assert result.lastGood == '1.2.0.136'
+    assert result.untestable == []
+    assert len(installs) <= 7
+
+def test_bisect_skips_untestable_builds():
+    def isGood(version):
+        number = int(version.split('.')[-1])
+        if number in (136, 137):
+            return None
+        return number < 137
+    result = bisect_builds(BUILDS, '1.2.0.100', '1.2.0.199', isGood)
+    # either untestable build may be the culprit
+    assert result.lastGood == '1.2.0.135'
+    assert result.firstBad == '1.2.0.138'
+    assert result.untestable == ['1.2.0.136', '1.2.0.137']
+
+def test_bisect_rejects_swapped_builds():
+    with pytest.raises(ValueError):
+        bisect_builds(BUILDS, '1.2.0.150', '1.2.0.120', lambda version: True)
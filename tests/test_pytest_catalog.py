@@ -0,0 +1,99 @@
+import os
+from Lib.BuildCatalog import BuildCatalog
+
+'''
+PyTest tests for the build catalog, build share stood in for by a local directory
+'''
+
+def add_build(root, version: str, complete: bool = True):
+    os.makedirs(os.path.join(root, version, 'Build'))
+    if complete:
+        with open(os.path.join(root, version, 'Build', 'updateDevice'), 'wb') as f:
+            f.write(b'x' * 10)
+
+def touch(path, mtime: int):
+    # directory mtime granularity may be coarse, set it explicitly
+    os.utime(path, (mtime, mtime))
+
+def test_catalog_queries(tmp_path):
+    root = str(tmp_path / 'Orion_Dev')
+    for version in ('1.2.0.998', '1.2.0.1000', '1.2.0.999', '1.2.1.5'):
+        add_build(root, version)
+    add_build(root, 'Logs')
+    catalog = BuildCatalog(str(tmp_path / 'catalog.db'))
+    catalog.refresh(root, 'updateDevice')
+    assert catalog.versions(root) == ['1.2.0.998', '1.2.0.999', '1.2.0.1000', '1.2.1.5']
+    assert catalog.latest(root) == '1.2.1.5'
+    assert catalog.between(root, '1.2.0.999', '1.2.1.5') == ['1.2.0.999', '1.2.0.1000', '1.2.1.5']
+    assert catalog.previous(root, '1.2.1.5') == '1.2.0.1000'
+    assert catalog.previous(root, '1.2.1.5', 3) == '1.2.0.998'
+    assert catalog.previous(root, '1.2.0.998') is None
+    (artifact, size, mtime) = catalog.artifact(root, '1.2.0.999')
+    assert artifact == os.path.join(root, '1.2.0.999', 'Build', 'updateDevice') and size == 10
+
+def test_catalog_incremental_refresh(tmp_path, monkeypatch):
+    root = str(tmp_path / 'Orion_Dev')
+    add_build(root, '1.0.0.1')
+    add_build(root, '1.0.0.2', complete=False)
+    touch(root, 1000)
+    catalogFile = str(tmp_path / 'catalog.db')
+    BuildCatalog(catalogFile).refresh(root, 'updateDevice')
+    listed = []
+    realListdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listed.append(path) or realListdir(path))
+    # persisted: a new instance (new process) doesn't list the unchanged root again
+    catalog = BuildCatalog(catalogFile)
+    catalog.refresh(root, 'updateDevice')
+    assert listed == []
+    assert catalog.versions(root) == ['1.0.0.1']
+    # running build finishes: found without listing the root
+    with open(os.path.join(root, '1.0.0.2', 'Build', 'updateDevice'), 'wb') as f:
+        f.write(b'y')
+    catalog.refresh(root, 'updateDevice')
+    assert listed == []
+    assert catalog.latest(root) == '1.0.0.2'
+    # new folder and a removed one change the root's mtime
+    add_build(root, '1.0.0.3')
+    os.remove(os.path.join(root, '1.0.0.1', 'Build', 'updateDevice'))
+    os.rmdir(os.path.join(root, '1.0.0.1', 'Build'))
+    os.rmdir(os.path.join(root, '1.0.0.1'))
+    touch(root, 2000)
+    catalog.refresh(root, 'updateDevice')
+    assert listed == [root]
+    assert catalog.versions(root) == ['1.0.0.2', '1.0.0.3']
+
+def test_catalog_concurrent_refresh(tmp_path, monkeypatch):
+    import sqlite3
+    import threading
+    import time
+    catalogFile = str(tmp_path / 'catalog.db')
+    roots = [str(tmp_path / 'Orion_Dev'), str(tmp_path / 'Orion_Rel')]
+    for root in roots:
+        for build in range(30):
+            add_build(root, f'1.0.0.{build}')
+    locked = []
+    realStat = os.stat
+    def slowStat(path, *args, **kwargs):
+        if str(path).endswith('updateDevice'):
+            # slow share: meanwhile another process must still be able to write the catalog
+            time.sleep(0.05)
+            probe = sqlite3.connect(catalogFile, timeout=1)
+            try:
+                probe.execute('BEGIN IMMEDIATE')
+                probe.rollback()
+            except sqlite3.OperationalError as e:
+                locked.append(e)
+            probe.close()
+        return realStat(path, *args, **kwargs)
+    monkeypatch.setattr(os, 'stat', slowStat)
+    catalogs = [BuildCatalog(catalogFile) for root in roots]
+    threads = [threading.Thread(target=catalog.refresh, args=(root, 'updateDevice'))
+               for (catalog, root) in zip(catalogs, roots)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert locked == []
+    for (catalog, root) in zip(catalogs, roots):
+        assert len(catalog.versions(root)) == 30
+    assert BuildCatalog(catalogFile).versions(roots[1]) == [f'1.0.0.{build}' for build in range(30)]
@@ -0,0 +1,100 @@
+import io
+import os
+import random
+import shutil
+import subprocess
+import time
+import zlib
+import pytest
+from Lib import DeltaUpload
+from Lib.DeltaUpload import block_signatures, compute_delta, apply_delta, roll_adler32, format_ops, SignatureCache
+
+'''
+PyTest tests for block delta computation, no device needed
+'''
+
+BLOCK = 1024
+
+def make_builds(tmp_path):
+    rnd = random.Random(1)
+    old = bytes(rnd.getrandbits(8) for _ in range(40 * BLOCK + 100))
+    # new build: a few bytes changed, a chunk inserted (shifts everything after it), tail changed
+    new = old[:5000] + b'changed' + old[5007:20000] + b'inserted' * 50 + old[20000:38000] + b'new tail'
+    (tmp_path / 'old').write_bytes(old)
+    (tmp_path / 'new').write_bytes(new)
+    return (old, new)
+
+def test_roll_adler32():
+    data = bytes(range(256)) * 20
+    weak = zlib.adler32(data[:BLOCK])
+    for pos in range(len(data) - BLOCK):
+        weak = roll_adler32(weak, data[pos], data[pos + BLOCK], BLOCK)
+        assert weak == zlib.adler32(data[pos + 1:pos + 1 + BLOCK])
+
+def delta(new: bytes, tmp_path, **kwargs) -> tuple:
+    '''(ops, literal bytes) of new against the old build, None if compute_delta() gives up'''
+    literal = io.BytesIO()
+    ops = compute_delta(new, block_signatures(str(tmp_path / 'old'), BLOCK), literal, BLOCK, **kwargs)
+    return (ops, literal.getvalue()) if ops is not None else None
+
+def test_delta_reconstructs_and_sends_only_changes(tmp_path):
+    (old, new) = make_builds(tmp_path)
+    (ops, literal) = delta(new, tmp_path)
+    assert apply_delta(old, ops, literal, BLOCK) == new
+    # shifted blocks after the insertion are still found
+    assert len(literal) < 6 * BLOCK
+
+def test_delta_gives_up_on_unrelated_file(tmp_path):
+    (old, new) = make_builds(tmp_path)
+    assert delta(bytes(reversed(new)), tmp_path) is None
+
+def test_delta_gives_up_early(tmp_path):
+    make_builds(tmp_path)
+    unrelated = random.Random(2).getrandbits(8 * 4 * 1024 * 1024).to_bytes(4 * 1024 * 1024, 'little')
+    # nothing in common within the first 256KB, the rest isn't searched
+    start = time.time()
+    assert delta(unrelated, tmp_path, maxLiteralFraction=1, maxUnmatched=256 * 1024) is None
+    assert time.time() - start < 2
+    # out of time
+    start = time.time()
+    assert delta(unrelated, tmp_path, maxLiteralFraction=1, maxSeconds=0.2) is None
+    assert time.time() - start < 2
+
+def test_signature_cache(tmp_path):
+    make_builds(tmp_path)
+    cache = SignatureCache(str(tmp_path / 'signatures'))
+    assert cache.load('abc', BLOCK) is None
+    cache.save('abc', str(tmp_path / 'old'), BLOCK)
+    assert cache.load('abc', BLOCK) == block_signatures(str(tmp_path / 'old'), BLOCK)
+    # signatures made for another block size are of no use
+    assert cache.load('abc', 2 * BLOCK) is None
+
+def run_patch_script(tmp_path, shell: list, env: dict = None) -> bytes:
+    '''new build as patched by PATCH_SCRIPT run with shell'''
+    (old, new) = make_builds(tmp_path)
+    (ops, literal) = delta(new, tmp_path)
+    (tmp_path / 'literal').write_bytes(literal)
+    (tmp_path / 'delta').write_text(format_ops(ops))
+    (tmp_path / 'patch.sh').write_text(DeltaUpload.PATCH_SCRIPT)
+    subprocess.run(shell + ['patch.sh', 'old', 'delta', 'literal', 'patched', str(BLOCK)], cwd=str(tmp_path), check=True, env=env)
+    return (tmp_path / 'patched').read_bytes() == new
+
+@pytest.mark.skipif(shutil.which('sh') is None, reason='needs a POSIX shell')
+def test_patch_script(tmp_path):
+    assert run_patch_script(tmp_path, ['sh'])
+
+@pytest.mark.skipif(shutil.which('busybox') is None, reason='needs busybox')
+def test_patch_script_busybox(tmp_path):
+    # the device's shell and tools
+    (tmp_path / 'bin').mkdir()
+    for tool in ('dd', 'tail', 'head'):
+        (tmp_path / 'bin' / tool).symlink_to(shutil.which('busybox'))
+    assert run_patch_script(tmp_path, ['busybox', 'sh'], dict(os.environ, PATH=str(tmp_path / 'bin')))
+
+@pytest.mark.skipif(shutil.which('sh') is None, reason='needs a POSIX shell')
+def test_patch_script_head_reading_ahead(tmp_path):
+    # a head reading all its input, like stdio buffered ones read more than they output
+    (tmp_path / 'bin').mkdir()
+    (tmp_path / 'bin' / 'head').write_text('#!/bin/sh\nall=$(mktemp)\ncat > $all\ncommand -p head "$@" $all\nrm $all\n')
+    (tmp_path / 'bin' / 'head').chmod(0o755)
+    assert run_patch_script(tmp_path, ['sh'], dict(os.environ, PATH=str(tmp_path / 'bin') + os.pathsep + os.environ['PATH']))
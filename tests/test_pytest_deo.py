@@ -0,0 +1,123 @@
+import pytest
+import asyncio
+import gzip
+import json
+import threading
+import time
+from Lib.DeoSnapshot import DeoSnapshot
+from Lib.DeoAlarms import AlarmTracker, RAISED, CLEARED
+from Lib.DeoDecoder import DeoDecoder
+from Lib.DeoRecorder import DeoRecorder, read_recording
+
+'''
+PyTest tests for DEO message handling, no device needed
+'''
+
+def deo_message(alarms: list = [], dutyCycle: float = 0.0, systemTime: str = '05/31/2019 19:19:34') -> str:
+    alarmManager = {f'_activeAlarmsList{n}': alarms[n] if n < len(alarms) else '' for n in range(10)}
+    alarmManager['_alarmConditionState'] = len(alarms) > 0
+    return json.dumps({'DeviceData': [
+        {'structureData': alarmManager, 'structureName': 'AlarmManagerData'},
+        {'structureData': {'_blue': 0.0, '_dutyCyclePct': dutyCycle, '_frequencyHz': 0.0}, 'structureName': 'AlarmLightData'}],
+        'systemTime': systemTime})
+
+def test_snapshot_keeps_latest_containers():
+    snapshot = DeoSnapshot()
+    snapshot.update('{"DeviceDataConfig": [{"structureName": "AlarmManagerData"}]}')
+    assert snapshot.config == [{'structureName': 'AlarmManagerData'}]
+    assert snapshot.value('AlarmLightData._dutyCyclePct', 0) is None
+    snapshot.update(deo_message(dutyCycle=50.0), 1000.0)
+    assert snapshot.value('AlarmLightData._dutyCyclePct') == 50.0
+    assert snapshot.receivedAt == 1000.0
+    # containers missing from an update keep their value
+    snapshot.update(json.dumps({'DeviceData': [{'structureData': {'_dutyCyclePct': 75.0}, 'structureName': 'AlarmLightData'}],
+                                'systemTime': '05/31/2019 19:19:35'}))
+    assert snapshot.value('AlarmLightData._dutyCyclePct') == 75.0
+    assert snapshot.value('AlarmManagerData._activeAlarmsList0') == ''
+    assert snapshot.systemTime == '05/31/2019 19:19:35'
+
+def test_snapshot_wait_for_update():
+    snapshot = DeoSnapshot()
+    version = snapshot.version()
+    threading.Timer(0.1, lambda: snapshot.update(deo_message(['High Pressure']))).start()
+    start = time.time()
+    assert snapshot.container('AlarmManagerData', 5)['_activeAlarmsList0'] == 'High Pressure'
+    assert snapshot.wait_for_update(version, 5)
+    assert time.time() - start < 5
+    assert not snapshot.wait_for_update(snapshot.version(), 0.05)
+
+def test_alarm_tracker_events():
+    snapshot = DeoSnapshot()
+    tracker = AlarmTracker()
+    seen = []
+    tracker.add_callback(seen.append)
+    def feed(alarms, systemTime):
+        if 'AlarmManagerData' in snapshot.update(deo_message(alarms, systemTime=systemTime), 1000.0):
+            return tracker.update(snapshot.container('AlarmManagerData'), snapshot.systemTime, snapshot.receivedAt)
+    assert feed([], '05/31/2019 19:19:34') == []
+    # an alarm raised and cleared between two polls is still reported
+    assert [(e.kind, e.alarm) for e in feed(['High Pressure'], '05/31/2019 19:19:35')] == [(RAISED, 'High Pressure')]
+    assert [(e.kind, e.alarm) for e in feed(['Low Flow'], '05/31/2019 19:19:36')] == \
+        [(RAISED, 'Low Flow'), (CLEARED, 'High Pressure')]
+    assert tracker.active() == ['Low Flow']
+    assert [(e.kind, e.alarm) for e in feed([], '05/31/2019 19:19:37')] == [(CLEARED, 'Low Flow')]
+    assert seen == list(tracker.history)
+    assert seen[0].systemTime == '05/31/2019 19:19:35'
+    # a failing callback doesn't stop the others
+    tracker.add_callback(lambda event: 1 / 0)
+    tracker.remove_callback(seen.append)
+    assert len(feed(['High Pressure'], '05/31/2019 19:19:38')) == 1
+    assert len(seen) == 4
+
+def test_alarm_event_stream():
+    tracker = AlarmTracker()
+    async def watch():
+        stream = tracker.events()
+        # updates come from another thread, as they do from the DEO receiver
+        threading.Timer(0.05, lambda: tracker.update({'_activeAlarmsList0': 'High Pressure'}, 't1', 1.0)).start()
+        threading.Timer(0.1, lambda: tracker.update({}, 't2', 2.0)).start()
+        events = [await asyncio.wait_for(stream.__anext__(), 5) for i in range(2)]
+        stream.close()
+        return events
+    events = asyncio.run(watch())
+    assert [(e.kind, e.alarm, e.systemTime) for e in events] == [(RAISED, 'High Pressure', 't1'), (CLEARED, 'High Pressure', 't2')]
+
+def test_decoder_selective():
+    message = deo_message(['AlarmLightData'], dutyCycle=50.0)
+    decoder = DeoDecoder(['AlarmLightData', 'NotThereData'])
+    assert decoder.decode(message) == {'DeviceData': [json.loads(message)['DeviceData'][1]], 'systemTime': '05/31/2019 19:19:34'}
+    assert decoder.decode(message.encode()) == decoder.decode(message)
+    # other key order and whitespace
+    message = '{ "systemTime" : "t1",\n "DeviceData" : [ { "structureName" : "AlarmLightData" ,\n "structureData" : {"_dutyCyclePct": [1, 2]} } ] }'
+    assert decoder.decode(message) == {'DeviceData': [{'structureName': 'AlarmLightData', 'structureData': {'_dutyCyclePct': [1, 2]}}],
+                                       'systemTime': 't1'}
+    # DeviceDataConfig messages are decoded in full
+    assert decoder.decode('{"DeviceDataConfig": [{"structureName": "AlarmManagerData"}]}') == \
+        {'DeviceDataConfig': [{'structureName': 'AlarmManagerData'}]}
+    assert DeoDecoder().decode(message) == json.loads(message)
+    with pytest.raises(ValueError):
+        decoder.decode('{"DeviceData": [{"structureData": {"_dutyCyclePct": }, "structureName": "AlarmLightData"}]}')
+
+def test_snapshot_with_decoder():
+    snapshot = DeoSnapshot(DeoDecoder(['AlarmManagerData']))
+    message = deo_message(['High Pressure'], dutyCycle=50.0)
+    assert snapshot.update(message, 1000.0) == ['AlarmManagerData']
+    assert snapshot.value('AlarmManagerData._activeAlarmsList0') == 'High Pressure'
+    assert snapshot.value('AlarmLightData._dutyCyclePct', 0) is None
+    assert snapshot.systemTime == '05/31/2019 19:19:34'
+    assert snapshot.raw() == message
+
+def test_recorder(tmp_path):
+    recordFile = str(tmp_path / 'deo.ndjson.gz')
+    messages = [deo_message(dutyCycle=n, systemTime=f'05/31/2019 19:19:{n:02}') for n in range(5)]
+    with DeoRecorder(recordFile) as recorder:
+        for (n, message) in enumerate(messages):
+            recorder.record(message, 1000.0 + n)
+    assert recorder.count == 5
+    assert list(read_recording(recordFile)) == [(1000.0 + n, message) for (n, message) in enumerate(messages)]
+    # a recording cut short is read up to its last complete message
+    with gzip.open(recordFile, 'rb') as f:
+        lines = f.read()
+    with gzip.open(recordFile, 'wb') as f:
+        f.write(lines[:-100])
+    assert [receivedAt for (receivedAt, message) in read_recording(recordFile)] == [1000.0, 1001.0, 1002.0, 1003.0]
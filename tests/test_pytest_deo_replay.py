@@ -0,0 +1,107 @@
+import pytest
+aiohttp = pytest.importorskip('aiohttp')
+import gc
+import time
+from Lib.DeoRecorder import DeoRecorder, read_recording
+from Lib.DeoReplayServer import DeoReplayServer
+import Lib.DeoWebSocket
+from Lib.DeoWebSocket import DeoWebSocket
+from Lib.DeoAlarms import RAISED, CLEARED
+from test_pytest_deo import deo_message
+
+'''
+PyTest tests for DeoWebSocket against a DEO replay server, no device needed
+'''
+
+def record(recordFile: str, alarms: list, interval: float):
+    with DeoRecorder(recordFile) as recorder:
+        recorder.record('{"DeviceDataConfig": [{"structureName": "AlarmManagerData"}]}', 1000.0)
+        for (n, alarm) in enumerate(alarms):
+            recorder.record(deo_message([alarm] if alarm else [], dutyCycle=n), 1000.0 + (n + 1) * interval)
+
+def test_replay_alarms(tmp_path):
+    recordFile = str(tmp_path / 'deo.ndjson.gz')
+    # an alarm raised for one update only
+    record(recordFile, ['', '', 'High Pressure', '', ''], 1.0)
+    with DeoReplayServer(recordFile, speed=10, port=0) as server:
+        start = time.time()
+        with DeoWebSocket('127.0.0.1', port=server.port, recordFile=str(tmp_path / 'again.ndjson.gz')) as deoWS:
+            events = []
+            deoWS.alarms.add_callback(events.append)
+            assert deoWS.getCurrentContainerValue('AlarmLightData._dutyCyclePct') is not None
+            while deoWS.recorder.count < 6 and time.time() - start < 10:
+                time.sleep(0.05)
+            assert [(event.kind, event.alarm) for event in events] == [(RAISED, 'High Pressure'), (CLEARED, 'High Pressure')]
+            # 0.5s of recording at 10x
+            assert 0.3 < time.time() - start < 5
+    # recorded again by the client as replayed
+    assert [message for (receivedAt, message) in read_recording(str(tmp_path / 'again.ndjson.gz'))] == \
+        [message for (receivedAt, message) in read_recording(recordFile)]
+
+def test_replay_repeat_load(tmp_path):
+    recordFile = str(tmp_path / 'deo.ndjson.gz')
+    record(recordFile, [''] * 20, 1.0)
+    with DeoReplayServer(recordFile, speed=0, repeat=True, port=0) as server:
+        clients = [DeoWebSocket('127.0.0.1', port=server.port) for n in range(5)]
+        try:
+            for deoWS in clients:
+                # more than the recording holds, it is played over and over
+                for n in range(50):
+                    assert len(deoWS.getWSData(5)) > 0
+            assert server.clients == 5
+        finally:
+            for deoWS in clients:
+                deoWS.closeSession()
+
+def test_replay_time_series(tmp_path):
+    pytest.importorskip('numpy')
+    from Lib.DeoTimeSeries import DeoTimeSeries
+    recordFile = str(tmp_path / 'deo.ndjson.gz')
+    record(recordFile, [''] * 20, 1.0)
+    timeSeries = DeoTimeSeries(['AlarmLightData._dutyCyclePct'], str(tmp_path / 'capture'), chunkSize=8)
+    with DeoReplayServer(recordFile, speed=0, port=0) as server:
+        with DeoWebSocket('127.0.0.1', port=server.port, containers=['AlarmManagerData'], timeSeries=timeSeries) as deoWS:
+            for n in range(21):
+                assert len(deoWS.getWSData(5)) > 0
+    (times, values) = timeSeries.series('AlarmLightData._dutyCyclePct')
+    assert list(values) == list(range(20))
+    assert timeSeries.stats('AlarmLightData._dutyCyclePct').max == 19
+
+def test_poll_deo_alarm(tmp_path):
+    recordFile = str(tmp_path / 'deo.ndjson.gz')
+    record(recordFile, ['', '', 'High Pressure'], 0.2)
+    with DeoReplayServer(recordFile, port=0) as server:
+        start = time.time()
+        assert DeoWebSocket.pollDeoAlarm('127.0.0.1', 30, port=server.port)
+        # returns as soon as the alarm is raised
+        assert time.time() - start < 5
+        record(recordFile, ['', ''], 0.2)
+    with DeoReplayServer(recordFile, port=0) as server:
+        assert not DeoWebSocket.pollDeoAlarm('127.0.0.1', 1, port=server.port)
+
+def test_poll_deo_alarm_without_alarm_data(tmp_path, monkeypatch):
+    recordFile = str(tmp_path / 'deo.ndjson.gz')
+    with DeoRecorder(recordFile) as recorder:
+        recorder.record('{"DeviceData": [{"structureData": {"_dutyCyclePct": 0}, "structureName": "AlarmLightData"}]}', 1000.0)
+    monkeypatch.setattr(Lib.DeoWebSocket, 'DATA_TIMEOUT', 0.5)
+    with DeoReplayServer(recordFile, port=0) as server:
+        # no AlarmManagerData, that's not "no alarms"
+        with pytest.raises(Exception, match='AlarmManagerData'):
+            DeoWebSocket.pollDeoAlarm('127.0.0.1', 1, port=server.port)
+    # nothing listening
+    monkeypatch.setattr(Lib.DeoWebSocket.time, 'sleep', lambda seconds: None)
+    with pytest.raises(Exception, match='unable to make websocket'):
+        DeoWebSocket.pollDeoAlarm('127.0.0.1', 1, port=server.port)
+
+def test_dropped_client_stops(tmp_path):
+    recordFile = str(tmp_path / 'deo.ndjson.gz')
+    record(recordFile, [''] * 20, 1.0)
+    with DeoReplayServer(recordFile, speed=0, repeat=True, port=0) as server:
+        deoWS = DeoWebSocket('127.0.0.1', port=server.port)
+        assert len(deoWS.getWSData(5)) > 0
+        thread = deoWS._thread
+        # never closed, dropping it stops the receiving thread
+        del deoWS
+        gc.collect()
+        thread.join(5)
+        assert not thread.is_alive()
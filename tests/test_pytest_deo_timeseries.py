@@ -0,0 +1,66 @@
+import pytest
+np = pytest.importorskip('numpy')
+import json
+from Lib.DeoSnapshot import DeoSnapshot
+from Lib.DeoTimeSeries import DeoTimeSeries, load_capture
+from test_pytest_deo import deo_message
+
+'''
+PyTest tests for DEO time-series capture, no device needed
+'''
+
+DUTY_CYCLE = 'AlarmLightData._dutyCyclePct'
+ALARM_STATE = 'AlarmManagerData._alarmConditionState'
+
+def capture(captureDir: str, samples: int, chunkSize: int, interval: float = 0) -> DeoTimeSeries:
+    '''duty cycle n % 10 at time 1000 + n'''
+    timeSeries = DeoTimeSeries([DUTY_CYCLE, ALARM_STATE, 'AlarmLightData._missing'], captureDir, interval, chunkSize)
+    snapshot = DeoSnapshot()
+    for n in range(samples):
+        snapshot.update(deo_message(['High Pressure'] if n % 2 else [], dutyCycle=float(n % 10)), 1000.0 + n)
+        timeSeries.sample(snapshot, 1000.0 + n)
+    return timeSeries
+
+def test_capture_chunks(tmp_path):
+    timeSeries = capture(str(tmp_path), 25, 10)
+    # two full chunks on disk, the rest in memory
+    assert len(timeSeries) == 25
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['chunk_00000.npz', 'chunk_00001.npz']
+    (times, values) = timeSeries.series(DUTY_CYCLE, 1008, 1013)
+    assert list(times) == [1008, 1009, 1010, 1011, 1012]
+    assert list(values) == [8, 9, 0, 1, 2]
+    assert list(timeSeries.series(ALARM_STATE, 1000, 1003)[1]) == [0, 1, 0]
+    assert np.isnan(timeSeries.series('AlarmLightData._missing')[1]).all()
+    timeSeries.close()
+    columns = load_capture(str(tmp_path))
+    assert list(columns['time']) == [1000.0 + n for n in range(25)]
+    assert list(columns[DUTY_CYCLE]) == [float(n % 10) for n in range(25)]
+    with pytest.raises(Exception):
+        DeoTimeSeries([DUTY_CYCLE], str(tmp_path))
+
+def test_window_stats(tmp_path):
+    timeSeries = capture(str(tmp_path), 25, 10)
+    stats = timeSeries.stats(DUTY_CYCLE)
+    assert (stats.count, stats.min, stats.max) == (25, 0, 9)
+    assert stats.mean == pytest.approx(sum(n % 10 for n in range(25)) / 25)
+    # a window covering chunk 1 and parts of chunk 0 and memory
+    stats = timeSeries.stats(DUTY_CYCLE, 1005, 1022)
+    assert (stats.count, stats.min, stats.max) == (17, 0, 9)
+    assert stats.mean == pytest.approx(sum(n % 10 for n in range(5, 22)) / 17)
+    assert timeSeries.stats('AlarmLightData._missing').count == 0
+    assert timeSeries.stats(DUTY_CYCLE, 2000, 3000).count == 0
+
+def test_downsample(tmp_path):
+    timeSeries = capture(str(tmp_path), 25, 10)
+    (starts, mins, maxs, means) = timeSeries.downsample(DUTY_CYCLE, 10)
+    assert list(starts) == [1000, 1010, 1020]
+    assert list(mins) == [0, 0, 0]
+    assert list(maxs) == [9, 9, 4]
+    assert list(means) == [4.5, 4.5, 2]
+    (starts, mins, maxs, means) = timeSeries.downsample(DUTY_CYCLE, 5, 1015, 1035)
+    assert list(starts) == [1015, 1020, 1025, 1030]
+    assert list(means[:2]) == [7, 2]
+    assert np.isnan(means[2:]).all()
+    # capture decimated to one sample per 3s
+    timeSeries = capture(str(tmp_path / 'decimated'), 25, 10, interval=3)
+    assert list(timeSeries.series(DUTY_CYCLE)[0]) == [1000.0 + n for n in range(0, 25, 3)]
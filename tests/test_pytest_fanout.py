@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+import time
+from Lib.Artifacts import Sha256Cache
+from Lib.FanoutUpload import FanoutUpload
+
+'''
+PyTest tests for fan-out upload, devices stood in for by local directories
+'''
+
+class LocalFile:
+    def __init__(self, path: str, delay: float):
+        self._f = open(path, 'wb')
+        self._delay = delay
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def write(self, data):
+        time.sleep(self._delay)
+        self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+    def stat(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._f.close()
+
+
+class LocalTarget:
+    '''the parts of DeviceSSH FanoutUpload uses, writing to a local directory'''
+
+    def __init__(self, directory, delay: float = 0):
+        self._directory = directory
+        self._delay = delay
+        self.opened = 0
+
+    def open_sftp(self):
+        return self
+
+    def open(self, remoteFile, mode):
+        self.opened += 1
+        return LocalFile(os.path.join(self._directory, os.path.basename(remoteFile)), self._delay)
+
+    def close(self):
+        pass
+
+    def remoteSha256(self, remoteFile):
+        path = os.path.join(self._directory, os.path.basename(remoteFile))
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_fanout_slow_target_does_not_stall_others(tmp_path):
+    data = os.urandom(64 * 1024 + 123)
+    source = tmp_path / 'device.mender'
+    source.write_bytes(data)
+    (tmp_path / 'fast').mkdir()
+    (tmp_path / 'slow').mkdir()
+    fast = LocalTarget(str(tmp_path / 'fast'))
+    slow = LocalTarget(str(tmp_path / 'slow'), delay=0.02)
+    hashCache = Sha256Cache(str(tmp_path / 'cache.json'))
+    # small window, the slow target has to read back from the spool file
+    fanout = FanoutUpload(str(source), chunkSize=1024, windowChunks=4, hashCache=hashCache)
+    results = fanout.upload({'fast': (fast, '/data/update/device.mender'), 'slow': (slow, '/data/update/device.mender')})
+    assert results == {'fast': None, 'slow': None}
+    assert (tmp_path / 'fast' / 'device.mender').read_bytes() == data
+    assert (tmp_path / 'slow' / 'device.mender').read_bytes() == data
+    # sha256 computed while streaming is remembered, a second run skips devices already up to date
+    assert hashCache.peek(str(source)) == hashlib.sha256(data).hexdigest()
+    results = FanoutUpload(str(source), hashCache=hashCache).upload({'fast': (fast, '/data/update/device.mender')})
+    assert results == {'fast': None}
+    assert fast.opened == 1
+
+def test_fanout_reports_failed_target(tmp_path):
+    source = tmp_path / 'device.mender'
+    source.write_bytes(b'x' * 5000)
+    (tmp_path / 'good').mkdir()
+    results = FanoutUpload(str(source), chunkSize=1024, hashCache=Sha256Cache(str(tmp_path / 'cache.json'))).upload(
+        {'good': (LocalTarget(str(tmp_path / 'good')), '/data/device.mender'),
+         'bad': (LocalTarget(str(tmp_path / 'missing')), '/data/device.mender')})
+    assert results['good'] is None
+    assert isinstance(results['bad'], OSError)
@@ -0,0 +1,74 @@
+from Lib.Pipeline import Pipeline
+
+'''
+PyTest tests for the checkpointed step pipeline
+'''
+
+IDENTITY = {'relBuild': None, 'devBuild': '1.2.0.100'}
+
+def run(checkpointFile, resume, calls, failInstall=False, verified=True):
+    pipeline = Pipeline(checkpointFile, IDENTITY, resume)
+    def step(name, result):
+        def func():
+            calls.append(name)
+            return result
+        return func
+    pipeline.step('discover', step('discover', {'devBuild': '1.2.0.100'}))
+    pipeline.step('upload', step('upload', {'updateDevice': True}))
+    pipeline.step('install_dev', step('install_dev', {'failed': failInstall, 'build': '1.2.0.100'}),
+                  lambda result: verified)
+    return pipeline
+
+def test_resume_skips_completed_steps(tmp_path):
+    checkpointFile = str(tmp_path / 'ORION.checkpoint.json')
+    calls = []
+    run(checkpointFile, False, calls, failInstall=True)
+    assert calls == ['discover', 'upload', 'install_dev']
+    # failed step runs again, completed ones are skipped
+    calls = []
+    pipeline = run(checkpointFile, True, calls)
+    assert calls == ['install_dev']
+    assert pipeline.resumed == ['discover', 'upload']
+    assert pipeline.result('discover') == {'devBuild': '1.2.0.100'}
+    # device no longer on the installed build: install again
+    calls = []
+    run(checkpointFile, True, calls, verified=False)
+    assert calls == ['install_dev']
+
+def test_checkpoint_ignored_without_resume_or_for_other_run(tmp_path):
+    checkpointFile = str(tmp_path / 'ORION.checkpoint.json')
+    run(checkpointFile, False, [])
+    calls = []
+    run(checkpointFile, False, calls)
+    assert calls == ['discover', 'upload', 'install_dev']
+    pipeline = Pipeline(checkpointFile, {'relBuild': '1.2.0.90', 'devBuild': None}, True)
+    assert not pipeline.done('discover')
+
+def test_interrupted_step_verified_on_resume(tmp_path):
+    checkpointFile = str(tmp_path / 'ORION.checkpoint.json')
+    expected = {'build': '1.2.0.100', 'summary': []}
+    def crash():
+        raise KeyboardInterrupt
+    pipeline = Pipeline(checkpointFile, IDENTITY)
+    try:
+        pipeline.step('install_dev', crash, lambda result: True, expected)
+    except KeyboardInterrupt:
+        pass
+    # device not on the expected build: install again
+    calls = []
+    pipeline = Pipeline(checkpointFile, IDENTITY, True)
+    pipeline.step('install_dev', lambda: calls.append('install_dev') or {'failed': True}, lambda result: False, expected)
+    assert calls == ['install_dev']
+    # interrupted again, device ended up on the expected build: done
+    pipeline = Pipeline(checkpointFile, IDENTITY)
+    try:
+        pipeline.step('install_dev', crash, lambda result: True, expected)
+    except KeyboardInterrupt:
+        pass
+    calls = []
+    verified = []
+    pipeline = Pipeline(checkpointFile, IDENTITY, True)
+    result = pipeline.step('install_dev', lambda: calls.append('install_dev') or {},
+                           lambda result: verified.append(result) or True, expected)
+    assert calls == [] and result == expected and verified == [expected]
+    assert pipeline.done('install_dev') and pipeline.resumed == ['install_dev']
@@ -0,0 +1,347 @@
+import pytest
+serial = pytest.importorskip('serial')
+import socket
+import subprocess
+import threading
+import time
+import Lib.DeviceSerial
+from Lib.DeviceSerial import DeviceSerial
+from Lib.SerialReader import SerialReader
+from Lib.CommandResult import CommandResult
+
+'''
+PyTest tests for DeviceSerial against a simulated device on a fake serial port, no device needed
+'''
+
+USER = 'root'
+PASSWORD = 'secret'
+PROMPT = 'root@orion:~# '
+LOGIN_PROMPT = 'orion login: '
+
+class FakeDevice:
+    """
+    serial port of a simulated device: login, a shell running the commands typed with sh, reboot
+    everything written is kept in writes
+    """
+
+    def __init__(self, loggedIn: bool = True, bootTime: float = 0.3):
+        self.port = 'FAKE'
+        self.timeout = 0.1
+        self.bootTime = bootTime
+        self.state = 'shell' if loggedIn else 'login'
+        self.writes = []
+        self._typed = ''
+        self._output = b''
+        self._cond = threading.Condition()
+
+    @property
+    def in_waiting(self) -> int:
+        with self._cond:
+            return len(self._output)
+
+    def read(self, size: int = 1) -> bytes:
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._output) > 0, self.timeout)
+            (data, self._output) = (self._output[:size], self._output[size:])
+            return data
+
+    def send(self, text: str):
+        '''device output'''
+        with self._cond:
+            self._output += text.encode()
+            self._cond.notify_all()
+
+    def write(self, data: bytes):
+        self.writes.append(data.decode())
+        self._typed += data.decode()
+        while '\n' in self._typed:
+            (line, self._typed) = self._typed.split('\n', 1)
+            self._line(line)
+
+    def _line(self, line: str):
+        if self.state == 'login':
+            if len(line) == 0:
+                self.send('\r\n' + LOGIN_PROMPT)
+            else:
+                self.send(line + '\r\nPassword: ')
+                self.state = 'password'
+        elif self.state == 'password':
+            if line == PASSWORD:
+                self.state = 'shell'
+                self.send('\r\nLast login: today\r\n' + PROMPT)
+            else:
+                self.state = 'login'
+                self.send('\r\nLogin incorrect\r\n' + LOGIN_PROMPT)
+        elif self.state == 'shell':
+            self.send(line + '\r\n')
+            if line == 'reboot':
+                self.state = 'booting'
+                threading.Timer(self.bootTime, self._booted).start()
+            elif len(line) > 0:
+                output = subprocess.run(['sh', '-c', line], stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+                self.send(output.decode().replace('\n', '\r\n') + PROMPT)
+            else:
+                self.send(PROMPT)
+
+    def _booted(self):
+        self.send('[    0.000000] Booting Linux\r\n[    2.000000] systemd: started\r\n\r\n' + LOGIN_PROMPT)
+        self.state = 'login'
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeSSH:
+    """DeviceSSH stand-in, commands answered with 'ssh' until it fails or goes inactive"""
+
+    def __init__(self):
+        self.active = True
+        self.failing = False
+        self.commands = []
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def runCommand(self, commandString: str, timeout: float = None) -> CommandResult:
+        if self.failing:
+            raise OSError('connection reset')
+        self.commands.append(commandString)
+        return CommandResult(['ssh'], 0, 0.0)
+
+
+@pytest.fixture
+def device(monkeypatch):
+    device = FakeDevice()
+    monkeypatch.setattr(Lib.DeviceSerial.serial, 'Serial', lambda *args, **kwargs: device)
+    # enterString()/reboot() pauses for a real device
+    monkeypatch.setattr(Lib.DeviceSerial.time, 'sleep', lambda seconds: None)
+    return device
+
+@pytest.fixture
+def deviceSerial(device):
+    deviceSerial = DeviceSerial('FAKE')
+    yield deviceSerial
+    deviceSerial.close()
+
+@pytest.fixture
+def reader(device):
+    reader = SerialReader(device, ringSize=5)
+    reader.start()
+    yield reader
+    reader.stop()
+    reader.join(1)
+
+def test_send_command_returns_at_prompt(deviceSerial):
+    start = time.time()
+    # the echoed command is left out
+    assert deviceSerial.sendCommand('echo one; echo two') == (True, ['one', 'two'])
+    assert deviceSerial.commandOutput('echo three') == ['three']
+    assert time.time() - start < 1
+
+def test_execute_command_and_verify_output(deviceSerial):
+    assert deviceSerial.executeCommandAndVerifyOutput('echo done', 'done')
+    assert not deviceSerial.executeCommandAndVerifyOutput('echo done already', 'done')
+    assert deviceSerial.executeCommandAndVerifyOutput('echo done already', 'done', exact=False)
+    # no match, given up as soon as the prompt is back
+    start = time.time()
+    assert not deviceSerial.executeCommandAndVerifyOutput('echo other', 'done')
+    assert time.time() - start < 1
+
+def test_expect_timeout(device, deviceSerial):
+    # rebooting, nothing answers
+    device.state = 'booting'
+    start = time.time()
+    assert deviceSerial.sendCommand('echo one', None, 0.5) == (False, [])
+    assert 0.5 <= time.time() - start < 2
+
+def test_reader_ring_buffer(device, reader):
+    mark = reader.mark()
+    device.send('one\r\ntwo\r\n' + PROMPT)
+    assert reader.wait_for('^two$', 2) == 'two'
+    assert [line for (seq, timestamp, line) in reader.lines_since(mark)] == ['one', 'two']
+    assert reader.partial() == PROMPT
+    # bounded, the oldest lines go
+    device.send(''.join(f'{n}\r\n' for n in range(10)))
+    assert reader.wait_for('^9$', 2) == '9'
+    assert [line for (seq, timestamp, line) in reader.lines_since(mark)] == ['5', '6', '7', '8', '9']
+
+def test_reader_subscriptions(device, reader):
+    mark = reader.mark()
+    device.send('Mender commit done\r\n')
+    # received before subscribing, found looking back from the mark
+    assert reader.wait_for('commit done', 2, mark) == 'Mender commit done'
+    assert reader.wait_for('commit done', 0.2) is None
+    # arriving mid wait
+    threading.Timer(0.3, lambda: device.send('Reboot when ready\r\n')).start()
+    start = time.time()
+    assert reader.wait_for('Reboot when ready', 30) == 'Reboot when ready'
+    assert time.time() - start < 2
+    # prompts without a newline match too
+    device.send(LOGIN_PROMPT)
+    assert reader.wait_for(r'login:\s*$', 2, mark) == LOGIN_PROMPT.strip()
+
+def test_wait_for_output_since_mark(device, deviceSerial):
+    mark = deviceSerial.output_mark()
+    device.send('Installing update\r\n')
+    assert deviceSerial.wait_for_output('^Installing', 5, mark) == 'Installing update'
+    assert deviceSerial.wait_for_output('^Never$', 0.2) is None
+
+def test_run_command(device, deviceSerial):
+    result = deviceSerial.runCommand('echo one; echo two')
+    assert (result.stdout, result.exitCode) == (['one', 'two'], 0)
+    assert result.succeeded
+    assert deviceSerial.runCommand('echo failing; (exit 3)').exitCode == 3
+    assert not deviceSerial.bachExecuteCommand('false')
+    assert deviceSerial.bachExecuteCommand('true')
+    # no end marker in time, no exit status
+    device.state = 'booting'
+    assert deviceSerial.runCommand('true', 0.3).exitCode is None
+
+@pytest.fixture
+def stateQueries(monkeypatch, tmp_path):
+    '''device state queries reading sample files instead of the device's'''
+    files = {'VERSIONS_QUERY': 'BUILD_VERSION="1.2.3.4"\nOS_VERSION="5.6"\n',
+             'DEVICE_TYPE_QUERY': 'deviceType="ORION"\n',
+             'IP_ADDRESSES_QUERY': 'NAME   STATE   AUTOSTART GROUPS IPV4          IPV6\n'
+                                   'driver RUNNING 1         -      192.168.1.10  -\n'
+                                   'net    RUNNING 1         -      10.0.0.5      -\n'}
+    for (query, content) in files.items():
+        path = tmp_path / query
+        path.write_text(content)
+        monkeypatch.setattr(Lib.DeviceSerial, query, f'cat {path}')
+
+def test_run_serial_command_without_newline(deviceSerial):
+    start = time.time()
+    result = deviceSerial.runSerialCommand('printf noeol')
+    assert (result.stdout, result.exitCode) == (['noeol'], 0)
+    assert time.time() - start < 2
+    assert deviceSerial.runSerialCommand('printf "a\\n\\n"').stdout == ['a', '']
+    assert deviceSerial.runSerialCommand('true').stdout == []
+
+def test_query_batch(deviceSerial):
+    sections = deviceSerial.queryBatch({'first': 'echo 1', 'second': 'echo 2; echo 3', 'third': 'true'})
+    assert sections == {'first': ['1'], 'second': ['2', '3'], 'third': []}
+
+def test_query_batch_without_newline(deviceSerial):
+    sections = deviceSerial.queryBatch({'first': 'printf noeol', 'second': 'printf "x\\n\\n"', 'third': 'true'})
+    assert sections == {'first': ['noeol'], 'second': ['x', ''], 'third': []}
+
+def test_get_device_state(device, deviceSerial, stateQueries):
+    device.writes.clear()
+    state = deviceSerial.get_device_state()
+    assert state == ('1.2.3.4', '5.6', ('ORION',), '192.168.1.10', '10.0.0.5')
+    assert state.has_device_type('orion')
+    # one round trip
+    assert len(device.writes) == 1
+
+def test_device_state_cached_until_reboot(device, deviceSerial, stateQueries):
+    state = deviceSerial.get_device_state()
+    device.writes.clear()
+    assert deviceSerial.get_device_state() == state
+    assert deviceSerial.get_versions() == ('1.2.3.4', '5.6')
+    assert deviceSerial.checkDeviceType('ORION')
+    # all answered from the cache
+    assert len(device.writes) == 0
+    assert deviceSerial.cache_stats() == {'hits': 3, 'misses': 1}
+    # a login prompt after a reboot not done through DeviceSerial (e.g. mender)
+    device.send('\r\n' + LOGIN_PROMPT)
+    assert deviceSerial.wait_for_output(r'login:\s*$', 2) is not None
+    # watchers have run once the reader lets go of its lock
+    deviceSerial.output_mark()
+    assert deviceSerial.get_versions() == ('1.2.3.4', '5.6')
+    assert len(device.writes) == 1
+
+def test_commands_routed_over_ssh(device, deviceSerial):
+    ssh = FakeSSH()
+    deviceSerial.attachSSH(ssh)
+    device.writes.clear()
+    assert deviceSerial.commandOutput('echo one') == ['ssh']
+    assert len(device.writes) == 0
+    # session gone, serial from now on
+    ssh.active = False
+    assert deviceSerial.commandOutput('echo two') == ['two']
+    deviceSerial.attachSSH(ssh)
+    ssh.active = True
+    ssh.failing = True
+    assert deviceSerial.commandOutput('echo three') == ['three']
+    ssh.failing = False
+    assert deviceSerial.commandOutput('echo four') == ['four']
+    assert ssh.commands == ['echo one']
+
+@pytest.fixture
+def services(monkeypatch):
+    '''SSH and DEO ports listening on the loopback addresses lxc-ls reports'''
+    monkeypatch.setattr(Lib.DeviceSerial, 'IP_ADDRESSES_QUERY',
+                        "printf 'driver RUNNING 1 - 127.0.0.1 -\\nnet RUNNING 1 - 127.0.0.1 -\\n'")
+    servers = {}
+    for name in ('SSH_PORT', 'DEO_PORT'):
+        servers[name] = socket.socket()
+        servers[name].bind(('127.0.0.1', 0))
+        servers[name].listen()
+        monkeypatch.setattr(Lib.DeviceSerial, name, servers[name].getsockname()[1])
+    yield servers
+    for server in servers.values():
+        server.close()
+
+def test_wait_network_ready(monkeypatch, device, deviceSerial, services):
+    ips = ('127.0.0.1', '127.0.0.1')
+    assert deviceSerial.wait_network_ready(5) == ips
+    # after a reboot, the known addresses are probed without a serial round trip
+    deviceSerial.invalidate_cache('reboot')
+    device.writes.clear()
+    assert deviceSerial.wait_network_ready(5) == ips
+    assert len(device.writes) == 0
+    # not answering there, looked up again over serial
+    monkeypatch.setattr(Lib.DeviceSerial, 'KNOWN_IP_PROBE_TIMEOUT', 0.3)
+    list(map(socket.socket.close, services.values()))
+    start = time.time()
+    assert deviceSerial.wait_network_ready(1) == ips
+    assert len(device.writes) > 0
+    assert time.time() - start < 3
+
+def test_network_ready_without_deo(device, deviceSerial, services):
+    # DEO still starting: SSH alone makes the network ready, DEO is waited for on its own
+    services['DEO_PORT'].close()
+    start = time.time()
+    assert deviceSerial.wait_network_ready(5) == ('127.0.0.1', '127.0.0.1')
+    assert time.time() - start < 2
+    assert not DeviceSerial.wait_deo_ready('127.0.0.1', 0.5)
+    deo = socket.socket()
+    deo.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    deo.bind(('127.0.0.1', Lib.DeviceSerial.DEO_PORT))
+    deo.listen()
+    assert DeviceSerial.wait_deo_ready('127.0.0.1', 5)
+    deo.close()
+
+def test_wait_for_output_mid_wait(device, deviceSerial):
+    mark = deviceSerial.output_mark()
+    threading.Timer(0.3, lambda: device.send('Reboot when ready\r\n')).start()
+    start = time.time()
+    assert deviceSerial.wait_for_output('Reboot when ready', 30, mark) == 'Reboot when ready'
+    assert time.time() - start < 2
+
+def test_reboot_logs_in_again(device, deviceSerial):
+    assert deviceSerial.login(USER, PASSWORD)
+    assert device.state == 'shell'
+    device.writes.clear()
+    start = time.time()
+    deviceSerial.reboot(killInternalUI=False, waitForIP=False)
+    assert time.time() - start < 10
+    # the echoed 'root@orion:~# reboot' must not pass for being logged in
+    assert USER + '\n' in device.writes and any(write.startswith(PASSWORD + '\n') for write in device.writes)
+    assert device.state == 'shell'
+
+def test_login_from_login_prompt(device, deviceSerial):
+    device.state = 'login'
+    # stale prompt output from before, not an answer to login()'s enters
+    device.send(PROMPT + 'exit\r\nlogout\r\n')
+    # time.sleep is patched out, let the reader pick it up
+    threading.Event().wait(0.3)
+    assert deviceSerial.login(USER, PASSWORD)
+    assert device.state == 'shell'
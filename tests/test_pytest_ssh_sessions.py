@@ -0,0 +1,86 @@
+import pytest
+paramiko = pytest.importorskip('paramiko')
+scp = pytest.importorskip('scp')
+import time
+import Lib.SSHSessionManager
+from Lib.SSHSessionManager import SSHSessionManager
+
+'''
+PyTest tests for SSHSessionManager with stand-in sessions and DeviceSSH progress logging, no device needed
+'''
+
+class FakeDeviceSSH:
+    '''the parts of DeviceSSH SSHSessionManager uses'''
+
+    def __init__(self, IP: str, user: str, password: str):
+        self.IP = IP
+        self.active = True
+        self.reconnects = 0
+        self.closed = False
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def reconnect(self, IP: str = None):
+        if IP is not None:
+            self.IP = IP
+        self.reconnects += 1
+        self.active = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def portOpen(monkeypatch):
+    '''whether the SSH port answers, for the monitor thread'''
+    portOpen = [False]
+    monkeypatch.setattr(Lib.SSHSessionManager, 'DeviceSSH', FakeDeviceSSH)
+    monkeypatch.setattr(Lib.SSHSessionManager, 'port_is_open', lambda host, port: portOpen[0])
+    return portOpen
+
+def test_session_reused_and_reconnected(portOpen):
+    manager = SSHSessionManager(monitorInterval=60)
+    try:
+        session = manager.session('ORION', '10.0.0.5', 'root', '')
+        assert manager.session('ORION', '10.0.0.5', 'root', '') is session
+        assert session.reconnects == 0
+        # dropped by a reboot
+        session.active = False
+        assert manager.session('ORION', '10.0.0.5', 'root', '') is session
+        assert (session.reconnects, session.active) == (1, True)
+        # new address after the reboot
+        assert manager.session('ORION', '10.0.0.6', 'root', '').IP == '10.0.0.6'
+        assert manager.get('ERIC') is None
+    finally:
+        manager.close()
+    assert session.closed
+    assert manager.get('ORION') is None
+
+def test_monitor_reconnects_in_background(portOpen):
+    manager = SSHSessionManager(monitorInterval=0.05)
+    try:
+        session = manager.session('ORION', '10.0.0.5', 'root', '')
+        session.active = False
+        time.sleep(0.3)
+        # still rebooting, nothing to connect to yet
+        assert session.reconnects == 0
+        portOpen[0] = True
+        deadline = time.time() + 5
+        while not session.active and time.time() < deadline:
+            time.sleep(0.05)
+        assert session.active and session.reconnects == 1
+    finally:
+        manager.close()
+
+def test_progress_kept_per_upload(monkeypatch):
+    import Lib.DeviceSSH
+    logged = []
+    monkeypatch.setattr(Lib.DeviceSSH, 'logger', type('Logger', (), {'info': lambda self, line: logged.append(line)})())
+    (first, second) = (Lib.DeviceSSH.progress_logger(), Lib.DeviceSSH.progress_logger())
+    # interleaved uploads at the same percentage both get logged, a repeat of one doesn't
+    first('a', 100, 10)
+    second('b', 100, 10)
+    first('a', 100, 10)
+    second('b', 100, 20)
+    assert [line.split("'")[0] for line in logged] == ['a', 'b', 'b']
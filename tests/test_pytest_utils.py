@@ -0,0 +1,64 @@
+import socket
+import threading
+import time
+from utils import *
+
+'''
+PyTest tests for the waiting helpers in utils, no device needed
+'''
+
+def test_wait_until_woken_by_condition_event():
+    # the wake event being the condition itself, as with serial output subscriptions
+    event = threading.Event()
+    threading.Timer(0.3, event.set).start()
+    start = time.time()
+    assert wait_until(event.is_set, 5, Backoff(1, 2, 60), None, event)
+    assert time.time() - start < 1
+
+def test_wait_until_woken_externally():
+    flag = []
+    wake = threading.Event()
+    def arrive():
+        flag.append(True)
+        wake.set()
+    threading.Timer(0.3, arrive).start()
+    start = time.time()
+    assert wait_until(lambda: len(flag) > 0, 5, Backoff(10, 1, 10), None, wake)
+    assert time.time() - start < 1
+
+def test_wait_until_timeout_and_cancel():
+    start = time.time()
+    assert not wait_until(lambda: False, 0.3, Backoff(0.1, 1, 0.1))
+    assert 0.3 <= time.time() - start < 1
+    cancel = CancelToken()
+    threading.Timer(0.2, cancel.cancel).start()
+    start = time.time()
+    assert not wait_until(lambda: False, 5, Backoff(10, 1, 10), cancel)
+    assert time.time() - start < 1
+
+def test_port_is_open():
+    with socket.socket() as server:
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        port = server.getsockname()[1]
+        assert port_is_open('127.0.0.1', port)
+    assert not port_is_open('127.0.0.1', port)
+
+def test_cancel_token_unlinks_finished_waits():
+    # one token for a whole run, the events of waits that are over must not pile up in it
+    cancel = CancelToken()
+    for n in range(100):
+        assert wait_until(lambda: True, 5, None, cancel)
+        assert not wait_until(lambda: False, 0.01, Backoff(0.01, 1, 0.01), cancel)
+    assert len(cancel._wakers) == 0
+    wake = threading.Event()
+    unlink = cancel.link(wake)
+    cancel.cancel()
+    assert wake.is_set()
+    unlink()
+    assert len(cancel._wakers) == 0
+
+def test_rig_config_file_and_name():
+    assert rig_config_file('orion') == 'ORION.INI'
+    assert rig_config_file('ORION_2.INI') == 'ORION_2.INI'
+    assert rig_name(os.path.join('configs', 'orion_2.ini')) == 'ORION_2'
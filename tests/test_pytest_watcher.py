@@ -0,0 +1,44 @@
+import os
+from Lib.Config import Config
+from Lib.BuildWatcher import BuildWatcher, BuildJob
+
+'''
+PyTest tests for the build watcher, build share stood in for by a local directory
+'''
+
+def make_config(tmp_path, device: str) -> Config:
+    iniFile = tmp_path / f'{device}.INI'
+    iniFile.write_text(f'DEVICE={device}\nBUILD_ROOT={tmp_path}{os.sep}share{os.sep}\n'
+                       f'DEV_BUILD_ROOT=Orion_Dev\nREL_BUILD_ROOT=Orion_Rel\nBUILD_CATALOG={tmp_path / "catalog.db"}\n')
+    return Config(str(iniFile))
+
+def add_build(tmp_path, kind: str, version: str, data: bytes = b'x'):
+    (root, artifact) = ('Orion_Dev', 'updateDevice') if kind == 'dev' else ('Orion_Rel', 'device.mender')
+    build = tmp_path / 'share' / root / version / 'Build'
+    build.mkdir(parents=True, exist_ok=True)
+    (build / artifact).write_bytes(data)
+    # directory mtime granularity may be coarse, make sure the change is visible
+    rootMtime = os.stat(str(tmp_path / 'share' / root)).st_mtime_ns
+    os.utime(str(tmp_path / 'share' / root), ns=(rootMtime + 1000000000, rootMtime + 1000000000))
+
+def test_watcher_triggers_once_build_is_stable(tmp_path):
+    add_build(tmp_path, 'dev', '1.0.0.1')
+    add_build(tmp_path, 'rel', '1.0.0.1')
+    watcher = BuildWatcher({'ORION': make_config(tmp_path, 'ORION'), 'ERIC': make_config(tmp_path, 'ERIC')},
+                           None, stableSeconds=100, stateFile=str(tmp_path / 'watcher.json'))
+    # builds already there are the starting point
+    assert watcher.poll_once(0) == []
+    add_build(tmp_path, 'dev', '1.0.0.2', b'partial')
+    assert watcher.poll_once(10) == []
+    # still being written
+    add_build(tmp_path, 'dev', '1.0.0.2', b'partial, more')
+    assert watcher.poll_once(60) == []
+    assert watcher.poll_once(150) == []
+    assert watcher.poll_once(170) == [BuildJob('ORION', 'dev', '1.0.0.2'), BuildJob('ERIC', 'dev', '1.0.0.2')]
+    assert watcher.poll_once(300) == []
+    # a restarted watcher remembers what was triggered
+    restarted = BuildWatcher({'ORION': make_config(tmp_path, 'ORION')}, None, stableSeconds=100,
+                             stateFile=str(tmp_path / 'watcher.json'))
+    add_build(tmp_path, 'rel', '1.0.0.3')
+    restarted.poll_once(400)
+    assert restarted.poll_once(500) == [BuildJob('ORION', 'rel', '1.0.0.3')]
@@ -1,5 +1,8 @@
 import logging
+import os
 import time
+import threading
+import socket
 
 def get_build_number(buildVersion):
     '''
@@ -40,6 +43,134 @@ def second_build_is_newer(build1: str, build2: str) -> bool:
     return False
 
 
+class Deadline:
+    '''
+    point in time a wait has to be done by, can be shared across nested waits
+    seconds None means no deadline
+    a child deadline never ends after its parent
+    '''
+
+    def __init__(self, seconds: float = None, parent = None):
+        self._end = None if seconds is None else time.time() + seconds
+        if parent is not None and parent._end is not None:
+            self._end = parent._end if self._end is None else min(self._end, parent._end)
+
+    @staticmethod
+    def of(timeout):
+        '''timeout may be a Deadline already, or seconds'''
+        return timeout if isinstance(timeout, Deadline) else Deadline(timeout)
+
+    def child(self, seconds: float = None):
+        return Deadline(seconds, self)
+
+    def remaining(self):
+        '''seconds left (>= 0), None if no deadline'''
+        if self._end is None:
+            return None
+        return max(0., self._end - time.time())
+
+    def expired(self) -> bool:
+        return self._end is not None and time.time() >= self._end
+
+
+class Backoff:
+    '''
+    intervals between polls: fast early polls, slower later ones
+    initial, initial*factor, initial*factor^2... capped at maximum
+    '''
+
+    def __init__(self, initial: float = 0.5, factor: float = 1.5, maximum: float = 10):
+        self.initial = min(initial, maximum)
+        self.factor = factor
+        self.maximum = maximum
+
+    def __iter__(self):
+        interval = self.initial
+        while True:
+            yield interval
+            interval = min(interval * self.factor, self.maximum)
+
+
+class CancelToken:
+    '''cancels waits it's passed to, from another thread'''
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._wakers = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._cancelled.set()
+        # wake up sleeping waits so they notice right away
+        with self._lock:
+            list(map(threading.Event.set, self._wakers))
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def link(self, wake: threading.Event):
+        '''
+        wake gets set on cancel()
+        returns a function unlinking it again, to call once the wait is over (a token can outlive many waits)
+        '''
+        with self._lock:
+            self._wakers.append(wake)
+        if self.cancelled:
+            wake.set()
+        return lambda: self._unlink(wake)
+
+    def _unlink(self, wake: threading.Event):
+        with self._lock:
+            self._wakers.remove(wake)
+
+
+def wait_until(condition, timeout = 20, backoff: Backoff = None, cancel: CancelToken = None, wake: threading.Event = None) -> bool:
+    '''
+    loop/poll on boolean function condition() until it's True
+    timeout - seconds or a (shared) Deadline
+    backoff - poll intervals, default Backoff()
+    cancel - CancelToken to give up early (returns False)
+    wake - event set by an external source (serial pattern match, port probe...)
+           to check condition() right away instead of at the next poll
+
+    returns True/False depending on condition met or timed out/cancelled
+    '''
+    deadline = Deadline.of(timeout)
+    if wake is None:
+        wake = threading.Event()
+    unlink = cancel.link(wake) if cancel is not None else None
+    try:
+        for interval in (backoff or Backoff()):
+            if cancel is not None and cancel.cancelled:
+                logging.info('Waiting cancelled')
+                return False
+            if condition():
+                return True
+            remaining = deadline.remaining()
+            if remaining is not None and remaining <= 0:
+                logging.warning('Waiting timed out')
+                return False
+            logging.debug(' waiting...')
+            if wake.wait(interval if remaining is None else min(interval, remaining)):
+                # wake may be what condition() looks at (e.g. a subscription event), check before clearing it
+                if condition():
+                    return True
+                wake.clear()
+    finally:
+        if unlink is not None:
+            unlink()
+
+
+def port_is_open(host: str, port: int, timeout: float = 1) -> bool:
+    '''TCP connect probe, True if host accepts connections on port'''
+    try:
+        with socket.create_connection((host, port), timeout):
+            return True
+    except OSError:
+        return False
+
+
 def poll_wait_while_true(condition, conditionFalseSeconds = 20, wait = 10):
     '''
     loop/poll on lambda boolean function condition()
@@ -47,35 +178,44 @@ def poll_wait_while_true(condition, conditionFalseSeconds = 20, wait = 10):
     exit loop when condition() is False for consecutive conditionFalseSeconds
     
     default conditionFalseSeconds is 20s
-    default time between polls is 5s
+    polls back off from 0.5s up to wait seconds (default 10s), restarting fast whenever condition() is True
 
     WARNING: possible infinite loop if condition() never becomes False
     '''
-    totalWait = 0
-    while totalWait < conditionFalseSeconds:
+    falseSince = None
+    intervals = iter(Backoff(maximum=wait))
+    while True:
         if condition():
-            totalWait = 0
-        else:
-            logging.info(' waiting...')
-            time.sleep(wait)
-            totalWait += wait
+            falseSince = None
+            intervals = iter(Backoff(maximum=wait))
+            continue
+        if falseSince is None:
+            falseSince = time.time()
+        falseSeconds = time.time() - falseSince
+        if falseSeconds >= conditionFalseSeconds:
+            return
+        logging.info(' waiting...')
+        time.sleep(min(next(intervals), conditionFalseSeconds - falseSeconds))
 
 def poll_wait_until(condition, maxWaitSeconds = 20, wait = 10) -> bool:
     '''
     loop/poll on lambda boolean function condition()
     continue until condition() is True,
-    exit loop on timeout maxWaitSeconds (default 20s)
-    default time between polls is 2s
+    exit loop on timeout maxWaitSeconds (default 20s, may also be a shared Deadline)
+    polls back off from 0.5s up to wait seconds (default 10s)
 
     returns True/False depending on conditon() met or timed out
     '''
-    totalWait = 0
-    while totalWait < maxWaitSeconds:
-        if condition():
-            return True
-        else:
-            logging.info(' waiting...')
-            time.sleep(wait)
-            totalWait += wait
-    logging.warn(f'Waiting timed out after {maxWaitSeconds} seconds')
-    return False
\ No newline at end of file
+    if wait_until(condition, maxWaitSeconds, Backoff(maximum=wait)):
+        return True
+    if not isinstance(maxWaitSeconds, Deadline):
+        logging.warn(f'Waiting timed out after {maxWaitSeconds} seconds')
+    return False
+
+def rig_config_file(rig: str) -> str:
+    '''INI file of a rig given as device name (ORION -> ORION.INI) or as INI file (ORION_2.INI)'''
+    return rig if rig.upper().endswith('.INI') else rig.upper() + '.INI'
+
+def rig_name(configFile: str) -> str:
+    '''rig name from its INI file, e.g. ORION_2'''
+    return os.path.splitext(os.path.basename(configFile))[0].upper()